@@ -4,16 +4,86 @@ import os
 import shutil
 import pwd
 import json
-from tempuscator.exceptions import BackupFileCorrupt, DirectoryNotEmpty, BackupCreateError
-from typing import Union
+import tempfile
+import dataclasses
+from tempuscator.remover import get_remover
+from tempuscator.exceptions import BackupFileCorrupt, DirectoryNotEmpty, BackupCreateError, ChainError, UploadError
+from tempuscator.xbstream import XbstreamReader
+from tempuscator.streamer import RemoteSink, StreamTee
+from tempuscator.transfer import ChunkedTransfer
+from tempuscator.journal import StageJournal, file_fingerprint
+from tempuscator.resources import ResourceProfile, format_size
+from tempuscator.metrics import Metrics
+from tempuscator.filters import SchemaFilter
+from tempuscator.chain import BackupChain, read_checkpoints, backup_kind, TYPE_FULL
+from tempuscator.datacache import PreparedCache
+from typing import List, Union
 from tempuscator.constants import (
     XBSTREAM_PATH,
     XTRABACKUP_PATH,
-    SCP_PATH
+    SCP_PATH,
+    CODEC_SUFFIXES,
+    COMPRESS_DEFAULT
 )
 
 _logger = logging.getLogger(__name__)
 
+# Longest list of file names passed to xbstream -x
+MAX_EXTRACT_ARGS = 512 << 10
+
+# Codec: (decompress while streaming, decompress threads per parallel thread)
+EXTRACT_PLANS = {
+    "none": (False, 0),
+    "qpress": (False, 1),
+    "lz4": (True, 0.5),
+    "zstd": (True, 1),
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class ExtractPlan():
+    """
+    Extraction plan for xbstream archive
+
+    :param str codec: detected compression codec
+    :param bool stream_decompress: decompress with xbstream while extracting
+    :param bool post_decompress: decompress with xtrabackup after extracting
+    :param int parallel: xbstream/xtrabackup parallel threads
+    :param int decompress_threads: threads used for decompression
+    """
+    codec: str
+    stream_decompress: bool
+    post_decompress: bool
+    parallel: int
+    decompress_threads: int
+
+    @classmethod
+    def for_codec(cls, codec: str, parallel: int) -> "ExtractPlan":
+        stream, factor = EXTRACT_PLANS[codec]
+        return cls(
+            codec=codec,
+            stream_decompress=stream,
+            post_decompress=codec != "none" and not stream,
+            parallel=parallel,
+            decompress_threads=max(1, int(parallel * factor)) if factor else 0)
+
+
+def detect_codec(path: str, chunks: int = 256) -> str:
+    """
+    Detect compression codec from xbstream chunk headers
+
+    :param str path: path to xbstream archive
+    :param int chunks: number of chunk headers to inspect
+
+    :returns: qpress, lz4, zstd or none
+    """
+    with open(path, "rb") as f:
+        for chunk in XbstreamReader(stream=f).chunks(limit=chunks):
+            ext = os.path.splitext(chunk.path)[1]
+            if ext in CODEC_SUFFIXES:
+                return CODEC_SUFFIXES[ext]
+    return "none"
+
 
 class BackupProcessor():
     """
@@ -30,7 +100,13 @@ class BackupProcessor():
             user: Union[str, int] = os.getuid(),
             group: Union[str, int] = os.getgid(),
             logger_name: str = "Obfuscator",
-            save_archive: str = None) -> None:
+            save_archive: str = None,
+            resume: bool = False,
+            profile: ResourceProfile = None,
+            metrics: Metrics = None,
+            schema_filter: SchemaFilter = None,
+            chain: BackupChain = None,
+            cache: PreparedCache = None) -> None:
         self._log_level = _logger.getEffectiveLevel()
         self.target = target
         self.source = source
@@ -40,17 +116,43 @@ class BackupProcessor():
         self.group = group
         self.remove_backup = remove_backup
         self.save_archive = save_archive
-        if not os.path.isfile(self.source):
+        self.plan = None
+        self.profile = profile
+        self.metrics = metrics or Metrics()
+        self.schema_filter = schema_filter or SchemaFilter()
+        self.chain = chain
+        if self.chain and self.schema_filter.enabled:
+            _logger.warning("Schema filter is ignored for backup chains, base must stay complete")
+            self.schema_filter = SchemaFilter()
+        self.cache = None if self.chain else cache
+        self.cache_key = None
+        self.cache_hit = False
+        self.journal = StageJournal()
+        fingerprint = file_fingerprint(self.source)
+        if resume and not self.force and os.path.isdir(self.target):
+            self.journal = StageJournal(directory=self.target, fingerprint=fingerprint)
+            if self.journal.stale or not self.journal.stages:
+                # Crash before first completed stage leaves partial target, start over
+                if os.listdir(self.target):
+                    _logger.warning(f"No completed stages for {self.target}, clearing it")
+                    self.__clear_target()
+                if self.journal.exists():
+                    os.remove(self.journal.path)
+                self.journal = StageJournal()
+        resuming = self.journal.exists() and bool(self.journal.stages)
+        if not resuming and not os.path.isfile(self.source):
             raise FileNotFoundError(f"Backup {self.source} not found, or not regular file")
         if self.force:
             if os.path.exists(self.target):
                 _logger.debug(f"Removing {self.target}")
-                shutil.rmtree(path=self.target)
-            if os.path.exists(self.save_archive):
+                get_remover().remove(self.target)
+            if self.save_archive and os.path.exists(self.save_archive):
                 _logger.debug(f"Removing: {self.save_archive}")
                 os.remove(self.save_archive)
         if os.path.isfile(path=self.target):
             raise FileExistsError(f"Destination {self.target} is regulara file, it should be empty dir or non existing path")
+        if resuming:
+            return
         if self.save_archive and os.path.exists(self.save_archive):
             raise FileExistsError(f"Destination {self.save_archive} already exists, not overwriting")
         if not os.path.exists(path=self.target):
@@ -63,25 +165,86 @@ class BackupProcessor():
             empty = os.listdir(path=self.target)
             if len(empty) != 0:
                 raise DirectoryNotEmpty(f"Directory {self.target} not empty")
+        if resume:
+            # Journal exists from the start, so partial extract is recognized as ours
+            self.journal = StageJournal(directory=self.target, fingerprint=fingerprint)
+            self.journal.reset()
+
+    def __clear_target(self) -> None:
+        for name in os.listdir(self.target):
+            path = os.path.join(self.target, name)
+            if name == os.path.basename(self.journal.path):
+                continue
+            _logger.debug(f"Removing: {path}")
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
 
     def __str__(self):
-        return json.dumps(self.__dict__, indent=2)
+        return json.dumps(self.__dict__, indent=2, default=str)
+
+    def plan_extract(self) -> ExtractPlan:
+        """
+        Inspect archive and choose extraction plan which decompresses once
+        """
+        codec = detect_codec(path=self.source)
+        self.plan = ExtractPlan.for_codec(codec=codec, parallel=int(self.parallel))
+        _logger.info(
+            f"Extract plan: codec={self.plan.codec} "
+            f"stream_decompress={self.plan.stream_decompress} "
+            f"post_decompress={self.plan.post_decompress} "
+            f"parallel={self.plan.parallel} "
+            f"decompress_threads={self.plan.decompress_threads}")
+        return self.plan
 
     def extract(self, debug: bool = False) -> None:
         """
         Extract xtrabackup backup file
         """
+        if self.cache and os.path.isfile(self.source):
+            self.cache_key = self.cache.key(source=self.source, variant=str(self.schema_filter))
+        if not self.journal.done("extract"):
+            if self.chain:
+                self.__apply_chain(debug=debug)
+            elif not (self.cache_key and self.__clone_cached()):
+                self.__extract(debug=debug)
+            self.journal.complete("extract")
+        xtrabackup_info = os.path.join(self.target, "xtrabackup_info")
+        if not os.path.isfile(xtrabackup_info):
+            if self.plan and not self.plan.post_decompress:
+                _logger.warning("Files left compressed after extract, decompressing")
+            with self.metrics.stage("decompress"):
+                self.decompress(debug=debug)
+        if self.remove_backup and os.path.isfile(self.source):
+            log_msg = f"Removing {self.source}" if self._log_level <= 10 else "Removing source backup"
+            _logger.log(self._log_level, log_msg)
+            os.remove(self.source)
+
+    def __extract(self, debug: bool = False) -> None:
+        plan = self.plan or self.plan_extract()
+        if self.journal.enabled:
+            self.__clear_target()
         _logger.info(f"Extracting backup to {self.target}")
         cli = [XBSTREAM_PATH]
         cli.append("-x")
         cli.append("--directory")
         cli.append(self.target)
-        cli.append("--decompress")
-        cli.append(f"--decompress-threads={self.parallel}")
+        if plan.stream_decompress:
+            cli.append("--decompress")
+            cli.append(f"--decompress-threads={plan.decompress_threads}")
         cli.append("--parallel")
-        cli.append(str(self.parallel))
+        cli.append(str(plan.parallel))
         if debug:
             cli.append("--verbose")
+        prune = False
+        if self.schema_filter.enabled:
+            paths = self.selected_paths()
+            if sum(len(p) + 1 for p in paths) < MAX_EXTRACT_ARGS:
+                cli.extend(paths)
+            else:
+                _logger.info("Too many selected files for xbstream arguments, extracting everything and pruning")
+                prune = True
         with open(self.source, 'r') as backup:
             _logger.debug(f"Executing: {' '.join(cli)}")
             extract = subprocess.Popen(cli, stdin=backup, user=self.user, group=self.group)
@@ -89,36 +252,132 @@ class BackupProcessor():
             _logger.debug(f"Extract return code: {extract.returncode}")
             if not extract.returncode == 0:
                 raise BackupFileCorrupt(f"File {self.source} looks like corruptted, try another")
-        if self.remove_backup and extract.returncode == 0:
-            log_msg = f"Removing {self.source}" if self._log_level <= 10 else "Removing source backup"
-            _logger.log(self._log_level, log_msg)
-            os.remove(self.source)
+        if prune:
+            self.__prune()
 
-    def prepare(self, debug: bool = False) -> None:
+    def __clone_cached(self) -> bool:
+        if self.journal.enabled:
+            self.__clear_target()
+        self.cache_hit = self.cache.clone(key=self.cache_key, target=self.target)
+        self.metrics.inc("prepared_cache_lookups_total", help="Prepared datadir cache lookups", result="hit" if self.cache_hit else "miss")
+        if self.cache_hit:
+            self.journal.complete("prepare")
+        return self.cache_hit
+
+    def __apply_chain(self, debug: bool = False) -> None:
+        checkpoints = read_checkpoints(self.source)
+        if checkpoints is None:
+            raise ChainError(f"Backup {self.source} has no xtrabackup_checkpoints, can't add it to chain")
+        kind = backup_kind(checkpoints)
+        with self.chain.lock():
+            self.chain.check(checkpoints)
+            staging = self.chain.staging if kind == TYPE_FULL else self.chain.incoming
+            if os.path.exists(staging):
+                get_remover().remove(staging)
+            _logger.info(f"Applying {kind} backup {os.path.basename(self.source)} to chain {self.chain.directory}")
+            part = BackupProcessor(
+                source=self.source,
+                target=staging,
+                parallel=self.parallel,
+                user=self.user,
+                group=self.group,
+                profile=self.profile,
+                metrics=self.metrics)
+            part.extract(debug=debug)
+            if kind == TYPE_FULL:
+                returncode = self.__prepare(target_dir=staging, debug=debug, apply_log_only=True)
+                if returncode != 0:
+                    get_remover().remove(staging)
+                    raise BackupFileCorrupt(f"Unable to prepare full backup {self.source} for chain")
+                self.chain.promote()
+            else:
+                returncode = self.__prepare(target_dir=self.chain.base, debug=debug, apply_log_only=True, incremental_dir=staging)
+                get_remover().remove(staging)
+                if returncode != 0:
+                    self.chain.invalidate()
+                    raise ChainError(f"Unable to apply incremental backup {self.source}, chain needs new full backup")
+            self.chain.record(source=self.source, checkpoints=checkpoints)
+            self.metrics.gauge("chain_to_lsn", self.chain.to_lsn, help="Last LSN applied to backup chain base")
+            if self.journal.enabled:
+                self.__clear_target()
+            self.chain.materialize(target=self.target)
+
+    def selected_paths(self) -> List[str]:
+        """
+        Files of archive selected by schema filter, in stream order
+        """
+        paths = {}
+        with open(self.source, "rb") as f:
+            for chunk in XbstreamReader(stream=f).chunks():
+                paths.setdefault(chunk.path, None)
+        selected = [p for p in paths if self.schema_filter.path_selected(p)]
+        _logger.info(f"Schema filter {self.schema_filter}: extracting {len(selected)} of {len(paths)} files")
+        return selected
+
+    def __prune(self) -> None:
+        for root, _, files in os.walk(self.target):
+            for name in files:
+                path = os.path.join(root, name)
+                if not self.schema_filter.path_selected(os.path.relpath(path, self.target)):
+                    os.remove(path)
+
+    def prepare(self, debug: bool = False, apply_log_only: bool = False, incremental_dir: str = None) -> None:
         """
         Prepare extracted backup
+
+        :param bool debug: show xtrabackup output
+        :param bool apply_log_only: skip rollback, more incremental backups will be applied
+        :param str incremental_dir: extracted incremental backup to apply on target
         """
+        if self.cache_hit or self.journal.done("prepare"):
+            return
+        returncode = self.__prepare(
+            target_dir=self.target,
+            debug=debug,
+            apply_log_only=apply_log_only,
+            incremental_dir=incremental_dir)
+        if returncode == 0:
+            self.journal.complete("prepare")
+            if self.cache_key:
+                try:
+                    self.cache.store(key=self.cache_key, source=self.target)
+                except OSError as e:
+                    _logger.warning(f"Unable to cache prepared datadir: {e}")
+
+    def __prepare(self, target_dir: str, debug: bool = False, apply_log_only: bool = False, incremental_dir: str = None) -> int:
         output = None if debug else subprocess.DEVNULL
-        _logger.info(f"Preparing restored backup in {self.target}")
+        _logger.info(f"Preparing restored backup in {target_dir}")
         cli = [XTRABACKUP_PATH]
         cli.append("--prepare")
+        if apply_log_only:
+            cli.append("--apply-log-only")
+        if self.profile:
+            cli.append(f"--use-memory={format_size(self.profile.prepare_memory)}")
+            cli.append(f"--parallel={self.profile.prepare_parallel}")
         cli.append("--target-dir")
-        cli.append(self.target)
+        cli.append(target_dir)
+        if incremental_dir:
+            cli.append("--incremental-dir")
+            cli.append(incremental_dir)
         _logger.debug(f"Executing: {' '.join(cli)}")
         prepare = subprocess.Popen(cli, stderr=output, user=self.user, group=self.group)
         prepare.wait()
         _logger.debug(f"Prepare exit code: {prepare.returncode}")
+        return prepare.returncode
 
     def decompress(self, debug: bool = False) -> None:
         """
         Decompress extracted files
         """
+        if self.journal.done("decompress"):
+            return
         output = None if debug else subprocess.DEVNULL
         _logger.info("Decompressing files")
+        threads = self.plan.decompress_threads if self.plan and self.plan.decompress_threads else self.parallel
         cli = [XTRABACKUP_PATH]
         cli.append("--decompress")
         cli.append("--parallel")
-        cli.append(str(self.parallel))
+        cli.append(str(threads))
         cli.append("--remove-original")
         cli.append("--target-dir")
         cli.append(self.target)
@@ -126,47 +385,134 @@ class BackupProcessor():
         decompress = subprocess.Popen(cli, stderr=output, user=self.user, group=self.group)
         decompress.wait()
         _logger.debug(f"Decompress exit status: {decompress.returncode}")
+        if decompress.returncode == 0:
+            self.journal.complete("decompress")
 
     def create(
             self,
             dst: str,
             debug: bool = False,
-            socket: str = "/var/lib/mysql/mysql.sock") -> None:
+            socket: str = "/var/lib/mysql/mysql.sock",
+            sinks: List[RemoteSink] = None,
+            compress: str = COMPRESS_DEFAULT,
+            compress_level: int = None) -> List[RemoteSink]:
         """
         Create xtrabackup compressed archive (xbstream)
+
+        :param str dst: local archive path, can be None when streaming to sinks
+        :param bool debug: show xtrabackup output
+        :param str socket: mysqld socket
+        :param list sinks: remote sinks to stream archive to while it is created
+        :param str compress: none, quicklz, lz4, zstd or default codec of xtrabackup
+        :param int compress_level: zstd compression level
+
+        :returns: list of sinks which failed to receive whole archive
         """
+        if self.journal.done("create"):
+            return []
         _logger.info("Creating xbstream archive")
         _logger.debug(f"Force: {self.force}")
         output = None if debug else subprocess.DEVNULL
-        target_dir = "/tmp/xtrabackup_backupfiles/"
-        if self.force and os.path.exists(dst):
+        if not dst and not sinks:
+            raise ValueError("Local archive path or remote sinks required")
+        if self.force and dst and os.path.exists(dst):
             _logger.warning(f"Removing {dst}")
             os.remove(dst)
+        # Own temporary directory, concurrent jobs can create archives at the same time
+        target_dir = tempfile.mkdtemp(prefix="xtrabackup_backupfiles_")
+        if isinstance(self.user, str):
+            user = pwd.getpwnam(self.user)
+            os.chown(path=target_dir, uid=user.pw_uid, gid=user.pw_gid)
+        try:
+            return self.__create(
+                dst=dst,
+                socket=socket,
+                sinks=sinks,
+                output=output,
+                target_dir=target_dir,
+                compress=compress,
+                compress_level=compress_level)
+        finally:
+            shutil.rmtree(target_dir, ignore_errors=True)
+
+    def __create(
+            self,
+            dst: str,
+            socket: str,
+            sinks: List[RemoteSink],
+            output,
+            target_dir: str,
+            compress: str = COMPRESS_DEFAULT,
+            compress_level: int = None) -> List[RemoteSink]:
         cli = [XTRABACKUP_PATH]
         cli.append("--backup")
         cli.append("--target-dir")
         cli.append(target_dir)
         cli.append("--stream")
-        cli.append("--compress")
         cli.append("--parallel")
         cli.append(str(self.parallel))
-        cli.append("--compress-threads")
-        cli.append(str(self.parallel))
+        if compress != "none":
+            cli.append("--compress" if compress == COMPRESS_DEFAULT else f"--compress={compress}")
+            cli.append("--compress-threads")
+            cli.append(str(self.parallel))
+            if compress == "zstd" and compress_level:
+                cli.append(f"--compress-zstd-level={compress_level}")
         cli.append("--socket")
         cli.append(socket)
         cli.append(f"--datadir={self.target}")
+        tables = self.schema_filter.tables_regex()
+        if tables:
+            cli.append(f"--tables={tables}")
+        tables_exclude = self.schema_filter.tables_exclude_regex()
+        if tables_exclude:
+            cli.append(f"--tables-exclude={tables_exclude}")
         _logger.debug(f"Executing: {' '.join(cli)}")
+        if sinks:
+            failed = self.__create_streaming(cli=cli, dst=dst, sinks=sinks, output=output)
+            self.journal.complete("create")
+            return failed
         with open(dst, 'wb') as archive:
             backup = subprocess.Popen(cli, stdout=archive, stderr=output, user=self.user, group=self.group)
             backup.communicate()
         _logger.debug(f"Return code: {backup.returncode}")
         if backup.returncode > 0:
             raise BackupCreateError
+        self.journal.complete("create")
+        return []
+
+    def __create_streaming(self, cli: List[str], dst: str, sinks: List[RemoteSink], output) -> List[RemoteSink]:
+        _logger.info(f"Streaming archive to: {', '.join(str(s) for s in sinks)}")
+        archive = open(dst, 'wb') if dst else None
+        try:
+            backup = subprocess.Popen(cli, stdout=subprocess.PIPE, stderr=output, user=self.user, group=self.group)
+            failed = StreamTee(sinks=sinks, local=archive).run(stream=backup.stdout)
+            backup.wait()
+        finally:
+            if archive:
+                archive.close()
+        _logger.debug(f"Return code: {backup.returncode}")
+        if backup.returncode > 0:
+            raise BackupCreateError
+        for sink in failed:
+            _logger.warning(f"Streaming to {sink} failed")
+        return failed
+
+    def stream_sinks(self, hosts: List[str], user: str, dst: str) -> List[RemoteSink]:
+        """
+        Remote sinks for streaming archive during create
+
+        :param list hosts: addresses of remote servers
+        :param str user: ssh user
+        :param str dst: remote file path
+        """
+        return [RemoteSink(host=h, user=user, dst=dst, os_user=self.user, os_group=self.group) for h in hosts]
 
     def cleanup_backup_files(self) -> None:
         """
         Remove not needed files and rotate certificates
         """
+        if self.journal.done("cleanup_backup_files"):
+            return
         _logger.info("Cleaning not needed files")
         files = [
             "auto.cnf",
@@ -191,6 +537,7 @@ class BackupProcessor():
             _logger.debug(f"Removing: {remove_file}")
             if os.path.isfile(remove_file):
                 os.remove(remove_file)
+        self.journal.complete("cleanup_backup_files")
 
     def uploader(
             self,
@@ -198,10 +545,25 @@ class BackupProcessor():
             user: str,
             src: str,
             dst: str,
-            progress: bool = False) -> None:
+            progress: bool = False,
+            streams: int = 1,
+            chunk_size: int = 256 << 20) -> None:
         """
         Upload new archive to destination server
+
+        :param int streams: concurrent ssh streams, 1 uses single scp
+        :param int chunk_size: bytes sent by one stream
         """
+        if streams > 1:
+            transfer = ChunkedTransfer(
+                host=host,
+                user=user,
+                streams=streams,
+                chunk_size=chunk_size,
+                os_user=self.user,
+                os_group=self.group)
+            transfer.send(src=src, dst=dst)
+            return
         _logger.info(f"Uploading file: {src} to {host}:{dst}")
         output = None if progress else subprocess.DEVNULL
         cli = [SCP_PATH]
@@ -216,6 +578,8 @@ class BackupProcessor():
         _logger.debug(f"Executing: {' '.join(cli)}")
         upload = subprocess.Popen(cli, stdout=output, user=self.user, group=self.group)
         upload.communicate()
+        if upload.returncode != 0:
+            raise UploadError(f"Upload of {src} to {host} failed with code {upload.returncode}")
 
     def cleanup(self) -> None:
         """
@@ -223,4 +587,4 @@ class BackupProcessor():
         """
         _logger.info("Cleaning up")
         _logger.debug(f"Removing: {self.target}")
-        shutil.rmtree(self.target)
+        get_remover().remove(self.target)
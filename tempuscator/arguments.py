@@ -1,6 +1,8 @@
 import argparse
 import os
 import logging
+from tempuscator.constants import COMPRESS_CODECS, COMPRESS_DEFAULT, DEFAULT_PREPARED_CACHE_SIZE, DEFAULT_SCRIPT_CACHE, EXTRACT_AUTO, GRANTS_NATIVE, GRANTS_PT, MYSQLD_PATH
+from tempuscator.grants import DEFAULT_SOCKET
 
 
 def base_args() -> argparse.ArgumentParser:
@@ -33,6 +35,22 @@ def base_args() -> argparse.ArgumentParser:
         help="Force remove and recreate target directory",
         action="store_true"
     )
+    base.add_argument(
+        "--metrics-dir",
+        help="node_exporter textfile collector directory for prometheus metrics",
+        type=str
+    )
+    base.add_argument(
+        "--remove-workers",
+        help="Directories removed in parallel in background, default: %(default)s",
+        type=int,
+        default=2
+    )
+    base.add_argument(
+        "--remove-io-budget",
+        help="Bytes per second freed by background removal, K/M/G suffix allowed, 0 - unlimited, default: %(default)s",
+        default="0"
+    )
     base.add_argument(
         "-c",
         "--config",
@@ -77,11 +95,106 @@ def obf_args() -> argparse.Namespace:
         help="Parallel parameter for xtrabackup",
         default=4
     )
+    archiver.add_argument(
+        "--include-schemas",
+        help="Comma separated schema or schema.table wildcard patterns to extract, mask and archive, system schemas are always kept, default: all"
+    )
+    archiver.add_argument(
+        "--exclude-schemas",
+        help="Comma separated schema or schema.table wildcard patterns to skip"
+    )
+    archiver.add_argument(
+        "--compress",
+        help="Archive compression codec, default: codec chosen by xtrabackup",
+        choices=(COMPRESS_DEFAULT,) + COMPRESS_CODECS,
+        default=COMPRESS_DEFAULT
+    )
+    archiver.add_argument(
+        "--compress-level",
+        help="Zstd compression level",
+        type=int
+    )
+    archiver.add_argument(
+        "--chain-dir",
+        help="Backup chain directory, full backups become prepared base and incremental backups are applied to it before masking"
+    )
+    archiver.add_argument(
+        "--prepared-cache",
+        help="Directory with prepared datadirs reused for the same backup, best on the target filesystem for reflinks"
+    )
+    archiver.add_argument(
+        "--prepared-cache-size",
+        help="Size of prepared datadir cache, K/M/G/T suffix allowed, default: %(default)s",
+        default=DEFAULT_PREPARED_CACHE_SIZE
+    )
+    archiver.add_argument(
+        "--resume",
+        help="Keep stage journal in target directory and continue from first unfinished stage",
+        action="store_true"
+    )
     obfuscator.add_argument(
         "--sql-file",
         help="Patgh to sql file",
         required=True
     )
+    obfuscator.add_argument(
+        "--script-cache",
+        help="Directory with parsed sql files, default: %(default)s",
+        default=DEFAULT_SCRIPT_CACHE
+    )
+    obfuscator.add_argument(
+        "--shutdown-mode",
+        help="Temporary mysqld shutdown: slow, clean, fast (skip flush) or kill, default: %(default)s",
+        choices=["slow", "clean", "fast", "kill"],
+        default="fast"
+    )
+    obfuscator.add_argument(
+        "--mask-workers",
+        help="Number of tables masked in parallel, default: %(default)s",
+        type=int,
+        default=4
+    )
+    obfuscator.add_argument(
+        "--mask-max-in-flight",
+        help="Global limit of masking queries running at the same time, default: mask workers",
+        type=int
+    )
+    obfuscator.add_argument(
+        "--mask-order",
+        help="table - parallel by table and serial inside table, serial - one query at a time in file order, default: %(default)s",
+        choices=["table", "serial"],
+        default="table"
+    )
+    obfuscator.add_argument(
+        "--mask-chunk-rows",
+        help="Split single table UPDATE/DELETE to primary key ranges of this many rows, 0 disables, default: %(default)s",
+        type=int,
+        default=0
+    )
+    obfuscator.add_argument(
+        "--mask-history",
+        help="Json file with masking query timings, used to dispatch longest queries first and updated after run"
+    )
+    obfuscator.add_argument(
+        "--plan-only",
+        help="Start mysqld, print estimated masking schedule and busiest worker and exit without masking",
+        action="store_true"
+    )
+    obfuscator.add_argument(
+        "--profile",
+        help="Record wall time, affected rows and InnoDB counters of every masking query",
+        action="store_true"
+    )
+    obfuscator.add_argument(
+        "--profile-report",
+        help="Write slowest masking queries to this file, .json extension writes json, otherwise text table"
+    )
+    obfuscator.add_argument(
+        "--profile-top",
+        help="Number of slowest masking queries in profile report, default: %(default)s",
+        type=int,
+        default=20
+    )
     ssh_args.add_argument(
         "--host",
         type=str,
@@ -97,6 +210,22 @@ def obf_args() -> argparse.Namespace:
         type=str,
         help="File path were to put file"
     )
+    ssh_args.add_argument(
+        "--stream-upload",
+        help="Stream archive to host while it is created instead of uploading afterwards",
+        action="store_true"
+    )
+    ssh_args.add_argument(
+        "--upload-streams",
+        help="Concurrent ssh streams sending archive chunks, 1 uses single scp, default: %(default)s",
+        type=int,
+        default=1
+    )
+    ssh_args.add_argument(
+        "--upload-chunk-size",
+        help="Bytes sent by one stream, K/M/G suffix allowed, default: %(default)s",
+        default="256M"
+    )
     return args.parse_args()
 
 
@@ -139,9 +268,15 @@ def swap_args() -> argparse.Namespace:
     )
     archiver.add_argument(
         "--extract-dir",
-        help="Where to extract files, default: %(default)s",
+        help="Where to extract files, auto - next to system datadir on the same filesystem, default: %(default)s",
         type=str,
-        default="/tmp/swapper",
+        default=EXTRACT_AUTO,
+    )
+    swapper.add_argument(
+        "--copy-workers",
+        help="Files copied in parallel when extract dir is on other filesystem than datadir, default: %(default)s",
+        type=int,
+        default=8
     )
     archiver.add_argument(
         "--remove-backup",
@@ -153,6 +288,153 @@ def swap_args() -> argparse.Namespace:
         help="Leave backup directory of previuos mysql version",
         action="store_true"
     )
+    mysql.add_argument(
+        "--mysql-socket",
+        type=str,
+        help="Socket of system mysql, default: client socket from ~/.my.cnf or %(default)s",
+        default=DEFAULT_SOCKET
+    )
+    swapper.add_argument(
+        "--grants-source",
+        help="Grant export: native or pt-show-grants, default: %(default)s",
+        choices=[GRANTS_NATIVE, GRANTS_PT],
+        default=GRANTS_NATIVE
+    )
+    swapper.add_argument(
+        "--grants-workers",
+        help="Accounts exported in parallel, default: %(default)s",
+        type=int,
+        default=4
+    )
+    swapper.add_argument(
+        "--grants-cache",
+        help="Directory for exported grants reused while grant tables don't change, disabled by default"
+    )
+    swapper.add_argument(
+        "--grants-ignore",
+        help="Comma separated user@host patterns not copied, default: %(default)s",
+        default="root@localhost"
+    )
+    swapper.add_argument(
+        "--grants-include",
+        help="Comma separated user@host patterns copied, default: all"
+    )
+    return args.parse_args()
+
+
+def codec_bench_args() -> argparse.Namespace:
+    args = base_args()
+    bench = args.add_argument_group(title="Bench", description="Compression codec benchmark")
+    bench.add_argument(
+        "--datadir",
+        help="Prepared datadir to sample",
+        required=True
+    )
+    bench.add_argument(
+        "--sample-size",
+        help="Bytes compressed with every codec, K/M/G suffix allowed, default: %(default)s",
+        default="256M"
+    )
+    bench.add_argument(
+        "--bandwidth",
+        help="Upload bandwidth in bytes per second, K/M/G suffix allowed, default: %(default)s",
+        default="100M"
+    )
+    bench.add_argument(
+        "--threads",
+        help="Compress threads used by xtrabackup, default: %(default)s",
+        type=int,
+        default=int(os.sysconf('SC_NPROCESSORS_ONLN'))
+    )
+    bench.add_argument(
+        "--codecs",
+        help="Comma separated codecs to compare, default: %(default)s",
+        default=",".join(COMPRESS_CODECS)
+    )
+    bench.add_argument(
+        "--zstd-levels",
+        help="Comma separated zstd levels to compare, default: %(default)s",
+        default="1,3,6,9"
+    )
+    return args.parse_args()
+
+
+def benchmark_args() -> argparse.Namespace:
+    args = base_args()
+    bench = args.add_argument_group(title="Benchmark", description="Pipeline benchmark with stand-in xtrabackup tools")
+    bench.add_argument(
+        "--scenarios",
+        help="Comma separated scenarios: backup, masking, watcher, default: %(default)s",
+        default="backup,masking,watcher"
+    )
+    bench.add_argument(
+        "--work-dir",
+        help="Directory for benchmark files, default: temporary directory"
+    )
+    bench.add_argument(
+        "--output",
+        help="JSON results file, default: stdout"
+    )
+    bench.add_argument(
+        "--backup-size",
+        help="Size of generated xbstream archive, K/M/G suffix allowed, default: %(default)s",
+        default="256M"
+    )
+    bench.add_argument(
+        "--archive-size",
+        help="Size of archive written by fake xtrabackup --backup, default: %(default)s",
+        default="64M"
+    )
+    bench.add_argument(
+        "--xbstream-throughput",
+        help="Bytes per second of fake xbstream, 0 - unlimited, default: %(default)s",
+        default="1G"
+    )
+    bench.add_argument(
+        "--xtrabackup-throughput",
+        help="Bytes per second of fake xtrabackup, 0 - unlimited, default: %(default)s",
+        default="1G"
+    )
+    bench.add_argument(
+        "--scp-throughput",
+        help="Bytes per second of fake scp, 0 - unlimited, default: %(default)s",
+        default="100M"
+    )
+    bench.add_argument(
+        "--tool-latency",
+        help="Seconds before fake tool starts working, default: %(default)s",
+        type=float,
+        default=0.05
+    )
+    bench.add_argument(
+        "--mysqld",
+        help="Mysqld used for masking and watcher scenarios, default: %(default)s",
+        default=MYSQLD_PATH
+    )
+    bench.add_argument(
+        "--tables",
+        help="Synthetic tables, default: %(default)s",
+        type=int,
+        default=4
+    )
+    bench.add_argument(
+        "--rows",
+        help="Rows per synthetic table, default: %(default)s",
+        type=int,
+        default=100000
+    )
+    bench.add_argument(
+        "--mask-workers",
+        help="Masking workers, default: %(default)s",
+        type=int,
+        default=4
+    )
+    bench.add_argument(
+        "--mask-chunk-rows",
+        help="Rows per masking chunk, 0 - no chunking, default: %(default)s",
+        type=int,
+        default=0
+    )
     return args.parse_args()
 
 
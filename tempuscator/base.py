@@ -5,14 +5,36 @@ import json
 import inotify.adapters
 import uuid
 import time
-import threading
+from typing import Callable, Optional
 from tempuscator.executor import Obfuscator
 from tempuscator.engines import MysqlData
 from tempuscator.swapper import SwapDirs
 from tempuscator.exceptions import MissingConfigSection, NotARoot
 from tempuscator.archiver import BackupProcessor
+from tempuscator.chain import BackupChain
+from tempuscator.datacache import PreparedCache
+from tempuscator.uploads import UploadScheduler
 from tempuscator.repo import Scruber
-from tempuscator.constants import CLOSE_WRITE_MASK
+from tempuscator.jobs import Job, JobQueue
+from tempuscator.resources import ResourceProfile, load_overrides, parse_size
+from tempuscator.metrics import Metrics
+from tempuscator.profiler import Profiler
+from tempuscator.planner import CostPlanner
+from tempuscator.filters import SchemaFilter, split_patterns
+from tempuscator.grants import DEFAULT_SOCKET
+from tempuscator.constants import (
+    CLOSE_WRITE_MASK,
+    COMPRESS_DEFAULT,
+    DEFAULT_GRANTS_CACHE,
+    DEFAULT_PREPARED_CACHE_SIZE,
+    DEFAULT_QUEUE_DIR,
+    DEFAULT_REPO_CACHE,
+    DEFAULT_SCRIPT_CACHE,
+    EXTRACT_AUTO,
+    GRANTS_NATIVE,
+    SWAP_DST_DIR,
+    SHUTDOWN_FAST
+)
 
 _logger = logging.getLogger(__name__)
 
@@ -26,8 +48,10 @@ class Watcher():
             swapper: SwapDirs = None,
             mysql: MysqlData = None,
             obfuscator: Obfuscator = None,
-            debug: bool = False) -> None:
+            debug: bool = False,
+            metrics: Metrics = None) -> None:
         self.debug = debug
+        self.metrics = metrics or Metrics()
         self.path = path
         self.swapper = swapper
         self.mysql = mysql
@@ -46,9 +70,37 @@ class Watcher():
             raise MissingConfigSection("Configuration missing section: obfuscator")
         self.conf: dict = raw_conf.__dict__.get("_sections")["obfuscator"]
         _logger.debug(f"config:\n{json.dumps(self.conf, indent=2)}")
+        self.workers = int(self.conf.get("workers", 1))
+        self.queue: JobQueue = None
+        self.resources = load_overrides(path=config)
+        self.uploads = UploadScheduler(
+            max_concurrent=int(self.conf.get("max_uploads", 2)),
+            max_backlog=int(self.conf.get("upload_backlog", 4)),
+            retries=int(self.conf.get("upload_retries", 3)),
+            backoff=float(self.conf.get("upload_backoff", 30)),
+            metrics=self.metrics)
+
+    def _job_queue(self, action: str, handler, workers: int) -> JobQueue:
+        """
+        Persistent job queue for action
+
+        :param str action: swap or obfuscate
+        :param handler: callable executed for every job
+        :param int workers: number of concurrent jobs
+        """
+        queue_dir = os.path.expanduser(self.conf.get("queue_dir", DEFAULT_QUEUE_DIR))
+        self.queue = JobQueue(
+            path=os.path.join(queue_dir, action),
+            handler=handler,
+            workers=workers,
+            retry_failed=self._conf_bool("resume"),
+            metrics=self.metrics)
+        self.queue.start()
+        return self.queue
 
     def watch_obfuscate(self) -> None:
         _logger.info("Starting obfuscator watcher")
+        jobs = self._job_queue(action="obfuscate", handler=self.__obfuscate_job, workers=self.workers)
         watcher = inotify.adapters.InotifyTree(path=self.path, mask=CLOSE_WRITE_MASK)
         for e in watcher.event_gen(yield_nones=False):
             (_, event, path, file) = e
@@ -57,7 +109,7 @@ class Watcher():
                 continue
             backup_file = os.path.join(path, file)
             _logger.info(f"Received: {backup_file}")
-            self.__run_obfuscate(backup=backup_file)
+            jobs.submit(backup=backup_file, action="obfuscate")
 
     def watch(self, action: str) -> None:
         """
@@ -72,6 +124,8 @@ class Watcher():
             raise ValueError(f"action emust be one from: {' '.join(actions)}")
         _logger.info("Starting directory watcher")
         _logger.debug(f"Watching: {self.path}")
+        # Swap replaces the single system datadir, jobs can't run concurrently
+        jobs = self._job_queue(action="swap", handler=self.__swap_job, workers=1)
         watch = inotify.adapters.InotifyTree(path=self.path, mask=CLOSE_WRITE_MASK)
         for e in watch.event_gen(yield_nones=False):
             (_, event, path, file) = e
@@ -80,61 +134,211 @@ class Watcher():
                 continue
             file = os.path.join(path, file)
             _logger.info(f"Received: {file}")
-            self.__run_swap(backup=file)
+            jobs.submit(backup=file, action="swap")
 
     def _random_str(self) -> str:
         return uuid.uuid4().hex[:8]
 
-    def __run_obfuscate(self, backup: str) -> None:
+    def _work_dir(self, job_id: str) -> str:
+        """
+        Work directory of job, every job gets own directory and mysqld socket
+
+        :param str job_id: job id, stable for the same backup
+        """
+        if "tmp_path" in self.conf.keys() and self.workers == 1:
+            return self.conf["tmp_path"]
+        return os.path.join(self.conf.get("tmp_dir", "/tmp/"), f"tempuscator-{job_id}")
+
+    def obfuscate(self, backup: str, job_id: str = None) -> None:
+        """
+        Run single obfuscation job synchronously, bypassing job queue
+
+        :param str backup: backup file
+        :param str job_id: job id, random by default
+        """
+        self.__run_obfuscate(backup=backup, job_id=job_id or self._random_str())
+
+    def __obfuscate_job(self, job: Job) -> None:
+        self.__run_obfuscate(backup=job.backup, job_id=job.id, current=job.current)
+
+    def __swap_job(self, job: Job) -> None:
+        self.__run_swap(backup=job.backup, job_id=job.id)
+
+    def _conf_bool(self, key: str, default: bool = False) -> bool:
+        if key not in self.conf.keys():
+            return default
+        return self.conf.get(key).strip().lower() in ("1", "yes", "true", "on")
+
+    def _prepared_cache(self) -> Optional[PreparedCache]:
+        cache_dir = self.conf.get("prepared_cache")
+        if not cache_dir:
+            return None
+        return PreparedCache(
+            directory=os.path.expanduser(cache_dir),
+            max_size=parse_size(self.conf.get("prepared_cache_size", DEFAULT_PREPARED_CACHE_SIZE)))
+
+    def _chain(self, backup: str) -> Optional[BackupChain]:
+        """
+        Backup chain of uploaded file, one chain per watched subdirectory
+
+        :param str backup: uploaded backup path
+        """
+        chain_dir = self.conf.get("chain_dir")
+        if not chain_dir:
+            return None
+        key = os.path.relpath(os.path.dirname(os.path.abspath(backup)), os.path.abspath(self.path))
+        if key == "." or key.startswith(".."):
+            key = "default"
+        return BackupChain(directory=os.path.join(chain_dir, key.replace(os.sep, "_")))
+
+    def __run_obfuscate(self, backup: str, job_id: str, current: Callable[[], bool] = None) -> None:
         start = time.perf_counter()
         repo_url = self.conf.get("repo")
-        repo_dst = os.path.join("/tmp/", self._random_str())
         scrub_file = self.conf.get("scrub_sql")
-        tmp_path = self.conf["tmp_path"] if "tmp_path" in self.conf.keys() else os.path.join("/tmp/", self._random_str())
+        tmp_path = self._work_dir(job_id=job_id)
         _logger.debug(f"Tmp path: {tmp_path}")
-        processor = BackupProcessor(source=backup, target=tmp_path)
+        resume = self._conf_bool("resume")
+        profile = ResourceProfile.detect(path=tmp_path, share=self.workers, overrides=self.resources)
+        schema_filter = SchemaFilter(
+            include=split_patterns(self.conf.get("include_schemas")),
+            exclude=split_patterns(self.conf.get("exclude_schemas")))
+        processor = BackupProcessor(
+            source=backup,
+            target=tmp_path,
+            resume=resume,
+            force=not resume,
+            profile=profile,
+            metrics=self.metrics,
+            schema_filter=schema_filter,
+            chain=self._chain(backup=backup),
+            cache=self._prepared_cache())
         _logger.debug(f"Backup procesor: {processor}")
-        mysql = MysqlData(datadir=tmp_path, debug=self.debug)
+        mask_workers = int(self.conf.get("mask_workers", 4))
+        mask_in_flight = int(self.conf.get("mask_max_in_flight", mask_workers))
+        mysql = MysqlData(
+            datadir=tmp_path,
+            debug=self.debug,
+            conn_pool_size=max(mask_workers, mask_in_flight),
+            profile=profile)
         _logger.debug(f"Mysql data: {mysql}")
-        scruber = Scruber(url=repo_url, dst=repo_dst, sql_file=scrub_file)
-        obfuscator = Obfuscator(scrub=scruber)
+        scruber = Scruber(
+            url=repo_url,
+            dst=None,
+            sql_file=scrub_file,
+            cache_dir=os.path.expanduser(self.conf.get("repo_cache", DEFAULT_REPO_CACHE)),
+            ttl=int(self.conf.get("repo_cache_ttl", 300)),
+            ref=self.conf.get("repo_ref"))
+        profiler = None
+        if self._conf_bool("profile"):
+            report = self.conf.get("profile_report")
+            if report and self.workers > 1:
+                # Job id before extension, report format is chosen by it
+                root, ext = os.path.splitext(report)
+                report = f"{root}.{job_id}{ext}"
+            profiler = Profiler(top=int(self.conf.get("profile_top", 20)), report=report)
+        obfuscator = Obfuscator(
+            scrub=scruber,
+            schema_filter=schema_filter,
+            script_cache=os.path.expanduser(self.conf.get("script_cache", DEFAULT_SCRIPT_CACHE)),
+            workers=mask_workers,
+            max_in_flight=mask_in_flight,
+            order=self.conf.get("mask_order", "table"),
+            chunk_rows=int(self.conf.get("mask_chunk_rows", 0)),
+            journal=processor.journal,
+            metrics=self.metrics,
+            profiler=profiler,
+            planner=CostPlanner(history=self.conf.get("mask_history")) if "mask_history" in self.conf.keys() else None)
         _logger.debug(f"Obfuscator: {obfuscator}")
-        save_path = self.conf.get("save_path")
+        dst_save_path = self.conf.get("save_path")
+        hosts = self.conf.get("scp_host").split(",") if "scp_host" in self.conf.keys() else []
+        # Concurrent jobs and background uploads can't share one local archive
+        save_path = dst_save_path if self.workers == 1 and not hosts else f"{dst_save_path}.{job_id}"
+        user = self.conf.get("ssh_user") if "ssh_user" in self.conf.keys() else os.environ["USER"]
+        dst_path = self.conf.get('scp_path') if "scp_path" in self.conf.keys() else dst_save_path
+        sinks = None
+        if hosts and self._conf_bool("stream_upload"):
+            sinks = processor.stream_sinks(hosts=hosts, user=user, dst=dst_path)
+        socket = None
+        success = False
         try:
-            processor.extract(debug=self.debug)
-            processor.prepare(debug=self.debug)
+            if os.path.isfile(backup):
+                self.metrics.gauge("bytes_in", os.path.getsize(backup), "Size of source backup")
+            with self.metrics.stage("extract"):
+                processor.extract(debug=self.debug)
+            with self.metrics.stage("prepare"):
+                processor.prepare(debug=self.debug)
             processor.cleanup_backup_files()
-            socket = mysql.start()
-            obfuscator.cleanup_system_users(engine=mysql.engine)
-            obfuscator.change_system_user_password(engine=mysql.engine, user="root", empty=True)
-            obfuscator.mask(engine=mysql.engine)
-            processor.create(dst=save_path, socket=socket, debug=self.debug)
+            with self.metrics.stage("mysqld_start"):
+                socket = mysql.start()
+            with self.metrics.stage("user_cleanup"):
+                obfuscator.cleanup_system_users(engine=mysql.engine)
+                obfuscator.change_system_user_password(engine=mysql.engine, user="root", empty=True)
+            if schema_filter.enabled:
+                with self.metrics.stage("schema_filter"):
+                    schema_filter.drop_unselected(engine=mysql.engine)
+            with self.metrics.stage("mask"):
+                obfuscator.mask(engine=mysql.engine)
+            with self.metrics.stage("create"):
+                failed = processor.create(
+                    dst=save_path,
+                    socket=socket,
+                    debug=self.debug,
+                    sinks=sinks,
+                    compress=self.conf.get("compress", COMPRESS_DEFAULT),
+                    compress_level=int(self.conf.get("compress_level", 0)) or None)
+            if os.path.isfile(save_path):
+                self.metrics.gauge("bytes_out", os.path.getsize(save_path), "Size of obfuscated archive")
+            success = True
         finally:
             if socket:
-                mysql.stop()
-            processor.cleanup()
-            _logger.debug(f"Removing: {backup}")
-            os.remove(backup)
+                # Datadir is archived already, no need for clean shutdown
+                with self.metrics.stage("mysqld_stop"):
+                    mysql.stop(mode=self.conf.get("shutdown_mode", SHUTDOWN_FAST))
+            if success or not resume:
+                processor.cleanup()
+                if current is None or current():
+                    _logger.debug(f"Removing: {backup}")
+                    os.remove(backup)
+                else:
+                    _logger.info(f"{backup} was replaced by new upload, keeping it for its own job")
+            else:
+                _logger.warning(f"Keeping {tmp_path} and {backup} for resume")
             end = time.perf_counter()
             execution_time = round((end - start)/60, 2)
             _logger.info(f"Execution time: {execution_time}")
-        if "scp_host" in self.conf.keys():
+        if sinks:
+            hosts = [s.host for s in failed]
+        if hosts:
             _logger.info("Uploading obfuscated backup")
-            hosts = self.conf.get("scp_host").split(",")
             _logger.debug(f"Uploading to {hosts}")
-            user = self.conf.get("ssh_user") if "ssh_user" in self.conf.keys() else os.environ["USER"]
-            dst_path = self.conf.get('scp_path') if "scp_path" in self.conf.keys() else save_path
-            u_thread = []
-            for host in hosts:
-                u_thread.append(threading.Thread(target=self.__run_upload, args=(processor, host, user, save_path, dst_path, )))
-            for t in u_thread:
-                t.start()
-            for j in u_thread:
-                j.join()
+            self.uploads.submit(
+                src=save_path,
+                hosts=hosts,
+                upload=lambda host: self.__run_upload(processor, host, user, save_path, dst_path),
+                done=lambda results: self.__uploads_done(save_path, dst_save_path, results))
+        else:
+            self.__keep_archive(save_path, dst_save_path)
+
+    def __keep_archive(self, save_path: str, dst_save_path: str) -> None:
+        """
+        Move per job archive to configured save_path, latest finished job wins
+        """
+        if save_path != dst_save_path and os.path.isfile(save_path):
+            _logger.debug(f"Moving {save_path} to {dst_save_path}")
+            os.replace(save_path, dst_save_path)
+
+    def __uploads_done(self, save_path: str, dst_save_path: str, results: dict) -> None:
+        """
+        Report failed hosts and keep local archive as save_path
+        """
+        failed = [h for h, ok in results.items() if not ok]
+        if failed:
+            _logger.error(f"Archive {save_path} wasn't uploaded to {', '.join(failed)}")
+        self.__keep_archive(save_path, dst_save_path)
 
     def __run_upload(self, uploader: BackupProcessor, host: str, user: str, src: str, dst: str) -> None:
         """
-        Threaded method for parallel uploader
+        Upload archive to single host, called by upload scheduler
 
         :param uploader: BackupProcessor class
         :param host: ip addres or hostname where to scp
@@ -142,10 +346,17 @@ class Watcher():
         :param src: source file path
         :param dst: destination path were to put file
 
-        :return: None
+        :raises UploadError: upload failed
         """
         _logger.debug(f"Starting uploading to {host}")
-        uploader.uploader(host=host, user=user, src=src, dst=dst)
+        with self.metrics.stage("upload", host=host):
+            uploader.uploader(
+                host=host,
+                user=user,
+                src=src,
+                dst=dst,
+                streams=int(self.conf.get("upload_streams", 1)),
+                chunk_size=parse_size(self.conf.get("upload_chunk_size", "256M")))
 
     def __swap_checks(self) -> None:
         """
@@ -157,30 +368,56 @@ class Watcher():
         if os.getuid() != 0:
             raise NotARoot("User must be root")
 
-    def __run_swap(self, backup) -> None:
+    def __run_swap(self, backup: str, job_id: str) -> None:
         """
         Swap mysql directories
 
         :param str backup: Path to backup file
+        :param str job_id: Job id
 
         :returns: None
         """
         self.__swap_checks()
         start = time.perf_counter()
-        work_dir = os.path.join("/tmp/", self._random_str())
-        swapper = SwapDirs(src_dir=work_dir)
-        processor = BackupProcessor(source=backup, target=work_dir, user="mysql", group="mysql")
-        mysql = MysqlData(datadir=work_dir, debug=self.debug, user="mysql", group="mysql")
+        work_dir = self.conf.get("extract_dir", EXTRACT_AUTO)
+        if work_dir == EXTRACT_AUTO:
+            work_dir = SwapDirs.staging_path(dst_dir=SWAP_DST_DIR, name=job_id)
+        swapper = SwapDirs(
+            src_dir=work_dir,
+            copy_workers=int(self.conf.get("copy_workers", 8)),
+            socket=self.conf.get("mysql_socket", DEFAULT_SOCKET),
+            grants_source=self.conf.get("grants_source", GRANTS_NATIVE),
+            grants_workers=int(self.conf.get("grants_workers", 4)),
+            grants_cache=os.path.expanduser(self.conf.get("grants_cache", DEFAULT_GRANTS_CACHE)),
+            grants_ignore=[p for p in self.conf.get("grants_ignore", "root@localhost").split(",") if p],
+            grants_include=[p for p in self.conf.get("grants_include", "").split(",") if p])
+        profile = ResourceProfile.detect(path=work_dir, overrides=self.resources)
+        processor = BackupProcessor(source=backup, target=work_dir, user="mysql", group="mysql", force=True, profile=profile)
+        mysql = MysqlData(datadir=work_dir, debug=self.debug, user="mysql", group="mysql", profile=profile)
         try:
-            processor.extract(debug=self.debug)
-            processor.prepare(debug=self.debug)
-            mysql.start(skip_grants=False)
-            swapper.update_users(engine=mysql.engine)
-            mysql.stop()
-            swapper.stop_mysqld()
-            swapper.swap_dirs()
+            swapper.check_space(os.path.getsize(backup))
+            with self.metrics.stage("extract"):
+                processor.extract(debug=self.debug)
+            with self.metrics.stage("prepare"):
+                processor.prepare(debug=self.debug)
+            with self.metrics.stage("mysqld_start"):
+                mysql.start(skip_grants=False)
+            with self.metrics.stage("update_users"):
+                swapper.update_users(engine=mysql.engine)
+            with self.metrics.stage("mysqld_stop"):
+                mysql.stop()
+            with self.metrics.stage("stage"):
+                swapper.stage()
+            with self.metrics.stage("stop_system_mysqld"):
+                swapper.stop_mysqld()
+            with self.metrics.stage("swap_dirs"):
+                swapper.swap_dirs()
         finally:
-            swapper.start_mysqld()
+            with self.metrics.stage("start_system_mysqld"):
+                swapper.start_mysqld()
+        if swapper.downtime is not None:
+            self.metrics.gauge("swap_downtime_seconds", swapper.downtime, "System mysqld stop issued until accepting connections")
+        swapper.remove_old_dir()
         stop = time.perf_counter()
         execution_time = round((stop - start)/60, 2)
         _logger.info(f"Program took: {execution_time} minutes")
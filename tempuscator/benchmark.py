@@ -0,0 +1,414 @@
+import logging
+import os
+import sys
+import json
+import time
+import struct
+import uuid
+import shutil
+import platform
+import tempfile
+import contextlib
+import subprocess
+import dataclasses
+from typing import Dict, Iterator, List, Optional
+from tempuscator.archiver import BackupProcessor
+from tempuscator.base import Watcher
+from tempuscator.engines import MysqlData
+from tempuscator.executor import Obfuscator
+from tempuscator.metrics import Metrics
+from tempuscator.remover import get_remover
+from tempuscator.constants import MYSQLD_PATH, SHUTDOWN_CLEAN, SHUTDOWN_FAST, XBSTREAM_MAGIC
+
+_logger = logging.getLogger(__name__)
+
+MB = 1 << 20
+FAKE_ENV = "TEMPUSCATOR_FAKE"
+# Executables which can be replaced, constant name: tool name
+FAKE_TOOLS = {
+    "XBSTREAM_PATH": "xbstream",
+    "XTRABACKUP_PATH": "xtrabackup",
+    "SCP_PATH": "scp",
+    "PT_SHOW_GRANTS": "pt-show-grants",
+}
+SCENARIOS = ("backup", "masking", "watcher")
+
+# Stand-in for xtrabackup tools, behaviour is chosen by executable name and
+# configured with JSON from environment
+FAKE_SCRIPT = '''#!{python}
+import json, os, shutil, sys, time
+conf = json.loads(os.environ.get("{env}", "{{}}"))
+name = os.path.basename(sys.argv[0])
+tool = conf.get(name, {{}})
+throughput = tool.get("throughput", 0)
+time.sleep(tool.get("latency", 0))
+started = time.monotonic()
+
+
+def pace(done):
+    if throughput:
+        wait = done / throughput - (time.monotonic() - started)
+        if wait > 0:
+            time.sleep(wait)
+
+
+def arg(flag):
+    for i, a in enumerate(sys.argv):
+        if a == flag and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        if a.startswith(flag + "="):
+            return a.split("=", 1)[1]
+    return None
+
+
+def consume(stream):
+    done = 0
+    while True:
+        data = stream.read(1 << 20)
+        if not data:
+            return done
+        done += len(data)
+        pace(done)
+
+
+def tree_size(path):
+    return sum(os.path.getsize(os.path.join(r, n)) for r, _, names in os.walk(path) for n in names)
+
+
+if name == "xbstream" and "-x" in sys.argv:
+    consume(sys.stdin.buffer)
+    directory = arg("--directory")
+    if conf.get("template"):
+        shutil.copytree(conf["template"], directory, dirs_exist_ok=True)
+    else:
+        for f in ("xtrabackup_info", "xtrabackup_checkpoints", "backup-my.cnf"):
+            with open(os.path.join(directory, f), "w") as out:
+                out.write("fake")
+elif name == "xtrabackup" and "--prepare" in sys.argv:
+    pace(tree_size(arg("--target-dir")))
+elif name == "xtrabackup" and "--backup" in sys.argv:
+    size = tool.get("archive_size", 0)
+    block = b"\\0" * (1 << 20)
+    done = 0
+    while done < size:
+        sys.stdout.buffer.write(block[:size - done])
+        done += min(len(block), size - done)
+        pace(done)
+elif name == "scp":
+    with open(sys.argv[-2], "rb") as f:
+        consume(f)
+elif name == "pt-show-grants":
+    print("GRANT USAGE ON *.* TO 'bench'@'localhost';")
+'''
+
+
+@dataclasses.dataclass
+class FakeTool():
+    """
+    Simulated executable
+
+    :param str name: xbstream, xtrabackup, scp or pt-show-grants
+    :param int throughput: bytes per second, 0 unlimited
+    :param float latency: seconds before tool starts working
+    :param int archive_size: bytes written by xtrabackup --backup
+    """
+    name: str
+    throughput: int = 0
+    latency: float = 0
+    archive_size: int = 0
+
+
+def install_fakes(directory: str, tools: List[FakeTool], template: str = None) -> Dict[str, str]:
+    """
+    Write stand-in executables and configure them through environment
+
+    :param str directory: directory for executables
+    :param list tools: simulated tools
+    :param str template: datadir copied by fake xbstream instead of placeholder files
+
+    :returns: constant name -> executable path
+    """
+    os.makedirs(directory, exist_ok=True)
+    script = os.path.join(directory, "fake-tool")
+    with open(script, "w") as f:
+        f.write(FAKE_SCRIPT.format(python=sys.executable, env=FAKE_ENV))
+    os.chmod(script, 0o755)
+    conf = {t.name: dataclasses.asdict(t) for t in tools}
+    if template:
+        conf["template"] = template
+    os.environ[FAKE_ENV] = json.dumps(conf)
+    paths = {}
+    for constant, name in FAKE_TOOLS.items():
+        path = os.path.join(directory, name)
+        if not os.path.lexists(path):
+            os.symlink(script, path)
+        paths[constant] = path
+    return paths
+
+
+@contextlib.contextmanager
+def patched_executables(paths: Dict[str, str]) -> Iterator[None]:
+    """
+    Point executable constants of all loaded tempuscator modules to other paths
+    """
+    saved = []
+    modules = [m for n, m in list(sys.modules.items()) if n == "tempuscator" or n.startswith("tempuscator.")]
+    for module in modules:
+        for name, path in paths.items():
+            if hasattr(module, name):
+                saved.append((module, name, getattr(module, name)))
+                setattr(module, name, path)
+    try:
+        yield
+    finally:
+        for module, name, value in saved:
+            setattr(module, name, value)
+
+
+def write_xbstream(path: str, size: int, chunk_size: int = MB) -> None:
+    """
+    Write valid xbstream archive of given payload size
+    """
+    def chunk(name: str, data: bytes) -> bytes:
+        encoded = name.encode()
+        header = XBSTREAM_MAGIC + struct.pack("<ccI", b"\0", b"P", len(encoded)) + encoded
+        return header + struct.pack("<QQI", len(data), 0, 0) + data
+
+    block = os.urandom(chunk_size)
+    with open(path, "wb") as f:
+        f.write(chunk("xtrabackup_checkpoints", b"backup_type = full-backuped\nfrom_lsn = 0\nto_lsn = 1\n"))
+        f.write(chunk("xtrabackup_info", f"uuid = {uuid.uuid4()}\n".encode()))
+        written = 0
+        while written < size:
+            data = block[:min(chunk_size, size - written)]
+            f.write(chunk("ibdata1", data))
+            written += len(data)
+
+
+def _timed(results: Dict[str, float], stage: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        results[stage] = round(time.perf_counter() - start, 3)
+
+
+def bench_backup(work_dir: str, backup_size: int) -> dict:
+    """
+    BackupProcessor stages against fake tools
+    """
+    source = os.path.join(work_dir, "backup.xbs")
+    write_xbstream(path=source, size=backup_size)
+    stages = {}
+    processor = BackupProcessor(source=source, target=os.path.join(work_dir, "backup-datadir"), force=True)
+    _timed(stages, "extract", processor.extract)
+    _timed(stages, "prepare", processor.prepare)
+    _timed(stages, "cleanup_backup_files", processor.cleanup_backup_files)
+    archive = os.path.join(work_dir, "backup-out.xbs")
+    _timed(stages, "create", processor.create, dst=archive, socket=os.path.join(work_dir, "none.sock"))
+    _timed(stages, "upload", processor.uploader, host="localhost", user="bench", src=archive, dst="/dev/null")
+    _timed(stages, "cleanup", processor.cleanup)
+    os.remove(archive)
+    return {"backup_bytes": backup_size, "stages": stages, "total": round(sum(stages.values()), 3)}
+
+
+def init_datadir(mysqld: str, datadir: str) -> None:
+    """
+    Initialize empty datadir with root without password
+    """
+    cli = [mysqld, "--no-defaults", "--initialize-insecure", f"--datadir={datadir}"]
+    if os.geteuid() == 0:
+        cli.append("--user=root")
+    _logger.debug(f"Executing: {' '.join(cli)}")
+    subprocess.run(cli, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def populate(mysql: MysqlData, tables: int, rows: int) -> None:
+    """
+    Create synthetic tables with rows of fake personal data
+    """
+    with mysql.engine.connect() as conn:
+        conn.exec_driver_sql("CREATE DATABASE IF NOT EXISTS bench")
+        conn.exec_driver_sql(f"SET SESSION cte_max_recursion_depth = {max(1000, rows)}")
+        for i in range(tables):
+            conn.exec_driver_sql(
+                f"CREATE TABLE bench.customers_{i} ("
+                "id INT PRIMARY KEY, name VARCHAR(64), email VARCHAR(128), phone VARCHAR(32)) ENGINE=InnoDB")
+            conn.exec_driver_sql(
+                f"INSERT INTO bench.customers_{i} "
+                f"WITH RECURSIVE seq (n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows}) "
+                "SELECT n, CONCAT('name', n), CONCAT('user', n, '@mail.test'), LPAD(n, 10, '0') FROM seq")
+        conn.commit()
+
+
+def masking_script(path: str, tables: int) -> None:
+    with open(path, "w") as f:
+        for i in range(tables):
+            f.write(
+                f"UPDATE bench.customers_{i} SET name = SHA1(name), "
+                "email = CONCAT('user', id, '@example.com'), phone = LPAD(CRC32(phone), 10, '0');\n")
+
+
+def build_template(mysqld: str, work_dir: str, tables: int, rows: int) -> str:
+    """
+    Datadir with synthetic tables, cleanly shut down
+    """
+    template = os.path.join(work_dir, "template")
+    init_datadir(mysqld=mysqld, datadir=template)
+    mysql = MysqlData(datadir=template, debug=False, mysql_user="root")
+    mysql.start()
+    try:
+        populate(mysql=mysql, tables=tables, rows=rows)
+    finally:
+        mysql.stop(mode=SHUTDOWN_CLEAN)
+    for name in ("tempuscator.sock", "tempuscator.sock.lock", "tempuscator.pid"):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(template, name))
+    return template
+
+
+def bench_masking(work_dir: str, template: str, tables: int, rows: int, workers: int, chunk_rows: int) -> dict:
+    """
+    Obfuscator masking throughput on throwaway mysqld
+    """
+    datadir = os.path.join(work_dir, "masking")
+    shutil.copytree(template, datadir)
+    script = os.path.join(work_dir, "masking.sql")
+    masking_script(path=script, tables=tables)
+    stages = {}
+    mysql = MysqlData(datadir=datadir, debug=False, mysql_user="root", conn_pool_size=workers)
+    obfuscator = Obfuscator(source=script, workers=workers, chunk_rows=chunk_rows)
+    _timed(stages, "mysqld_start", mysql.start)
+    try:
+        _timed(stages, "mask", obfuscator.mask, engine=mysql.engine)
+    finally:
+        _timed(stages, "mysqld_stop", mysql.stop, mode=SHUTDOWN_FAST)
+    get_remover().remove(datadir)
+    total_rows = tables * rows
+    return {
+        "tables": tables,
+        "rows": total_rows,
+        "workers": workers,
+        "chunk_rows": chunk_rows,
+        "stages": stages,
+        "rows_per_second": round(total_rows / max(stages["mask"], 0.001)),
+    }
+
+
+def bench_watcher(work_dir: str, tables: int, workers: int) -> dict:
+    """
+    Whole Watcher obfuscation job, extract copies template datadir
+    """
+    watch_dir = os.path.join(work_dir, "watch")
+    os.makedirs(watch_dir, exist_ok=True)
+    script = os.path.join(work_dir, "watcher.sql")
+    masking_script(path=script, tables=tables)
+    config = os.path.join(work_dir, "watcher.ini")
+    with open(config, "w") as f:
+        f.write("[obfuscator]\n")
+        f.write(f"scrub_sql = {script}\n")
+        f.write(f"tmp_dir = {work_dir}\n")
+        f.write(f"save_path = {os.path.join(work_dir, 'watcher-out.xbs')}\n")
+        f.write(f"queue_dir = {os.path.join(work_dir, 'queue')}\n")
+        f.write(f"script_cache = {os.path.join(work_dir, 'scripts')}\n")
+        f.write(f"mask_workers = {workers}\n")
+        f.write("scp_host = localhost\n")
+        f.write("ssh_user = bench\n")
+        f.write("scp_path = /dev/null\n")
+        f.write("upload_streams = 1\n")
+    backup = os.path.join(watch_dir, "backup.xbs")
+    write_xbstream(path=backup, size=MB)
+    watcher = Watcher(config=config, path=watch_dir, metrics=Metrics())
+    start = time.perf_counter()
+    watcher.obfuscate(backup=backup, job_id="bench")
+    job = time.perf_counter() - start
+    watcher.uploads.wait()
+    return {"job": round(job, 3), "job_with_upload": round(time.perf_counter() - start, 3)}
+
+
+def version() -> str:
+    try:
+        from importlib.metadata import version as package_version
+        return package_version("tempuscator")
+    except Exception:
+        return "unknown"
+
+
+def run(
+        work_dir: str,
+        scenarios: List[str],
+        tools: List[FakeTool],
+        backup_size: int,
+        mysqld: str = MYSQLD_PATH,
+        tables: int = 4,
+        rows: int = 100000,
+        workers: int = 4,
+        chunk_rows: int = 0) -> dict:
+    """
+    Run benchmark scenarios
+
+    Failed scenario is reported with its error, other scenarios still run.
+
+    :returns: JSON serializable results
+    """
+    results = {
+        "version": version(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "config": {
+            "backup_size": backup_size,
+            "tables": tables,
+            "rows": rows,
+            "workers": workers,
+            "chunk_rows": chunk_rows,
+            "tools": [dataclasses.asdict(t) for t in tools],
+        },
+        "results": {},
+    }
+    template: Optional[str] = None
+    if "masking" in scenarios or "watcher" in scenarios:
+        try:
+            template = build_template(mysqld=mysqld, work_dir=work_dir, tables=tables, rows=rows)
+        except Exception as e:
+            _logger.error(f"Unable to build template datadir: {e}")
+            results["template_error"] = str(e)
+    bin_dir = os.path.join(work_dir, "bin")
+    paths = install_fakes(directory=bin_dir, tools=tools)
+    paths["MYSQLD_PATH"] = mysqld
+    with patched_executables(paths):
+        for scenario in scenarios:
+            if scenario != "backup" and template is None:
+                results["results"][scenario] = {"error": "template datadir not available"}
+                continue
+            _logger.info(f"Running {scenario} benchmark")
+            # Backup scenario has no mysqld, fake extract writes placeholder files
+            install_fakes(directory=bin_dir, tools=tools, template=None if scenario == "backup" else template)
+            try:
+                if scenario == "backup":
+                    results["results"][scenario] = bench_backup(work_dir=work_dir, backup_size=backup_size)
+                elif scenario == "masking":
+                    results["results"][scenario] = bench_masking(
+                        work_dir=work_dir, template=template, tables=tables, rows=rows, workers=workers, chunk_rows=chunk_rows)
+                elif scenario == "watcher":
+                    results["results"][scenario] = bench_watcher(work_dir=work_dir, tables=tables, workers=workers)
+            except Exception as e:
+                _logger.error(f"Benchmark {scenario} failed: {e}")
+                results["results"][scenario] = {"error": str(e)}
+    get_remover().wait()
+    return results
+
+
+@contextlib.contextmanager
+def work_directory(path: str = None) -> Iterator[str]:
+    """
+    Given directory or temporary one removed afterwards
+    """
+    if path:
+        os.makedirs(path, exist_ok=True)
+        yield path
+        return
+    path = tempfile.mkdtemp(prefix="tempuscator-bench-")
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,182 @@
+import logging
+import os
+import json
+import time
+import fcntl
+import subprocess
+import contextlib
+from typing import Dict, Iterator, Optional
+from tempuscator.xbstream import XbstreamReader
+from tempuscator.exceptions import ChainError
+from tempuscator.fscopy import clone_file, copy_tree
+from tempuscator.remover import get_remover
+from tempuscator.constants import LZ4_PATH, QPRESS_PATH, ZSTD_PATH
+
+_logger = logging.getLogger(__name__)
+
+CHECKPOINTS_FILE = "xtrabackup_checkpoints"
+INFO_FILE = "xtrabackup_info"
+# Compressed metadata file suffix: decompress command reading stdin
+METADATA_CODECS = {
+    ".zst": [ZSTD_PATH, "-dc"],
+    ".lz4": [LZ4_PATH, "-dc"],
+    ".qp": [QPRESS_PATH, "-dio"],
+}
+TYPE_FULL = "full"
+TYPE_INCREMENTAL = "incremental"
+
+
+def parse_checkpoints(content: str) -> Dict[str, str]:
+    values = {}
+    for line in content.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            values[key.strip()] = value.strip()
+    return values
+
+
+def read_metadata(path: str, name: str) -> Optional[bytes]:
+    """
+    Read xtrabackup metadata file from xbstream archive without extracting it
+
+    :param str path: xbstream archive
+    :param str name: file name in archive, compressed variants are tried too
+
+    :returns: file content or None if archive doesn't have it
+    """
+    with open(path, "rb") as f:
+        for suffix in [""] + list(METADATA_CODECS):
+            f.seek(0)
+            data = XbstreamReader(stream=f).read_file(path=f"{name}{suffix}")
+            if data is None:
+                continue
+            if suffix:
+                cli = METADATA_CODECS[suffix]
+                if not os.path.exists(cli[0]):
+                    _logger.warning(f"{cli[0]} not found, can't read {name}{suffix}")
+                    return None
+                data = subprocess.run(cli, input=data, stdout=subprocess.PIPE, check=True).stdout
+            return data
+    return None
+
+
+def read_checkpoints(path: str) -> Optional[Dict[str, str]]:
+    """
+    Read xtrabackup_checkpoints from xbstream archive without extracting it
+
+    :param str path: xbstream archive
+
+    :returns: checkpoint values or None if archive has no checkpoints file
+    """
+    data = read_metadata(path=path, name=CHECKPOINTS_FILE)
+    return parse_checkpoints(data.decode()) if data is not None else None
+
+
+def backup_kind(checkpoints: Dict[str, str]) -> str:
+    """
+    full or incremental from checkpoints backup_type
+    """
+    return TYPE_INCREMENTAL if checkpoints.get("backup_type") == "incremental" else TYPE_FULL
+
+
+class BackupChain():
+    """
+    Prepared base datadir which incremental backups are applied to
+
+    Base is prepared with --apply-log-only so next increments can still be
+    applied, working copies are materialized from it and prepared fully.
+
+    :param str directory: chain directory, one per backup source
+    :param int copy_workers: files copied in parallel when materializing
+    """
+
+    def __init__(self, directory: str, copy_workers: int = 8) -> None:
+        self.directory = directory
+        self.copy_workers = copy_workers
+        self.base = os.path.join(directory, "base")
+        self.staging = os.path.join(directory, "base.new")
+        self.incoming = os.path.join(directory, "incoming")
+        self.state_path = os.path.join(directory, "chain.json")
+        os.makedirs(directory, mode=0o750, exist_ok=True)
+        self.state = self.__load()
+
+    def __load(self) -> dict:
+        if not os.path.isfile(self.state_path) or not os.path.isdir(self.base):
+            return {}
+        with open(self.state_path, "r") as f:
+            return json.load(f)
+
+    def __save(self) -> None:
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """
+        Exclusive lock of chain, held while base is changed or copied
+        """
+        with open(os.path.join(self.directory, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    @property
+    def to_lsn(self) -> Optional[int]:
+        return self.state.get("to_lsn")
+
+    def check(self, checkpoints: Dict[str, str]) -> None:
+        """
+        Validate that incremental backup continues chain
+
+        :raises ChainError: chain has no base or LSNs don't match
+        """
+        if backup_kind(checkpoints) != TYPE_INCREMENTAL:
+            return
+        if self.to_lsn is None:
+            raise ChainError(f"Chain {self.directory} has no prepared base, full backup required first")
+        from_lsn = int(checkpoints.get("from_lsn", -1))
+        if from_lsn != self.to_lsn:
+            raise ChainError(f"Incremental from_lsn {from_lsn} doesn't continue chain at to_lsn {self.to_lsn}")
+
+    def promote(self) -> None:
+        """
+        Replace base with freshly prepared full backup
+        """
+        if os.path.exists(self.base):
+            get_remover().remove(self.base)
+        os.rename(self.staging, self.base)
+
+    def record(self, source: str, checkpoints: Dict[str, str]) -> None:
+        """
+        Remember backup applied to base
+        """
+        entry = {
+            "source": os.path.basename(source),
+            "type": backup_kind(checkpoints),
+            "from_lsn": int(checkpoints.get("from_lsn", 0)),
+            "to_lsn": int(checkpoints["to_lsn"]),
+            "applied": time.time(),
+        }
+        backups = [] if entry["type"] == TYPE_FULL else self.state.get("backups", [])
+        self.state = {"to_lsn": entry["to_lsn"], "backups": backups + [entry]}
+        self.__save()
+        _logger.info(f"Chain {self.directory} at lsn {entry['to_lsn']}, {len(self.state['backups'])} backups")
+
+    def invalidate(self) -> None:
+        """
+        Forget base after failed apply, next backup must be full
+        """
+        _logger.warning(f"Invalidating chain {self.directory}")
+        self.state = {}
+        if os.path.isfile(self.state_path):
+            os.remove(self.state_path)
+
+    def materialize(self, target: str) -> None:
+        """
+        Clone base to working directory with reflinks, base itself stays apply-log-only
+        """
+        if self.to_lsn is None:
+            raise ChainError(f"Chain {self.directory} has no prepared base")
+        _logger.info(f"Materializing chain base at lsn {self.to_lsn} to {target}")
+        copy_tree(src=self.base, dst=target, workers=self.copy_workers, copy=clone_file)
@@ -0,0 +1,117 @@
+import logging
+import re
+import math
+import sqlalchemy as db
+from typing import List, Optional, Tuple
+from tempuscator.sqlscript import Statement
+
+_logger = logging.getLogger(__name__)
+
+_IDENT = r"(?:`[^`]+`|\w+)(?:\s*\.\s*(?:`[^`]+`|\w+))?"
+_UPDATE_RE = re.compile(
+    r"^\s*(UPDATE\s+(?:LOW_PRIORITY\s+)?(?:IGNORE\s+)?(" + _IDENT + r")(?:\s+(?:AS\s+)?(?!SET\b)(\w+))?"
+    r"\s+SET\s+.+?)(?:\s+WHERE\s+(.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_DELETE_RE = re.compile(
+    r"^\s*(DELETE\s+(?:LOW_PRIORITY\s+)?(?:QUICK\s+)?(?:IGNORE\s+)?FROM\s+(" + _IDENT + r"))"
+    r"(?:\s+WHERE\s+(.+?))?\s*;?\s*$",
+    re.IGNORECASE | re.DOTALL)
+_UNSUPPORTED_RE = re.compile(r"\b(?:JOIN|SELECT|ORDER\s+BY|LIMIT|USING)\b", re.IGNORECASE)
+_INT_TYPES = ("tinyint", "smallint", "mediumint", "int", "bigint")
+
+
+class RangeChunker():
+    """
+    Split single table UPDATE/DELETE statements to primary key range slices
+
+    Only tables with single column integer primary key are split, everything
+    else is returned as is.
+
+    :param int chunk_rows: approximate number of rows in one slice
+    """
+
+    def __init__(self, chunk_rows: int = 100000) -> None:
+        if chunk_rows < 1:
+            raise ValueError("chunk_rows must be positive")
+        self.chunk_rows = chunk_rows
+
+    def parse(self, query: str) -> Optional[Tuple[str, str, str, Optional[str]]]:
+        """
+        Parse single table UPDATE or DELETE
+
+        :param str query: SQL statement
+
+        :returns: (statement without WHERE, table, column qualifier, where) or None if not supported
+        """
+        if _UNSUPPORTED_RE.search(query):
+            return None
+        m = _UPDATE_RE.match(query)
+        if m:
+            head, table, qualifier, where = m.groups()
+            qualifier = qualifier or table
+        else:
+            m = _DELETE_RE.match(query)
+            if not m:
+                return None
+            head, table, where = m.groups()
+            qualifier = table
+        if head.count("'") % 2 or head.count('"') % 2:
+            return None
+        return head, table, qualifier, where
+
+    def _primary_key(self, conn: db.Connection, schema: Optional[str], table: str) -> Optional[str]:
+        query = db.text(
+            "SELECT k.COLUMN_NAME, c.DATA_TYPE FROM information_schema.KEY_COLUMN_USAGE k "
+            "JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = k.TABLE_SCHEMA "
+            "AND c.TABLE_NAME = k.TABLE_NAME AND c.COLUMN_NAME = k.COLUMN_NAME "
+            "WHERE k.CONSTRAINT_NAME = 'PRIMARY' AND k.TABLE_SCHEMA = COALESCE(:schema, DATABASE()) "
+            "AND k.TABLE_NAME = :table")
+        rows = conn.execute(query, {"schema": schema, "table": table}).fetchall()
+        if len(rows) != 1 or rows[0][1].lower() not in _INT_TYPES:
+            return None
+        return rows[0][0]
+
+    def _table_rows(self, conn: db.Connection, schema: Optional[str], table: str) -> int:
+        query = db.text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE()) AND TABLE_NAME = :table")
+        rows = conn.execute(query, {"schema": schema, "table": table}).scalar()
+        return int(rows or 0)
+
+    def split(self, engine: db.Engine, statement: Statement) -> List[str]:
+        """
+        Rewrite statement to primary key range slices
+
+        :param engine: sqlalchemy engine
+        :param statement: parsed SQL statement
+
+        :returns: list of slices, empty if statement can't or shouldn't be split
+        """
+        if statement.kind not in ("UPDATE", "DELETE") or len(statement.tables) != 1:
+            return []
+        parsed = self.parse(statement.sql)
+        if not parsed:
+            return []
+        head, table, qualifier, where = parsed
+        parts = [p.strip().strip("`") for p in table.split(".")]
+        schema, name = (parts[0], parts[1]) if len(parts) == 2 else (None, parts[0])
+        with engine.connect() as conn:
+            pk = self._primary_key(conn=conn, schema=schema, table=name)
+            if not pk:
+                _logger.debug(f"{table} has no single integer primary key, not splitting")
+                return []
+            rows = self._table_rows(conn=conn, schema=schema, table=name)
+            if rows < self.chunk_rows * 2:
+                return []
+            low, high = conn.execute(db.text(f"SELECT MIN(`{pk}`), MAX(`{pk}`) FROM {table}")).fetchone()
+        if low is None:
+            return []
+        slices = math.ceil(rows / self.chunk_rows)
+        step = max(1, math.ceil((high - low + 1) / slices))
+        column = f"{qualifier}.`{pk}`"
+        condition = f"({where}) AND " if where else ""
+        queries = []
+        for start in range(low, high + 1, step):
+            queries.append(f"{head} WHERE {condition}{column} >= {start} AND {column} < {start + step}")
+        _logger.info(f"Split query on {table} to {len(queries)} slices by {pk}")
+        return queries
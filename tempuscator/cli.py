@@ -1,14 +1,25 @@
 import os
+import json
 import time
 import logging
 from tempuscator.archiver import BackupProcessor
+from tempuscator.chain import BackupChain
+from tempuscator.datacache import PreparedCache
+from tempuscator import codecbench
+from tempuscator import benchmark as pipeline_bench
 from tempuscator.executor import Obfuscator
 from tempuscator.engines import MysqlData
 from tempuscator.logger import init_logger
-from tempuscator.arguments import obf_args, swap_args, notifier_args
+from tempuscator.arguments import obf_args, swap_args, notifier_args, codec_bench_args, benchmark_args
 from tempuscator.sentry import init_sentry
 from tempuscator.swapper import SwapDirs
 from tempuscator.base import Watcher
+from tempuscator.resources import ResourceProfile, load_overrides, parse_size
+from tempuscator.remover import configure as configure_remover
+from tempuscator.metrics import Metrics
+from tempuscator.profiler import Profiler
+from tempuscator.planner import CostPlanner
+from tempuscator.filters import SchemaFilter, split_patterns
 
 
 def obfuscator() -> None:
@@ -25,9 +36,15 @@ def obfuscator() -> None:
     if os.path.isfile(args.config):
         _logger.debug(f"Initializing sentry from {args.config}")
         init_sentry(path=args.config)
+    metrics = Metrics(textfile_dir=args.metrics_dir, name="tempuscator_obfuscator")
+    remover = configure_remover(workers=args.remove_workers, io_budget=parse_size(args.remove_io_budget))
+    profile = ResourceProfile.detect(path=args.target_dir, overrides=load_overrides(path=args.config))
+    schema_filter = SchemaFilter(include=split_patterns(args.include_schemas), exclude=split_patterns(args.exclude_schemas))
     mysql = MysqlData(
         datadir=args.target_dir,
-        debug=args.debug
+        debug=args.debug,
+        conn_pool_size=max(args.mask_workers, args.mask_max_in_flight or 0),
+        profile=profile
     )
     backup = BackupProcessor(
         source=args.backup_file,
@@ -35,33 +52,89 @@ def obfuscator() -> None:
         force=args.force,
         parallel=args.parallel,
         remove_backup=args.remove_backup,
-        save_archive=args.save_archive
+        save_archive=args.save_archive,
+        resume=args.resume,
+        profile=profile,
+        metrics=metrics,
+        schema_filter=schema_filter,
+        chain=BackupChain(directory=args.chain_dir) if args.chain_dir else None,
+        cache=PreparedCache(directory=args.prepared_cache, max_size=parse_size(args.prepared_cache_size)) if args.prepared_cache else None
     )
-    obfuscator = Obfuscator(source=args.sql_file)
-    backup.extract(debug=args.debug)
-    xtrabackup_info = os.path.join(mysql.datadir, "xtrabackup_info")
-    if not os.path.isfile(xtrabackup_info):
-        backup.decompress(debug=args.debug)
-    backup.prepare(debug=args.debug)
-    backup.cleanup_backup_files()
-    try:
-        mysql.start()
-        obfuscator.cleanup_system_users(engine=mysql.engine)
-        obfuscator.change_system_user_password(engine=mysql.engine, user="root", empty=True)
-        obfuscator.mask(engine=mysql.engine)
-        backup.create(socket=mysql.socket, dst=args.save_archive, debug=args.debug)
-    finally:
-        mysql.stop()
-        backup.cleanup()
-    backup.uploader(
-        host=args.host,
-        user=args.ssh_user,
-        src=args.save_archive,
-        dst=args.scp_dst,
-        progress=args.debug)
+    obfuscator = Obfuscator(
+        source=args.sql_file,
+        script_cache=os.path.expanduser(args.script_cache),
+        schema_filter=schema_filter,
+        workers=args.mask_workers,
+        max_in_flight=args.mask_max_in_flight,
+        order=args.mask_order,
+        chunk_rows=args.mask_chunk_rows,
+        journal=backup.journal,
+        metrics=metrics,
+        profiler=Profiler(top=args.profile_top, report=args.profile_report) if args.profile or args.profile_report else None,
+        planner=CostPlanner(history=args.mask_history) if args.mask_history or args.plan_only else None
+    )
+    with metrics.job():
+        metrics.gauge("bytes_in", os.path.getsize(args.backup_file) if os.path.isfile(args.backup_file) else 0, "Size of source backup")
+        with metrics.stage("extract"):
+            backup.extract(debug=args.debug)
+        with metrics.stage("prepare"):
+            backup.prepare(debug=args.debug)
+        backup.cleanup_backup_files()
+        sinks = None
+        if args.stream_upload and args.host:
+            sinks = backup.stream_sinks(hosts=[args.host], user=args.ssh_user, dst=args.scp_dst)
+        if args.plan_only:
+            try:
+                mysql.start()
+                print(obfuscator.plan(engine=mysql.engine))
+            finally:
+                mysql.stop(mode=args.shutdown_mode)
+                if not args.resume:
+                    backup.cleanup()
+            return
+        failed = []
+        try:
+            with metrics.stage("mysqld_start"):
+                mysql.start()
+            with metrics.stage("user_cleanup"):
+                obfuscator.cleanup_system_users(engine=mysql.engine)
+                obfuscator.change_system_user_password(engine=mysql.engine, user="root", empty=True)
+            if schema_filter.enabled:
+                with metrics.stage("schema_filter"):
+                    schema_filter.drop_unselected(engine=mysql.engine)
+            with metrics.stage("mask"):
+                obfuscator.mask(engine=mysql.engine)
+            with metrics.stage("create"):
+                failed = backup.create(
+                    socket=mysql.socket,
+                    dst=args.save_archive,
+                    debug=args.debug,
+                    sinks=sinks,
+                    compress=args.compress,
+                    compress_level=args.compress_level)
+            if os.path.isfile(args.save_archive):
+                metrics.gauge("bytes_out", os.path.getsize(args.save_archive), "Size of obfuscated archive")
+        finally:
+            with metrics.stage("mysqld_stop"):
+                mysql.stop(mode=args.shutdown_mode)
+            if not args.resume:
+                backup.cleanup()
+        if args.resume:
+            backup.cleanup()
+        if args.host and (not sinks or failed):
+            with metrics.stage("upload", host=str(args.host)):
+                backup.uploader(
+                    host=args.host,
+                    user=args.ssh_user,
+                    src=args.save_archive,
+                    dst=args.scp_dst,
+                    progress=args.debug,
+                    streams=args.upload_streams,
+                    chunk_size=parse_size(args.upload_chunk_size))
     stop = time.perf_counter()
     execution_time = round((stop - start)/60, 2)
     _logger.info(f"Program took: {execution_time} minutes")
+    remover.wait()
 
 
 def swapper() -> None:
@@ -74,12 +147,22 @@ def swapper() -> None:
     if os.path.isfile(args.config):
         _logger.debug(f"Initializing sentry from {args.config}")
         init_sentry(path=args.config)
+    metrics = Metrics(textfile_dir=args.metrics_dir, name="tempuscator_swapper")
+    remover = configure_remover(workers=args.remove_workers, io_budget=parse_size(args.remove_io_budget))
     swapper = SwapDirs(
             src_dir=args.extract_dir,
             user=args.mysql_user,
             password=args.mysql_password,
-            backup=args.backup)
+            backup=args.backup,
+            socket=args.mysql_socket,
+            grants_source=args.grants_source,
+            grants_workers=args.grants_workers,
+            grants_cache=args.grants_cache,
+            grants_ignore=[p for p in args.grants_ignore.split(",") if p],
+            grants_include=[p for p in (args.grants_include or "").split(",") if p],
+            copy_workers=args.copy_workers)
     _logger.debug(f"Swapper: {swapper}")
+    profile = ResourceProfile.detect(path=swapper.src_dir, overrides=load_overrides(path=args.config))
     backup = BackupProcessor(
             source=args.backup_file,
             target=swapper.src_dir,
@@ -87,29 +170,104 @@ def swapper() -> None:
             user=args.user,
             group=args.group,
             logger_name="Swapper",
-            remove_backup=args.remove_backup)
+            remove_backup=args.remove_backup,
+            profile=profile)
     _logger.debug(f"Backup processor: {backup}")
     updated_data = MysqlData(
             datadir=swapper.src_dir,
             debug=args.debug,
             user=args.user,
-            group=args.group)
+            group=args.group,
+            profile=profile)
     _logger.debug(f"Mysql data: {updated_data}")
-    backup.extract(debug=args.debug)
-    backup.prepare(debug=args.debug)
-    try:
-        updated_data.start(skip_grants=False)
-        swapper.update_users(updated_data.engine)
-    finally:
-        updated_data.stop()
-    try:
-        swapper.stop_mysqld()
-        swapper.swap_dirs()
-    finally:
-        swapper.start_mysqld()
+    with metrics.job():
+        if os.path.isfile(args.backup_file):
+            swapper.check_space(os.path.getsize(args.backup_file))
+        with metrics.stage("extract"):
+            backup.extract(debug=args.debug)
+        with metrics.stage("prepare"):
+            backup.prepare(debug=args.debug)
+        try:
+            with metrics.stage("mysqld_start"):
+                updated_data.start(skip_grants=False)
+            with metrics.stage("update_users"):
+                swapper.update_users(updated_data.engine)
+        finally:
+            with metrics.stage("mysqld_stop"):
+                updated_data.stop()
+        with metrics.stage("stage"):
+            swapper.stage()
+        try:
+            with metrics.stage("stop_system_mysqld"):
+                swapper.stop_mysqld()
+            with metrics.stage("swap_dirs"):
+                swapper.swap_dirs()
+        finally:
+            with metrics.stage("start_system_mysqld"):
+                swapper.start_mysqld()
+        if swapper.downtime is not None:
+            metrics.gauge("swap_downtime_seconds", swapper.downtime, "System mysqld stop issued until accepting connections")
+        swapper.remove_old_dir()
     stop = time.perf_counter()
     execution_time = round((stop - start)/60, 2)
     _logger.info(f"Program took: {execution_time} minutes")
+    remover.wait()
+
+
+def codec_bench() -> None:
+    """
+    Cli entry point for compression codec benchmark
+    """
+    args = codec_bench_args()
+    init_logger(name="tempuscator", level="debug" if args.debug else args.log_level)
+    codecs = codecbench.candidates(
+        codecs=split_patterns(args.codecs),
+        zstd_levels=[int(level) for level in split_patterns(args.zstd_levels)])
+    table, best = codecbench.run(
+        datadir=args.datadir,
+        codecs=codecs,
+        sample_size=parse_size(args.sample_size),
+        threads=args.threads,
+        bandwidth=parse_size(args.bandwidth))
+    if best is None:
+        raise SystemExit("No codec could be measured")
+    print(table)
+    print(f"Recommended: --compress {best.codec.codec}" + (f" --compress-level {best.codec.level}" if best.codec.level else ""))
+
+
+def benchmark() -> None:
+    """
+    Cli entry point for pipeline benchmark, results are written as JSON
+    """
+    args = benchmark_args()
+    init_logger(name="tempuscator", level="debug" if args.debug else args.log_level)
+    tools = [
+        pipeline_bench.FakeTool(name="xbstream", throughput=parse_size(args.xbstream_throughput), latency=args.tool_latency),
+        pipeline_bench.FakeTool(
+            name="xtrabackup",
+            throughput=parse_size(args.xtrabackup_throughput),
+            latency=args.tool_latency,
+            archive_size=parse_size(args.archive_size)),
+        pipeline_bench.FakeTool(name="scp", throughput=parse_size(args.scp_throughput), latency=args.tool_latency),
+        pipeline_bench.FakeTool(name="pt-show-grants", latency=args.tool_latency),
+    ]
+    with pipeline_bench.work_directory(path=args.work_dir) as work_dir:
+        results = pipeline_bench.run(
+            work_dir=work_dir,
+            scenarios=split_patterns(args.scenarios),
+            tools=tools,
+            backup_size=parse_size(args.backup_size),
+            mysqld=args.mysqld,
+            tables=args.tables,
+            rows=args.rows,
+            workers=args.mask_workers,
+            chunk_rows=args.mask_chunk_rows)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
 
 
 def mysql_obf_watcher() -> None:
@@ -124,7 +282,9 @@ def mysql_obf_watcher() -> None:
     if os.path.isfile(args.config):
         _logger.debug(f"Initializing sentry from {args.config}")
         init_sentry(path=args.config)
-    listener = Watcher(config=args.conf_action, path=args.watch_dir, debug=args.debug)
+    metrics = Metrics(textfile_dir=args.metrics_dir, name="tempuscator_obf_watcher")
+    configure_remover(workers=args.remove_workers, io_budget=parse_size(args.remove_io_budget))
+    listener = Watcher(config=args.conf_action, path=args.watch_dir, debug=args.debug, metrics=metrics)
     listener.watch_obfuscate()
 
 
@@ -143,5 +303,7 @@ def mysql_swap_watch() -> None:
     if os.path.isfile(args.config):
         _logger.debug(f"Initializing sentry from {args.config}")
         init_sentry(path=args.config)
-    listener = Watcher(config=args.conf_action, path=args.watch_dir, debug=args.debug)
+    metrics = Metrics(textfile_dir=args.metrics_dir, name="tempuscator_swap_watcher")
+    configure_remover(workers=args.remove_workers, io_budget=parse_size(args.remove_io_budget))
+    listener = Watcher(config=args.conf_action, path=args.watch_dir, debug=args.debug, metrics=metrics)
     listener.watch(action="swap")
@@ -0,0 +1,154 @@
+import logging
+import os
+import time
+import resource
+import subprocess
+import dataclasses
+from typing import List, Optional, Tuple
+from tempuscator.constants import LZ4_PATH, QPRESS_PATH, ZSTD_PATH
+
+_logger = logging.getLogger(__name__)
+
+MB = 1 << 20
+SAMPLE_BLOCK = MB
+
+
+@dataclasses.dataclass(frozen=True)
+class Codec():
+    """
+    Compression candidate as used by xtrabackup --compress
+
+    :param str codec: none, quicklz, lz4 or zstd
+    :param int level: zstd level, None for codec default
+    """
+    codec: str
+    level: Optional[int] = None
+
+    def __str__(self) -> str:
+        return self.codec if self.level is None else f"{self.codec}:{self.level}"
+
+    def cli(self) -> Optional[List[str]]:
+        """
+        Single threaded command compressing stdin to stdout, None for none
+        """
+        if self.codec == "zstd":
+            return [ZSTD_PATH, f"-{self.level or 1}", "-T1", "-c"]
+        if self.codec == "lz4":
+            return [LZ4_PATH, "-1", "-c"]
+        if self.codec == "quicklz":
+            return [QPRESS_PATH, "-T1", "-io", "sample"]
+        return None
+
+
+@dataclasses.dataclass(frozen=True)
+class BenchResult():
+    """
+    Compression result of sample
+
+    :param Codec codec: compression candidate
+    :param float ratio: compressed size / original size
+    :param float mb_per_core: MB of input compressed per CPU second
+    """
+    codec: Codec
+    ratio: float
+    mb_per_core: float
+
+    def estimate(self, size: int, threads: int, bandwidth: int) -> float:
+        """
+        Seconds to create and upload archive of datadir
+
+        :param int size: datadir bytes
+        :param int threads: compress threads
+        :param int bandwidth: upload bytes per second
+        """
+        create = size / MB / (self.mb_per_core * threads) if self.mb_per_core else 0
+        return create + size * self.ratio / bandwidth
+
+
+def candidates(codecs: List[str], zstd_levels: List[int]) -> List[Codec]:
+    result = []
+    for codec in codecs:
+        if codec == "zstd":
+            result.extend(Codec(codec="zstd", level=level) for level in zstd_levels)
+        else:
+            result.append(Codec(codec=codec))
+    return result
+
+
+def read_sample(datadir: str, sample_size: int) -> bytes:
+    """
+    Evenly spaced blocks of datadir files, every file gets share by its size
+
+    :param str datadir: prepared datadir
+    :param int sample_size: bytes in sample
+    """
+    files = []
+    for root, _, names in os.walk(datadir):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append((path, os.path.getsize(path)))
+    total = sum(s for _, s in files)
+    if not total:
+        raise ValueError(f"No data in {datadir}")
+    chunks = []
+    for path, size in files:
+        blocks = max(1, round(sample_size * size / total / SAMPLE_BLOCK)) if size else 0
+        step = max(SAMPLE_BLOCK, size // max(1, blocks))
+        with open(path, "rb") as f:
+            for offset in range(0, size, step)[:blocks]:
+                f.seek(offset)
+                chunks.append(f.read(SAMPLE_BLOCK))
+    sample = b"".join(chunks)
+    _logger.info(f"Sampled {len(sample) // MB} MB from {len(files)} files, {total // MB} MB total")
+    return sample
+
+
+def measure(codec: Codec, sample: bytes) -> Optional[BenchResult]:
+    """
+    Compress sample with codec, CPU time of compressor is measured
+
+    :returns: result or None if compressor is not installed
+    """
+    cli = codec.cli()
+    if cli is None:
+        return BenchResult(codec=codec, ratio=1.0, mb_per_core=0)
+    if not os.path.exists(cli[0]):
+        _logger.warning(f"{cli[0]} not found, skipping {codec}")
+        return None
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    compressed = subprocess.run(cli, input=sample, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+    duration = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return BenchResult(
+        codec=codec,
+        ratio=len(compressed) / len(sample),
+        mb_per_core=len(sample) / MB / max(cpu or duration, 0.001))
+
+
+def run(datadir: str, codecs: List[Codec], sample_size: int, threads: int, bandwidth: int) -> Tuple[str, Optional[BenchResult]]:
+    """
+    Benchmark codecs on datadir sample
+
+    :param str datadir: prepared datadir
+    :param list codecs: candidates
+    :param int sample_size: bytes compressed with every candidate
+    :param int threads: xtrabackup compress threads
+    :param int bandwidth: upload bytes per second
+
+    :returns: text table of estimates and result with the shortest create and upload time, None if nothing was measured
+    """
+    size = sum(os.path.getsize(os.path.join(r, n)) for r, _, names in os.walk(datadir) for n in names
+               if not os.path.islink(os.path.join(r, n)))
+    sample = read_sample(datadir=datadir, sample_size=sample_size)
+    results = [r for r in (measure(c, sample) for c in codecs) if r]
+    if not results:
+        return "", None
+    lines = [f"{'codec':<10} {'ratio':>7} {'MB/s/core':>10} {'create+upload':>14}"]
+    for r in results:
+        speed = round(r.mb_per_core, 1) if r.mb_per_core else "-"
+        lines.append(f"{str(r.codec):<10} {r.ratio:>7.3f} {speed:>10} {round(r.estimate(size, threads, bandwidth), 1):>13}s")
+    best = min(results, key=lambda r: r.estimate(size, threads, bandwidth))
+    return "\n".join(lines), best
@@ -2,12 +2,57 @@
 
 XBSTREAM_PATH = "/usr/bin/xbstream"
 SCP_PATH = "/usr/bin/scp"
+SSH_PATH = "/usr/bin/ssh"
 XTRABACKUP_PATH = "/usr/bin/xtrabackup"
 MYSQLD_PATH = "/usr/sbin/mysqld"
 PT_SHOW_GRANTS = "/usr/bin/pt-show-grants"
 SYSTEMCTL_PATH = "/usr/bin/systemctl"
 SSH_KEYSCAN_PATH = "/bin/ssh-keyscan"
+ZSTD_PATH = "/usr/bin/zstd"
+LZ4_PATH = "/usr/bin/lz4"
+QPRESS_PATH = "/usr/bin/qpress"
 
+# Xbstream
+XBSTREAM_MAGIC = b"XBSTCK01"
+CODEC_SUFFIXES = {
+    ".qp": "qpress",
+    ".lz4": "lz4",
+    ".zst": "zstd"
+}
+
+# Archive compression, default leaves codec to xtrabackup
+COMPRESS_DEFAULT = "default"
+COMPRESS_CODECS = ("none", "quicklz", "lz4", "zstd")
+
+# Mysqld shutdown modes
+SHUTDOWN_SLOW = "slow"
+SHUTDOWN_CLEAN = "clean"
+SHUTDOWN_FAST = "fast"
+SHUTDOWN_KILL = "kill"
+
+# Grant sources
+GRANTS_NATIVE = "native"
+GRANTS_PT = "pt-show-grants"
+DEFAULT_GRANTS_CACHE = "~/.tempuscator.d/grants"
+
+# Swap extraction directory next to system datadir
+EXTRACT_AUTO = "auto"
+SWAP_DST_DIR = "/var/lib/mysql"
+
+# Resumable pipeline
+JOURNAL_FILE = "tempuscator.journal"
+
+# Watcher job queue
+DEFAULT_QUEUE_DIR = "~/.tempuscator.d/queue"
+
+# Scrub repository mirrors
+DEFAULT_REPO_CACHE = "~/.tempuscator.d/repos"
+
+# Prepared datadir cache
+DEFAULT_PREPARED_CACHE_SIZE = "200G"
+
+# Parsed sql scripts
+DEFAULT_SCRIPT_CACHE = "~/.tempuscator.d/scripts"
 
 # INotify masks
 CLOSE_WRITE_MASK = 0x00000008
@@ -0,0 +1,196 @@
+import logging
+import os
+import json
+import time
+import fcntl
+import hashlib
+import subprocess
+import contextlib
+from typing import Iterator, List, Optional, Tuple
+from tempuscator.exceptions import BackupFileCorrupt
+from tempuscator.chain import INFO_FILE, parse_checkpoints, read_checkpoints, read_metadata
+from tempuscator.fscopy import clone_file, copy_tree, tree_size
+from tempuscator.remover import get_remover
+
+_logger = logging.getLogger(__name__)
+
+# Files only read or unlinked after prepare, safe to share by hardlink
+HARDLINK_FILES = (
+    "backup-my.cnf",
+    "xtrabackup_binlog_info",
+    "xtrabackup_checkpoints",
+    "xtrabackup_info",
+    "xtrabackup_slave_info",
+    "xtrabackup_tablespaces",
+)
+
+
+def backup_fingerprint(path: str) -> Optional[str]:
+    """
+    Identity of backup in xbstream archive
+
+    Taken from xtrabackup_checkpoints LSNs and xtrabackup_info backup uuid,
+    so the same backup copied or renamed gets the same fingerprint.
+
+    :param str path: xbstream archive
+
+    :returns: fingerprint or None if archive metadata can't be read
+    """
+    try:
+        checkpoints = read_checkpoints(path)
+        info = read_metadata(path=path, name=INFO_FILE)
+    except (BackupFileCorrupt, subprocess.CalledProcessError) as e:
+        _logger.warning(f"Unable to read backup metadata from {path}: {e}")
+        return None
+    uuid = parse_checkpoints(info.decode()).get("uuid") if info is not None else None
+    if not checkpoints or not uuid:
+        return None
+    lsns = ":".join(checkpoints.get(k, "") for k in ("backup_type", "from_lsn", "to_lsn", "last_lsn"))
+    return hashlib.sha256(f"{uuid}:{lsns}".encode()).hexdigest()
+
+
+def _clone(src: str, dst: str) -> int:
+    if os.path.basename(src) in HARDLINK_FILES:
+        os.link(src, dst)
+        return 0
+    return clone_file(src, dst)
+
+
+class PreparedCache():
+    """
+    Cache of prepared datadirs keyed by backup fingerprint
+
+    Entries are cloned to work directory with reflinks, or copied when
+    filesystem doesn't support them. Every entry has own lock file, clones
+    hold shared lock, store and eviction hold exclusive one.
+
+    :param str directory: cache directory, best on the same filesystem as work directories
+    :param int max_size: bytes kept in cache, least recently used entries are evicted
+    :param int workers: files cloned in parallel
+    """
+
+    def __init__(self, directory: str, max_size: int, workers: int = 8) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.workers = workers
+        os.makedirs(directory, mode=0o750, exist_ok=True)
+
+    def _data(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _meta(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    @contextlib.contextmanager
+    def _lock(self, key: str, exclusive: bool = False, blocking: bool = True) -> Iterator[bool]:
+        with open(os.path.join(self.directory, f"{key}.lock"), "w") as f:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(f, flags if blocking else flags | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def key(self, source: str, variant: str = "") -> Optional[str]:
+        """
+        Cache key of backup
+
+        :param str source: xbstream archive
+        :param str variant: anything else changing prepared datadir, for example schema filter
+
+        :returns: key or None if backup can't be identified without reading it whole
+        """
+        fingerprint = backup_fingerprint(source)
+        if fingerprint is None:
+            _logger.warning(f"No xtrabackup_checkpoints or xtrabackup_info uuid in {source}, prepared datadir cache skipped")
+            return None
+        return hashlib.sha256(f"{fingerprint}:{variant}".encode()).hexdigest()[:32]
+
+    def _read_meta(self, key: str) -> Optional[dict]:
+        try:
+            with open(self._meta(key), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_meta(self, key: str, meta: dict) -> None:
+        tmp = f"{self._meta(key)}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta(key))
+
+    def clone(self, key: str, target: str) -> bool:
+        """
+        Clone cached datadir to target
+
+        :returns: True on cache hit
+        """
+        with self._lock(key):
+            meta = self._read_meta(key)
+            if meta is None or not os.path.isdir(self._data(key)):
+                _logger.info(f"Prepared datadir cache miss {key}")
+                return False
+            _logger.info(f"Prepared datadir cache hit {key}, cloning to {target}")
+            copy_tree(src=self._data(key), dst=target, workers=self.workers, copy=_clone)
+            meta["used"] = time.time()
+            self._write_meta(key, meta)
+        return True
+
+    def store(self, key: str, source: str) -> None:
+        """
+        Add prepared datadir to cache, skipped if another job stores it
+        """
+        with self._lock(key, exclusive=True, blocking=False) as locked:
+            if not locked or self._read_meta(key) is not None:
+                return
+            data = self._data(key)
+            if os.path.exists(data):
+                get_remover().remove(data)
+            tmp = f"{data}.tmp"
+            if os.path.exists(tmp):
+                get_remover().remove(tmp)
+            size = tree_size(source)
+            if size > self.max_size:
+                _logger.info(f"Prepared datadir is larger than cache size, not caching {key}")
+                return
+            self.evict(reserve=size)
+            copy_tree(src=source, dst=tmp, workers=self.workers, copy=clone_file)
+            os.rename(tmp, data)
+            now = time.time()
+            self._write_meta(key, {"size": size, "created": now, "used": now})
+            _logger.info(f"Cached prepared datadir {key}, {size >> 20} MB")
+
+    def entries(self) -> List[Tuple[str, dict]]:
+        """
+        Cache entries, least recently used first
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            meta = self._read_meta(key)
+            if meta is not None:
+                entries.append((key, meta))
+        return sorted(entries, key=lambda e: e[1].get("used", 0))
+
+    def evict(self, reserve: int = 0) -> None:
+        """
+        Remove least recently used entries until cache fits its size
+
+        :param int reserve: bytes needed for entry being stored
+        """
+        entries = self.entries()
+        total = sum(m.get("size", 0) for _, m in entries) + reserve
+        for key, meta in entries:
+            if total <= self.max_size:
+                break
+            with self._lock(key, exclusive=True, blocking=False) as locked:
+                if not locked:
+                    continue
+                _logger.info(f"Evicting prepared datadir {key}")
+                os.remove(self._meta(key))
+                if os.path.exists(self._data(key)):
+                    get_remover().remove(self._data(key))
+            total -= meta.get("size", 0)
@@ -4,12 +4,30 @@ import psutil
 import dataclasses
 import sqlalchemy as db
 import os
+import time
 from typing import Union
-from tempuscator.constants import MYSQLD_PATH
+from tempuscator.exceptions import MysqldNotRunning, MysqldStartTimeout
+from tempuscator.constants import (
+    MYSQLD_PATH,
+    SHUTDOWN_CLEAN,
+    SHUTDOWN_FAST,
+    SHUTDOWN_KILL,
+    SHUTDOWN_SLOW
+)
+from tempuscator.resources import ResourceProfile, format_size
 
 
 _logger = logging.getLogger(__name__)
 
+# Client errors meaning server doesn't accept connections yet
+CONNECT_ERRORS = (2002, 2003, 2013)
+# innodb_fast_shutdown value set before SIGTERM
+FAST_SHUTDOWN = {
+    SHUTDOWN_SLOW: 0,
+    SHUTDOWN_CLEAN: None,
+    SHUTDOWN_FAST: 2,
+}
+
 
 @dataclasses.dataclass()
 class MysqlData():
@@ -25,8 +43,15 @@ class MysqlData():
     engine: db.Engine = dataclasses.field(init=False)
     running: bool = False
     conn_pool_size: int = dataclasses.field(default=4)
+    profile: ResourceProfile = dataclasses.field(default=None, repr=False)
+    start_timeout: float = dataclasses.field(default=3600)
+    stop_timeout: float = dataclasses.field(default=600)
+    ready_seconds: float = dataclasses.field(init=False, default=None)
+    stop_seconds: float = dataclasses.field(init=False, default=None)
 
     def __post_init__(self) -> None:
+        if self.profile is None:
+            self.profile = ResourceProfile.detect(path=self.datadir)
         self.socket = os.path.join(self.datadir, "tempuscator.sock")
         url = ["mysql+pymysql://"]
         url.append(self.mysql_user)
@@ -72,41 +97,104 @@ class MysqlData():
         cli.append(pid_path)
         cli.append(f"--log-error={mysql_log}")
         cli.append("--sql-mode=")
-        cli.append("--innodb-buffer-pool-instances=8")
-        cli.append("--innodb-buffer-pool-size=6G")
+        cli.append(f"--innodb-buffer-pool-instances={self.profile.buffer_pool_instances}")
+        cli.append(f"--innodb-buffer-pool-size={format_size(self.profile.buffer_pool_size)}")
         cli.append("--skip-innodb-doublewrite")
         cli.append("--innodb-flush-log-at-trx-commit=0")
-        cli.append("--thread-pool-size=32")
+        cli.append(f"--thread-pool-size={self.profile.thread_pool_size}")
         cli.append("--skip-performance-schema")
         cli.append("--skip-innodb-adaptive-hash-index")
         cli.append("--innodb-deadlock-detect=OFF")
         cli.append("--innodb-lock-wait-timeout=60")
         cli.append("--skip-innodb-buffer-pool-dump-at-shutdown")
-        cli.append("--innodb-page-cleaners=8")
-        cli.append("--innodb-log-buffer-size=128M")
-        cli.append("--innodb-io-capacity=3000")
-        cli.append("--innodb-io-capacity-max=6000")
+        cli.append(f"--innodb-page-cleaners={self.profile.page_cleaners}")
+        cli.append(f"--innodb-log-buffer-size={format_size(self.profile.log_buffer_size)}")
+        cli.append(f"--innodb-io-capacity={self.profile.io_capacity}")
+        cli.append(f"--innodb-io-capacity-max={self.profile.io_capacity_max}")
         cli.append("--innodb-flush-neighbors=0")
         cli.append("--innodb-redo-log-capacity=4G")
         _logger.debug(f"Executing: {' '.join(cli)}")
+        started = time.perf_counter()
         mysqld = subprocess.Popen(cli, stdout=subprocess.DEVNULL, user=self.user, group=self.group)
         mysqld.wait()
+        if mysqld.returncode != 0:
+            raise MysqldNotRunning(f"Mysqld failed to start, check {mysql_log}")
         with open(pid_path, 'r') as f:
             pid = f.read()
         self.pid = int(pid)
         self.running = True
+        self.wait_ready(started=started)
         return self.socket
 
-    def stop(self) -> None:
+    def wait_ready(self, started: float = None) -> float:
+        """
+        Poll socket with backoff until mysqld accepts queries
+
+        :param float started: perf_counter value when start was issued
+
+        :raises MysqldNotRunning: mysqld process exited
+        :raises MysqldStartTimeout: mysqld not ready in start_timeout
+
+        :returns: seconds until mysqld was ready
+        """
+        started = started or time.perf_counter()
+        delay = 0.05
+        while True:
+            try:
+                with self.engine.connect() as conn:
+                    conn.execute(db.text("SELECT 1"))
+                break
+            except db.exc.OperationalError as e:
+                code = e.orig.args[0] if e.orig and e.orig.args else None
+                if code not in CONNECT_ERRORS:
+                    _logger.debug(f"Mysqld answered with error {code}, treating as ready")
+                    break
+            if not psutil.pid_exists(self.pid):
+                self.running = False
+                raise MysqldNotRunning(f"Mysqld pid {self.pid} exited during startup")
+            if time.perf_counter() - started > self.start_timeout:
+                raise MysqldStartTimeout(f"Mysqld not ready after {self.start_timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+        self.ready_seconds = round(time.perf_counter() - started, 3)
+        _logger.info(f"Mysqld ready in {self.ready_seconds}s")
+        return self.ready_seconds
+
+    def stop(self, mode: str = SHUTDOWN_CLEAN) -> None:
         """
         Stop mysqld service
+
+        :param str mode: slow - full purge before shutdown,
+            clean - default InnoDB shutdown, use when datadir will be archived or reused,
+            fast - skip flushing, crash recovery on next start, use when datadir is discarded,
+            kill - SIGKILL, use when datadir is discarded
         """
-        if psutil.pid_exists(self.pid):
-            _logger.info("Mysqld running, stopping")
-            self.engine.dispose()
-            proc = psutil.Process(pid=self.pid)
-            proc.terminate()
-            proc.wait()
+        if mode not in (SHUTDOWN_SLOW, SHUTDOWN_CLEAN, SHUTDOWN_FAST, SHUTDOWN_KILL):
+            raise ValueError(f"Unknown shutdown mode: {mode}")
+        if not self.pid or not psutil.pid_exists(self.pid):
+            _logger.warning(f"Pid: {self.pid} doesn't exist")
             self.running = False
             return
-        _logger.warning(f"Pid: {self.pid} doesn't exist")
+        _logger.info(f"Mysqld running, stopping ({mode})")
+        started = time.perf_counter()
+        if FAST_SHUTDOWN.get(mode) is not None:
+            try:
+                with self.engine.connect() as conn:
+                    conn.execute(db.text(f"SET GLOBAL innodb_fast_shutdown = {FAST_SHUTDOWN[mode]}"))
+            except db.exc.DBAPIError as e:
+                _logger.warning(f"Unable to set innodb_fast_shutdown: {e}")
+        self.engine.dispose()
+        proc = psutil.Process(pid=self.pid)
+        if mode == SHUTDOWN_KILL:
+            proc.kill()
+        else:
+            proc.terminate()
+        try:
+            proc.wait(timeout=self.stop_timeout)
+        except psutil.TimeoutExpired:
+            _logger.error(f"Mysqld didn't stop in {self.stop_timeout}s, killing")
+            proc.kill()
+            proc.wait()
+        self.running = False
+        self.stop_seconds = round(time.perf_counter() - started, 3)
+        _logger.info(f"Mysqld stopped in {self.stop_seconds}s")
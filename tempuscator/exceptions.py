@@ -16,6 +16,12 @@ class MysqldNotRunning(Exception):
     """
 
 
+class MysqldStartTimeout(Exception):
+    """
+    Mysqld not accepting connections in time exception
+    """
+
+
 class MysqlAccessDeniend(Exception):
     """
     Mysql access deniend exception
@@ -44,3 +50,33 @@ class NotARoot(Exception):
     """
     Exception if running user not a root
     """
+
+
+class MaskingError(Exception):
+    """
+    Exception for failed masking queries
+    """
+
+
+class SqlScriptError(Exception):
+    """
+    Exception for sql script which can't be parsed
+    """
+
+
+class InsufficientSpace(Exception):
+    """
+    Exception for not enough free space on target filesystem
+    """
+
+
+class UploadError(Exception):
+    """
+    Exception for failed archive transfer
+    """
+
+
+class ChainError(Exception):
+    """
+    Exception for incremental backup which doesn't continue its chain
+    """
@@ -1,20 +1,69 @@
 import sqlalchemy as db
 import logging
-import threading
-from tempuscator.helpers import execute_query
 from tempuscator.repo import Scruber
+from tempuscator.scheduler import MaskScheduler, ORDER_TABLE
+from tempuscator.chunker import RangeChunker
+from tempuscator.journal import StageJournal
+from tempuscator.metrics import Metrics
+from tempuscator.profiler import Profiler
+from tempuscator.planner import CostPlanner
+from tempuscator.sqlscript import load_script
+from tempuscator.filters import SchemaFilter
 import json
 
 _logger = logging.getLogger(__name__)
 
 
 class Obfuscator():
+    """
+    Masking statements executor
 
-    def __init__(self, scrub: Scruber) -> None:
-        self.queries = scrub.get_queries()
+    :param scrub: scrub repository with sql file
+    :param str source: local sql file, used when scrub isn't given
+    :param str script_cache: directory with parsed sql scripts
+    :param schema_filter: statements touching only filtered out schemas are skipped
+    """
+
+    def __init__(
+            self,
+            scrub: Scruber = None,
+            source: str = None,
+            script_cache: str = None,
+            schema_filter: SchemaFilter = None,
+            workers: int = 4,
+            max_in_flight: int = None,
+            order: str = ORDER_TABLE,
+            chunk_rows: int = 0,
+            journal: StageJournal = None,
+            metrics: Metrics = None,
+            profiler: Profiler = None,
+            planner: CostPlanner = None) -> None:
+        if scrub:
+            content = scrub.get_script()
+        elif source:
+            with open(source, "r") as f:
+                content = f.read()
+        else:
+            raise ValueError("scrub or source required")
+        self.statements = load_script(content=content, cache_dir=script_cache)
+        if schema_filter and schema_filter.enabled:
+            selected = [s for s in self.statements if schema_filter.statement_selected(s)]
+            _logger.info(f"Skipping {len(self.statements) - len(selected)} statements on filtered out schemas")
+            self.statements = selected
+        _logger.info(f"Loaded {len(self.statements)} masking statements")
+        chunker = RangeChunker(chunk_rows=chunk_rows) if chunk_rows else None
+        self.scheduler = MaskScheduler(
+            workers=workers,
+            max_in_flight=max_in_flight,
+            order=order,
+            chunker=chunker,
+            journal=journal,
+            metrics=metrics,
+            profiler=profiler,
+            planner=planner)
 
     def __str__(self) -> str:
-        return json.dumps(self.__dict__)
+        return json.dumps(self.__dict__, default=str)
 
     def change_system_user_password(self, user: str, engine: db.Engine, empty: bool = False) -> None:
         password = ""
@@ -48,12 +97,12 @@ class Obfuscator():
             conn.execute(query)
             conn.commit()
 
+    def plan(self, engine: db.Engine) -> str:
+        """
+        Estimated masking schedule and busiest worker
+        """
+        return CostPlanner.describe(self.scheduler.plan(engine=engine, statements=self.statements))
+
     def mask(self, engine: db.Engine) -> None:
         _logger.info("Executing masking queries")
-        threads = []
-        for q in self.queries:
-            threads.append(threading.Thread(target=execute_query, args=(engine, q, )))
-        for t in threads:
-            t.start()
-        for j in threads:
-            j.join()
+        self.scheduler.run(engine=engine, statements=self.statements)
@@ -0,0 +1,173 @@
+import logging
+import os
+import re
+import fnmatch
+import sqlalchemy as db
+from typing import Iterable, List, Optional
+from tempuscator.sqlscript import Statement
+from tempuscator.constants import CODEC_SUFFIXES
+
+_logger = logging.getLogger(__name__)
+
+# Always extracted, prepared and archived
+SYSTEM_SCHEMAS = ("mysql", "sys", "performance_schema", "information_schema")
+_TABLE_SUFFIXES = (".ibd", ".frm", ".MYD", ".MYI", ".sdi", ".cfg", ".isl", ".TRG", ".TRN", ".par", ".CSV", ".CSM", ".ARZ", ".ARM")
+_ENCODED_RE = re.compile(r"@([0-9a-fA-F]{4})")
+
+
+def decode_name(name: str) -> str:
+    """
+    Decode mysql file name encoding, for example my@002ddb -> my-db
+    """
+    return _ENCODED_RE.sub(lambda m: chr(int(m.group(1), 16)), name)
+
+
+def _posix_regex(pattern: str) -> str:
+    out = []
+    for c in pattern:
+        if c == "*":
+            out.append(".*")
+        elif c == "?":
+            out.append(".")
+        elif c in r"\.^$+()[]{}|":
+            out.append("\\" + c)
+        else:
+            out.append(c)
+    return "".join(out)
+
+
+def quote_name(name: str) -> str:
+    return "`" + name.replace("`", "``") + "`"
+
+
+def split_patterns(value: Optional[str]) -> List[str]:
+    """
+    Comma separated patterns from cli or config
+    """
+    return [p.strip() for p in (value or "").split(",") if p.strip()]
+
+
+class SchemaFilter():
+    """
+    Schema and table include/exclude filter
+
+    Patterns are shell wildcards, schema or schema.table. System schemas are
+    always selected.
+
+    :param list include: selected schemas or tables, default all
+    :param list exclude: skipped schemas or tables
+    """
+
+    def __init__(self, include: Iterable[str] = None, exclude: Iterable[str] = None) -> None:
+        self.include = [self._full(p) for p in include or []]
+        self.exclude = [self._full(p) for p in exclude or []]
+
+    def __str__(self) -> str:
+        return f"include={','.join(self.include) or '*'} exclude={','.join(self.exclude)}"
+
+    @staticmethod
+    def _full(pattern: str) -> str:
+        return pattern if "." in pattern else f"{pattern}.*"
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.include or self.exclude)
+
+    def schema_selected(self, schema: str) -> bool:
+        """
+        Check if schema or any of its tables is selected
+        """
+        if schema in SYSTEM_SCHEMAS:
+            return True
+        if any(p.endswith(".*") and fnmatch.fnmatchcase(schema, p[:-2]) for p in self.exclude):
+            return False
+        return not self.include or any(fnmatch.fnmatchcase(schema, p.split(".", 1)[0]) for p in self.include)
+
+    def table_selected(self, schema: str, table: str) -> bool:
+        """
+        Check if table is selected
+        """
+        if schema in SYSTEM_SCHEMAS:
+            return True
+        name = f"{schema}.{table}"
+        if any(fnmatch.fnmatchcase(name, p) for p in self.exclude):
+            return False
+        return not self.include or any(fnmatch.fnmatchcase(name, p) for p in self.include)
+
+    def path_selected(self, path: str) -> bool:
+        """
+        Check if file from backup belongs to selected schema or table
+
+        Files outside schema directories (system tablespace, undo, redo,
+        xtrabackup metadata) are always selected.
+        """
+        parts = path.strip("/").split("/")
+        if len(parts) != 2 or parts[0].startswith("#"):
+            return True
+        schema = decode_name(parts[0])
+        name = parts[1]
+        ext = os.path.splitext(name)[1]
+        if ext in CODEC_SUFFIXES:
+            name = name[:-len(ext)]
+        base, ext = os.path.splitext(name)
+        if ext not in _TABLE_SUFFIXES:
+            return self.schema_selected(schema)
+        return self.table_selected(schema, decode_name(base.split("#", 1)[0]))
+
+    def statement_selected(self, statement: Statement) -> bool:
+        """
+        Check if masking statement touches selected tables
+
+        Statements with unqualified tables are kept, schema can't be known.
+        """
+        if not statement.tables:
+            return True
+        for table in statement.tables:
+            schema, _, name = table.rpartition(".")
+            if not schema or self.table_selected(schema, name):
+                return True
+        return False
+
+    def tables_regex(self) -> Optional[str]:
+        """
+        POSIX regex for xtrabackup --tables, None if everything is included
+        """
+        if not self.include:
+            return None
+        patterns = [f"{s}\\..*" for s in SYSTEM_SCHEMAS] + [_posix_regex(p) for p in self.include]
+        return f"^({'|'.join(patterns)})$"
+
+    def tables_exclude_regex(self) -> Optional[str]:
+        """
+        POSIX regex for xtrabackup --tables-exclude, None if nothing is excluded
+        """
+        if not self.exclude:
+            return None
+        return f"^({'|'.join(_posix_regex(p) for p in self.exclude)})$"
+
+    def drop_unselected(self, engine: db.Engine) -> None:
+        """
+        Drop schemas and tables which were not extracted
+
+        Data dictionary still knows about tablespaces skipped during extract,
+        dropping them keeps new archive consistent.
+        """
+        with engine.connect() as conn:
+            conn = conn.execution_options(no_parameters=True)
+            rows = conn.execute(db.text(
+                "SELECT TABLE_SCHEMA, TABLE_NAME, TABLE_TYPE FROM information_schema.TABLES")).fetchall()
+            schemas = {r[0] for r in conn.execute(db.text("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA")).fetchall()}
+            dropped_schemas = sorted(s for s in schemas if not self.schema_selected(s))
+            for schema in dropped_schemas:
+                _logger.debug(f"Dropping schema {schema}")
+                conn.exec_driver_sql(f"DROP DATABASE {quote_name(schema)}")
+            dropped_tables = 0
+            for schema, table, table_type in rows:
+                if schema in dropped_schemas or self.table_selected(schema, table):
+                    continue
+                kind = "VIEW" if table_type == "VIEW" else "TABLE"
+                _logger.debug(f"Dropping {kind.lower()} {schema}.{table}")
+                conn.exec_driver_sql(f"DROP {kind} IF EXISTS {quote_name(schema)}.{quote_name(table)}")
+                dropped_tables += 1
+            conn.commit()
+        _logger.info(f"Dropped {len(dropped_schemas)} schemas and {dropped_tables} tables not selected by filter")
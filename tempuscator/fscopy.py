@@ -0,0 +1,208 @@
+import logging
+import os
+import errno
+import fcntl
+import shutil
+import time
+import concurrent.futures
+from typing import Callable, List, Tuple
+
+_logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 8 << 20
+# ioctl sharing extents of source file with destination (XFS, btrfs)
+FICLONE = 0x40049409
+# Errors meaning copy_file_range can't be used for this pair of files
+_NO_COPY_RANGE = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM)
+
+
+def existing_parent(path: str) -> str:
+    """
+    First existing directory of path, path itself if it exists
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def same_device(a: str, b: str) -> bool:
+    """
+    Check if two paths, existing or not, are on the same filesystem
+    """
+    return os.stat(existing_parent(a)).st_dev == os.stat(existing_parent(b)).st_dev
+
+
+def free_space(path: str) -> int:
+    """
+    Bytes available to unprivileged user on filesystem holding path
+    """
+    return shutil.disk_usage(existing_parent(path)).free
+
+
+def tree_size(path: str) -> int:
+    """
+    Allocated bytes of all files in directory
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            st = os.lstat(os.path.join(root, name))
+            total += st.st_blocks * 512
+    return total
+
+
+def _data_ranges(fd: int, size: int) -> List[Tuple[int, int]]:
+    """
+    Data extents of sparse file, whole file if filesystem doesn't report holes
+    """
+    ranges = []
+    pos = 0
+    try:
+        while pos < size:
+            try:
+                start = os.lseek(fd, pos, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    break
+                raise
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            ranges.append((start, end))
+            pos = end
+    except OSError as e:
+        if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+            raise
+        return [(0, size)]
+    return ranges
+
+
+def _copy_range(src: int, dst: int, start: int, end: int, use_copy_range: bool) -> bool:
+    pos = start
+    while pos < end:
+        if use_copy_range:
+            try:
+                copied = os.copy_file_range(src, dst, min(end - pos, 1 << 30), pos, pos)
+            except OSError as e:
+                if e.errno not in _NO_COPY_RANGE:
+                    raise
+                use_copy_range = False
+                continue
+            if copied == 0:
+                break
+            pos += copied
+        else:
+            data = os.pread(src, min(end - pos, BUFFER_SIZE), pos)
+            if not data:
+                break
+            os.pwrite(dst, data, pos)
+            pos += len(data)
+    return use_copy_range
+
+
+def copy_file(src: str, dst: str) -> int:
+    """
+    Copy file keeping holes, ownership, mode and times
+
+    Data extents are copied with copy_file_range, large buffered reads are
+    used when kernel or filesystem doesn't support it.
+
+    :param str src: source file
+    :param str dst: destination file
+
+    :returns: number of data bytes copied
+    """
+    copied = 0
+    fd_src = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(fd_src)
+        fd_dst = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, st.st_mode & 0o7777)
+        try:
+            os.ftruncate(fd_dst, st.st_size)
+            use_copy_range = hasattr(os, "copy_file_range")
+            for start, end in _data_ranges(fd_src, st.st_size):
+                use_copy_range = _copy_range(fd_src, fd_dst, start, end, use_copy_range)
+                copied += end - start
+            if os.geteuid() == 0:
+                os.fchown(fd_dst, st.st_uid, st.st_gid)
+            os.fchmod(fd_dst, st.st_mode & 0o7777)
+        finally:
+            os.close(fd_dst)
+    finally:
+        os.close(fd_src)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return copied
+
+
+def clone_file(src: str, dst: str) -> int:
+    """
+    Reflink file, fall back to copy when filesystem can't share extents
+
+    :param str src: source file
+    :param str dst: destination file
+
+    :returns: number of data bytes copied, 0 for reflinked file
+    """
+    with open(src, "rb") as f_src:
+        st = os.fstat(f_src.fileno())
+        fd_dst = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, st.st_mode & 0o7777)
+        try:
+            fcntl.ioctl(fd_dst, FICLONE, f_src.fileno())
+        except OSError as e:
+            if e.errno not in _NO_COPY_RANGE + (errno.ENOTTY,):
+                raise
+            os.close(fd_dst)
+            return copy_file(src, dst)
+        try:
+            if os.geteuid() == 0:
+                os.fchown(fd_dst, st.st_uid, st.st_gid)
+            os.fchmod(fd_dst, st.st_mode & 0o7777)
+        finally:
+            os.close(fd_dst)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return 0
+
+
+def copy_tree(src: str, dst: str, workers: int = 8, copy: Callable[[str, str], int] = copy_file) -> int:
+    """
+    Copy directory tree with several files in flight
+
+    :param str src: source directory
+    :param str dst: destination directory, must not exist or be empty
+    :param int workers: files copied in parallel
+    :param copy: function copying single file, returns copied bytes
+
+    :returns: number of data bytes copied
+    """
+    start = time.perf_counter()
+    os.makedirs(dst, exist_ok=True)
+    dirs = [(src, dst)]
+    copied = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = []
+        for root, dir_names, files in os.walk(src):
+            target = os.path.join(dst, os.path.relpath(root, src))
+            for name in dir_names:
+                s_path = os.path.join(root, name)
+                d_path = os.path.join(target, name)
+                if os.path.islink(s_path):
+                    os.symlink(os.readlink(s_path), d_path)
+                    continue
+                os.mkdir(d_path)
+                dirs.append((s_path, d_path))
+            for name in files:
+                s_path = os.path.join(root, name)
+                d_path = os.path.join(target, name)
+                if os.path.islink(s_path):
+                    os.symlink(os.readlink(s_path), d_path)
+                    continue
+                futures.append(pool.submit(copy, s_path, d_path))
+        for f in futures:
+            copied += f.result()
+    for s_path, d_path in reversed(dirs):
+        shutil.copystat(s_path, d_path)
+        if os.geteuid() == 0:
+            st = os.stat(s_path)
+            os.chown(d_path, st.st_uid, st.st_gid)
+    duration = max(time.perf_counter() - start, 0.001)
+    _logger.info(f"Copied {src} to {dst}: {copied // (1 << 20)} MB in {round(duration, 1)}s, {round(copied / duration / (1 << 20))} MB/s")
+    return copied
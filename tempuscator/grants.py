@@ -0,0 +1,161 @@
+import logging
+import os
+import re
+import json
+import fnmatch
+import hashlib
+import tempfile
+import concurrent.futures
+import sqlalchemy as db
+from typing import Iterator, List, Optional, Tuple
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/var/lib/mysql/mysql.sock"
+# Tables holding accounts and privileges, checksum of them is cache key
+GRANT_TABLES = (
+    "mysql.user",
+    "mysql.db",
+    "mysql.tables_priv",
+    "mysql.columns_priv",
+    "mysql.procs_priv",
+    "mysql.proxies_priv",
+    "mysql.global_grants",
+    "mysql.role_edges",
+    "mysql.default_roles",
+    "mysql.password_history",
+)
+# Bumped when exported statements change, invalidates cached grants
+EXPORT_FORMAT = 2
+_CREATE_USER_RE = re.compile(r"^CREATE USER (?!IF NOT EXISTS)", re.IGNORECASE)
+# ALTER USER doesn't accept DEFAULT ROLE clause of SHOW CREATE USER
+_DEFAULT_ROLE_RE = re.compile(r" DEFAULT ROLE .*?(?= REQUIRE |$)", re.IGNORECASE)
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+class GrantExporter():
+    """
+    Export accounts and privileges of running mysqld as SQL statements
+
+    Accounts are read from mysql.user, SHOW CREATE USER and SHOW GRANTS run
+    for several accounts in parallel over pooled connections.
+
+    :param str socket: mysqld unix socket
+    :param str user: mysql user
+    :param str password: mysql password
+    :param int workers: accounts exported in parallel
+    :param list ignore: user@host patterns to skip, shell wildcards allowed
+    :param list include: user@host patterns to export, default all
+    :param str cache_dir: directory with exported grants, keyed by checksum of grant tables
+    """
+
+    def __init__(
+            self,
+            socket: str = DEFAULT_SOCKET,
+            user: str = None,
+            password: str = None,
+            workers: int = 4,
+            ignore: List[str] = None,
+            include: List[str] = None,
+            cache_dir: str = None) -> None:
+        self.workers = max(1, int(workers))
+        self.ignore = ["root@localhost"] if ignore is None else ignore
+        self.include = include or []
+        self.cache_dir = cache_dir
+        url = db.engine.URL.create(
+            drivername="mysql+pymysql",
+            username=user or os.environ.get("USER"),
+            password=password,
+            host="localhost",
+            database="mysql",
+            query={"unix_socket": socket})
+        self.engine = db.create_engine(url, pool_size=self.workers)
+
+    def __del__(self) -> None:
+        if hasattr(self, "engine"):
+            self.engine.dispose()
+
+    def selected(self, user: str, host: str) -> bool:
+        """
+        Check account against include and ignore filters
+        """
+        account = f"{user}@{host}"
+        if self.include and not any(fnmatch.fnmatchcase(account, p) for p in self.include):
+            return False
+        return not any(fnmatch.fnmatchcase(account, p) for p in self.ignore)
+
+    def accounts(self) -> List[Tuple[str, str]]:
+        """
+        Accounts matching filters
+
+        :returns: sorted list of (user, host)
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(db.text("SELECT User, Host FROM mysql.user ORDER BY User, Host")).fetchall()
+        return [(u, h) for u, h in rows if self.selected(u, h)]
+
+    def checksum(self) -> str:
+        """
+        Checksum of grant tables and filters
+        """
+        with self.engine.connect() as conn:
+            rows = conn.execute(db.text(f"CHECKSUM TABLE {', '.join(GRANT_TABLES)}")).fetchall()
+        key = json.dumps({"tables": [list(r) for r in rows], "ignore": self.ignore, "include": self.include, "format": EXPORT_FORMAT})
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _account(self, user: str, host: str) -> List[str]:
+        account = f"{_quote(user)}@{_quote(host)}"
+        with self.engine.connect() as conn:
+            try:
+                # Password hashes are binary, hex keeps statements printable
+                conn.exec_driver_sql("SET SESSION print_identified_with_as_hex = ON")
+            except db.exc.DBAPIError:
+                pass
+            conn = conn.execution_options(no_parameters=True)
+            create = conn.exec_driver_sql(f"SHOW CREATE USER {account}").scalar()
+            grants = [r[0] for r in conn.exec_driver_sql(f"SHOW GRANTS FOR {account}").fetchall()]
+        # Account usually exists in new datadir already, ALTER USER resets its credentials like pt-show-grants does
+        alter = _DEFAULT_ROLE_RE.sub("", re.sub(r"^CREATE USER ", "ALTER USER ", create, flags=re.IGNORECASE))
+        return [_CREATE_USER_RE.sub("CREATE USER IF NOT EXISTS ", create), alter] + grants
+
+    def export(self) -> Iterator[str]:
+        """
+        Stream statements recreating selected accounts, in account order
+        """
+        accounts = self.accounts()
+        _logger.info(f"Exporting grants of {len(accounts)} accounts with {self.workers} workers")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for statements in pool.map(lambda a: self._account(*a), accounts):
+                yield from statements
+
+    def _cache_path(self) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        try:
+            return os.path.join(self.cache_dir, f"grants-{self.checksum()}.json")
+        except db.exc.DBAPIError as e:
+            _logger.warning(f"Unable to checksum grant tables, cache disabled: {e}")
+            return None
+
+    def grants(self) -> List[str]:
+        """
+        Statements recreating selected accounts, cached while grant tables don't change
+        """
+        path = self._cache_path()
+        if path and os.path.isfile(path):
+            with open(path, "r") as f:
+                grants = json.load(f)
+            _logger.info(f"Using {len(grants)} cached grants from {path}")
+            return grants
+        grants = list(self.export())
+        if path:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(grants, f)
+            os.replace(tmp, path)
+            _logger.debug(f"Cached {len(grants)} grants in {path}")
+        return grants
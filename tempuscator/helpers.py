@@ -4,11 +4,15 @@ import logging
 _logger = logging.getLogger(__name__)
 
 
-def execute_query(engine: db.Engine, query: str, close: bool = False) -> None:
+def execute_query(engine: db.Engine, query: str, close: bool = False, dispose: bool = True) -> int:
     """
     Executute raw query
+
+    :returns: number of affected rows
     """
     with engine.connect() as conn:
-        conn.execute(db.text(query))
+        rows = conn.execute(db.text(query)).rowcount
         conn.commit()
-    engine.dispose(close=close)
+    if dispose:
+        engine.dispose(close=close)
+    return rows
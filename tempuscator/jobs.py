@@ -0,0 +1,223 @@
+import logging
+import os
+import json
+import time
+import queue
+import hashlib
+import threading
+import dataclasses
+from typing import Callable, Dict, List
+from tempuscator.metrics import Metrics
+
+_logger = logging.getLogger(__name__)
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+def backup_identity(backup: str) -> str:
+    """
+    Identity of uploaded file, changes when new file is uploaded under the same name
+
+    :param str backup: path to backup file
+
+    :returns: inode, size and mtime or empty string if file doesn't exist
+    """
+    try:
+        st = os.stat(backup)
+    except FileNotFoundError:
+        return ""
+    return f"{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+@dataclasses.dataclass
+class Job():
+    """
+    Queued backup processing job
+
+    :param str id: job id, derived from backup path and identity
+    :param str backup: path to backup file
+    :param str action: obfuscate or swap
+    :param str state: queued, running, done or failed
+    :param str identity: backup_identity of file when job was queued
+    """
+    id: str
+    backup: str
+    action: str
+    state: str = STATE_QUEUED
+    created: float = dataclasses.field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    attempts: int = 0
+    error: str = None
+    identity: str = None
+
+    def current(self) -> bool:
+        """
+        Check if backup path still holds the file this job was queued for
+        """
+        return self.identity is None or backup_identity(self.backup) == self.identity
+
+
+class JobQueue():
+    """
+    Persistent job queue processed by pool of workers
+
+    Every job is stored as json file in queue directory, jobs which were
+    queued or running when process stopped are queued again on start.
+
+    :param str path: queue directory
+    :param handler: callable executed for every job
+    :param int workers: number of jobs processed at the same time
+    :param bool retry_failed: queue failed jobs again on start
+    :param int keep: number of finished jobs kept in queue directory
+    :param metrics: optional metrics for queue depth and job results
+    """
+
+    def __init__(
+            self,
+            path: str,
+            handler: Callable[[Job], None],
+            workers: int = 1,
+            retry_failed: bool = False,
+            keep: int = 100,
+            metrics: Metrics = None) -> None:
+        self.path = path
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.retry_failed = retry_failed
+        self.keep = keep
+        self.metrics = metrics or Metrics()
+        self.jobs: Dict[str, Job] = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        os.makedirs(self.path, mode=0o750, exist_ok=True)
+
+    @staticmethod
+    def job_id(backup: str, identity: str = "") -> str:
+        return hashlib.sha1(f"{os.path.abspath(backup)}:{identity}".encode()).hexdigest()[:8]
+
+    def _save(self, job: Job) -> None:
+        path = os.path.join(self.path, f"{job.id}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(dataclasses.asdict(job), f, indent=2)
+        os.replace(tmp, path)
+
+    def _load(self) -> None:
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.path, name), "r") as f:
+                job = Job(**json.load(f))
+            self.jobs[job.id] = job
+            requeue = job.state in (STATE_QUEUED, STATE_RUNNING)
+            if job.state == STATE_FAILED and self.retry_failed:
+                requeue = os.path.isfile(job.backup) and job.current()
+            if requeue:
+                _logger.info(f"Requeueing job {job.id}: {job.backup}")
+                job.state = STATE_QUEUED
+                self._save(job)
+                self._queue.put(job.id)
+
+    def _prune(self) -> None:
+        finished = sorted(
+            (j for j in self.jobs.values() if j.state in (STATE_DONE, STATE_FAILED)),
+            key=lambda j: j.finished or 0)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            os.remove(os.path.join(self.path, f"{job.id}.json"))
+            del self.jobs[job.id]
+
+    def submit(self, backup: str, action: str) -> Job:
+        """
+        Queue backup for processing
+
+        :param str backup: path to backup file
+        :param str action: obfuscate or swap
+
+        :returns: queued job, already active job for the same file is returned as is
+        """
+        identity = backup_identity(backup)
+        job_id = self.job_id(backup, identity)
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job and job.state in (STATE_QUEUED, STATE_RUNNING):
+                _logger.debug(f"Job {job_id} for {backup} already {job.state}")
+                return job
+            for job in self.jobs.values():
+                # Waiting job of the same path will process the new file
+                if job.state == STATE_QUEUED and job.backup == backup:
+                    _logger.debug(f"Job {job.id} for {backup} not started yet, file replaced")
+                    job.identity = identity
+                    self._save(job)
+                    return job
+            job = Job(id=job_id, backup=backup, action=action, identity=identity)
+            self.jobs[job_id] = job
+            self._save(job)
+        self._queue.put(job_id)
+        depth = self.depth()
+        self.metrics.gauge("queue_depth", depth, "Jobs waiting or running", action=action)
+        _logger.info(f"Queued job {job_id}: {backup}, queue depth: {depth}")
+        return job
+
+    def depth(self) -> int:
+        """
+        Number of jobs waiting or running
+        """
+        with self._lock:
+            return sum(1 for j in self.jobs.values() if j.state in (STATE_QUEUED, STATE_RUNNING))
+
+    def start(self) -> None:
+        """
+        Load persisted jobs and start workers
+        """
+        with self._lock:
+            self._load()
+        for n in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"job-worker-{n}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        _logger.info(f"Started {self.workers} job workers")
+
+    def _worker(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                break
+            with self._lock:
+                job = self.jobs[job_id]
+                job.state = STATE_RUNNING
+                job.started = time.time()
+                job.attempts += 1
+                self._save(job)
+            _logger.info(f"Running job {job.id}: {job.backup}")
+            try:
+                self.handler(job)
+                state, error = STATE_DONE, None
+            except Exception as e:
+                _logger.exception(f"Job {job.id} failed")
+                state, error = STATE_FAILED, str(e)
+            with self._lock:
+                job.state = state
+                job.error = error
+                job.finished = time.time()
+                self._save(job)
+                self._prune()
+            _logger.info(f"Job {job.id} {state} in {round((job.finished - job.started)/60, 2)} minutes")
+            result = "success" if state == STATE_DONE else "failure"
+            self.metrics.inc("jobs_total", help="Finished jobs", result=result, action=job.action)
+            if state == STATE_DONE:
+                self.metrics.gauge("last_success_timestamp_seconds", job.finished, "Time of last successful job", action=job.action)
+            self.metrics.gauge("queue_depth", self.depth(), "Jobs waiting or running", action=job.action)
+
+    def stop(self) -> None:
+        """
+        Stop workers after current jobs finish
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
@@ -0,0 +1,96 @@
+import logging
+import os
+import json
+import time
+import threading
+from typing import Optional
+from tempuscator.constants import JOURNAL_FILE
+
+_logger = logging.getLogger(__name__)
+
+
+def file_fingerprint(path: str) -> Optional[dict]:
+    """
+    Cheap fingerprint of input file
+
+    :param str path: file path
+
+    :returns: dict with path, size and mtime or None if file doesn't exist
+    """
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class StageJournal():
+    """
+    Journal of completed pipeline stages, persisted in work directory
+
+    Journal without directory is disabled, it never reports stage as done.
+
+    :param str directory: work directory, journal file is written inside it
+    :param dict fingerprint: fingerprint of pipeline input
+    """
+
+    def __init__(self, directory: str = None, fingerprint: dict = None) -> None:
+        self.enabled = directory is not None
+        self.path = os.path.join(directory, JOURNAL_FILE) if self.enabled else None
+        self.fingerprint = fingerprint
+        self.stages = {}
+        self.stale = False
+        self._lock = threading.Lock()
+        if self.enabled and os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if fingerprint and data.get("fingerprint") != fingerprint:
+                _logger.warning("Journal fingerprint doesn't match input, starting from scratch")
+                self.stale = True
+                return
+            self.fingerprint = data.get("fingerprint")
+            self.stages = data.get("stages", {})
+            _logger.info(f"Resuming, completed stages: {len(self.stages)}")
+
+    def exists(self) -> bool:
+        return self.enabled and os.path.isfile(self.path)
+
+    def done(self, stage: str) -> bool:
+        """
+        Check if stage already completed
+
+        :param str stage: stage name
+        """
+        if stage in self.stages:
+            _logger.info(f"Stage {stage} already done, skipping")
+            return True
+        return False
+
+    def complete(self, stage: str) -> None:
+        """
+        Mark stage as completed
+
+        :param str stage: stage name
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.stages[stage] = time.time()
+            self._save()
+
+    def reset(self) -> None:
+        """
+        Forget all completed stages
+        """
+        self.stages = {}
+        self.stale = False
+        if self.enabled:
+            with self._lock:
+                self._save()
+
+    def _save(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "stages": self.stages}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
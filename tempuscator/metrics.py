@@ -0,0 +1,130 @@
+import logging
+import os
+import re
+import time
+import threading
+import contextlib
+from typing import Dict, Iterator, Tuple
+
+_logger = logging.getLogger(__name__)
+
+PREFIX = "tempuscator_"
+_SAMPLE_RE = re.compile(r"^(\w+)(?:\{(.*)\})?\s+(\S+)$")
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics():
+    """
+    Prometheus metrics written to node_exporter textfile collector directory
+
+    Without directory metrics are only kept in memory.
+
+    :param str textfile_dir: node_exporter textfile directory
+    :param str name: file name without .prom extension
+    """
+
+    def __init__(self, textfile_dir: str = None, name: str = "tempuscator") -> None:
+        self.path = os.path.join(textfile_dir, f"{name}.prom") if textfile_dir else None
+        self._metrics: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if self.path and os.path.isfile(self.path):
+            self._load_counters()
+
+    def _load_counters(self) -> None:
+        """
+        Keep counters monotonic across runs of cli tools
+        """
+        types = {}
+        with open(self.path, "r") as f:
+            for line in f:
+                if line.startswith("# TYPE"):
+                    _, _, name, m_type = line.split()
+                    types[name] = m_type
+                    continue
+                m = _SAMPLE_RE.match(line.strip())
+                if not m or types.get(m.group(1)) != "counter":
+                    continue
+                labels = dict(_LABEL_RE.findall(m.group(2) or ""))
+                self._set("counter", m.group(1)[len(PREFIX):], float(m.group(3)), "", labels)
+
+    def _set(self, m_type: str, name: str, value: float, help: str, labels: Dict[str, str], add: bool = False) -> None:
+        with self._lock:
+            metric = self._metrics.setdefault(name, {"type": m_type, "help": help, "samples": {}})
+            if help:
+                metric["help"] = help
+            key = _labels(labels)
+            metric["samples"][key] = metric["samples"].get(key, 0) + value if add else value
+
+    def gauge(self, name: str, value: float, help: str = "", **labels) -> None:
+        """
+        Set gauge value and write metrics file
+        """
+        self._set("gauge", name, value, help, labels)
+        self.write()
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels) -> None:
+        """
+        Increase counter and write metrics file
+        """
+        self._set("counter", name, value, help, labels, add=True)
+        self.write()
+
+    @contextlib.contextmanager
+    def stage(self, stage: str, **labels) -> Iterator[None]:
+        """
+        Measure duration of pipeline stage
+
+        :param str stage: stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = round(time.perf_counter() - start, 3)
+            _logger.debug(f"Stage {stage} took {duration}s")
+            self.gauge("stage_duration_seconds", duration, "Duration of last run of pipeline stage", stage=stage, **labels)
+
+    @contextlib.contextmanager
+    def job(self, **labels) -> Iterator[None]:
+        """
+        Count job result and remember last success time
+        """
+        try:
+            yield
+        except BaseException:
+            self.inc("jobs_total", help="Finished jobs", result="failure", **labels)
+            raise
+        self.inc("jobs_total", help="Finished jobs", result="success", **labels)
+        self.gauge("last_success_timestamp_seconds", time.time(), "Time of last successful job", **labels)
+
+    def write(self) -> None:
+        """
+        Atomically write metrics file
+        """
+        if not self.path:
+            return
+        lines = []
+        with self._lock:
+            for name, metric in sorted(self._metrics.items()):
+                full_name = f"{PREFIX}{name}"
+                if metric["help"]:
+                    lines.append(f"# HELP {full_name} {metric['help']}")
+                lines.append(f"# TYPE {full_name} {metric['type']}")
+                for key, value in sorted(metric["samples"].items()):
+                    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                    lines.append(f"{full_name}{{{labels}}} {value}" if labels else f"{full_name} {value}")
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write("\n".join(lines) + "\n")
+                os.replace(tmp, self.path)
+            except OSError as e:
+                _logger.warning(f"Unable to write metrics to {self.path}: {e}")
@@ -0,0 +1,184 @@
+import logging
+import os
+import json
+import fcntl
+import tempfile
+import heapq
+import hashlib
+import dataclasses
+import sqlalchemy as db
+from typing import Dict, Iterable, List, Tuple
+from tempuscator.sqlscript import Statement
+
+_logger = logging.getLogger(__name__)
+
+# Rows per second used until history has real timings
+DEFAULT_ROWS_PER_SECOND = 50000
+
+
+def statement_digest(query: str) -> str:
+    return hashlib.sha1(query.encode()).hexdigest()
+
+
+@dataclasses.dataclass
+class Slot():
+    """
+    Statement group placed on worker by planner
+
+    :param int worker: worker number
+    :param float start: estimated start, seconds from beginning of masking
+    :param float cost: estimated duration of whole group
+    :param list statements: statements of group in execution order
+    """
+    worker: int
+    start: float
+    cost: float
+    statements: List[Statement]
+
+    @property
+    def end(self) -> float:
+        return self.start + self.cost
+
+
+class CostPlanner():
+    """
+    Estimate masking statement costs and order groups longest first
+
+    Cost of statement is its duration from previous run if known, otherwise
+    EXPLAIN row estimate, or table size if EXPLAIN fails, divided by rows per
+    second rate learned from history.
+
+    :param str history: json file with timings of previous runs, optional
+    """
+
+    def __init__(self, history: str = None) -> None:
+        self.history = history
+        self.statements: Dict[str, dict] = {}
+        self.rate = DEFAULT_ROWS_PER_SECOND
+        if history and os.path.isfile(history):
+            with open(history, "r") as f:
+                self.statements = json.load(f).get("statements", {})
+            _logger.info(f"Loaded timings of {len(self.statements)} statements from {history}")
+        rows = sum(s["rows"] for s in self.statements.values() if s.get("rows"))
+        seconds = sum(s["seconds"] for s in self.statements.values() if s.get("rows"))
+        if rows and seconds:
+            self.rate = max(1, rows / seconds)
+        self._table_rows: Dict[str, int] = {}
+
+    def _explain_rows(self, conn: db.Connection, query: str) -> int:
+        result = conn.execute(db.text(f"EXPLAIN {query}"))
+        columns = list(result.keys())
+        if "rows" not in columns:
+            return 0
+        idx = columns.index("rows")
+        return sum(int(r[idx] or 0) for r in result.fetchall())
+
+    def _tables_rows(self, conn: db.Connection, tables: Iterable[str]) -> int:
+        total = 0
+        for table in tables:
+            if table not in self._table_rows:
+                schema, _, name = table.rpartition(".")
+                query = db.text(
+                    "SELECT TABLE_ROWS FROM information_schema.TABLES "
+                    "WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE()) AND TABLE_NAME = :table")
+                rows = conn.execute(query, {"schema": schema or None, "table": name}).scalar()
+                self._table_rows[table] = int(rows or 0)
+            total += self._table_rows[table]
+        return total
+
+    def estimate(self, conn: db.Connection, query: str, tables: Iterable[str]) -> float:
+        """
+        Estimate statement duration
+
+        :param conn: connection to temporary mysqld
+        :param str query: masking statement
+        :param list tables: tables touched by statement
+
+        :returns: estimated seconds
+        """
+        known = self.statements.get(statement_digest(query))
+        if known:
+            return known["seconds"]
+        try:
+            rows = self._explain_rows(conn, query)
+        except Exception as e:
+            _logger.debug(f"EXPLAIN failed, using table sizes: {query}: {e}")
+            conn.rollback()
+            rows = self._tables_rows(conn, tables)
+        return rows / self.rate
+
+    def plan(self, engine: db.Engine, groups: List[List[Statement]], workers: int) -> List[Slot]:
+        """
+        Longest processing time first schedule of statement groups
+
+        :param engine: sqlalchemy engine of temporary mysqld
+        :param list groups: statement groups, each executed serially
+        :param int workers: number of groups executed in parallel
+
+        :returns: slots sorted by estimated cost, longest first
+        """
+        costs = []
+        with engine.connect() as conn:
+            for group in groups:
+                costs.append(sum(self.estimate(conn, st.sql, st.tables) for st in group))
+        order = sorted(range(len(groups)), key=lambda i: costs[i], reverse=True)
+        loads = [(0.0, w) for w in range(max(1, workers))]
+        slots = []
+        for i in order:
+            load, worker = heapq.heappop(loads)
+            slots.append(Slot(worker=worker, start=load, cost=costs[i], statements=groups[i]))
+            heapq.heappush(loads, (load + costs[i], worker))
+        return slots
+
+    @staticmethod
+    def describe(slots: List[Slot]) -> str:
+        """
+        Format schedule with busiest worker
+
+        :param list slots: planned slots
+
+        :returns: text table
+        """
+        if not slots:
+            return "Nothing to schedule"
+        makespan = max(s.end for s in slots)
+        loads: Dict[int, List[Slot]] = {}
+        for s in slots:
+            loads.setdefault(s.worker, []).append(s)
+        busiest = max(loads, key=lambda w: sum(s.cost for s in loads[w]))
+        busiest_slots = loads[busiest]
+        lines = [f"{'worker':>6} {'start':>10} {'cost':>10} {'queries':>7}  first query"]
+        for s in sorted(slots, key=lambda s: (s.worker, s.start)):
+            query = " ".join(s.statements[0].sql.split())
+            if len(query) > 80:
+                query = f"{query[:77]}..."
+            lines.append(f"{s.worker:>6} {round(s.start, 1):>10} {round(s.cost, 1):>10} {len(s.statements):>7}  {query}")
+        lines.append(f"Estimated makespan: {round(makespan, 1)}s")
+        longest = max(busiest_slots, key=lambda s: s.cost)
+        lines.append(
+            f"Busiest worker: {busiest}, {round(sum(s.cost for s in busiest_slots), 1)}s in {len(busiest_slots)} groups, "
+            f"longest group {round(longest.cost, 1)}s starting with: {' '.join(longest.statements[0].sql.split())[:200]}")
+        return "\n".join(lines)
+
+    def save(self, timings: Dict[str, Tuple[float, int]]) -> None:
+        """
+        Remember statement timings for next run
+
+        :param dict timings: statement digest -> (seconds, rows)
+        """
+        if not self.history or not timings:
+            return
+        directory = os.path.dirname(os.path.abspath(self.history))
+        with open(f"{self.history}.lock", "w") as lock:
+            # Parallel jobs share history, merge with what others saved meanwhile
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.isfile(self.history):
+                with open(self.history, "r") as f:
+                    self.statements = {**json.load(f).get("statements", {}), **self.statements}
+            for digest, (seconds, rows) in timings.items():
+                self.statements[digest] = {"seconds": round(seconds, 3), "rows": rows}
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"statements": self.statements}, f, indent=2)
+            os.replace(tmp, self.history)
+        _logger.debug(f"Saved timings of {len(timings)} statements to {self.history}")
@@ -0,0 +1,146 @@
+import logging
+import os
+import json
+import threading
+import dataclasses
+import sqlalchemy as db
+from typing import Dict, List
+
+_logger = logging.getLogger(__name__)
+
+# SHOW GLOBAL STATUS counters recorded for every statement
+STATUS_COUNTERS = (
+    "Innodb_row_lock_time",
+    "Innodb_row_lock_waits",
+    "Innodb_rows_read",
+    "Innodb_rows_updated",
+    "Innodb_rows_deleted",
+    "Innodb_pages_written",
+)
+
+
+@dataclasses.dataclass
+class StatementProfile():
+    """
+    Cost of one masking statement
+
+    :param str digest: sha1 of statement
+    :param str query: statement text
+    :param float duration: wall time in seconds
+    :param int rows: rows affected
+    :param dict counters: InnoDB status counter deltas, lock time in milliseconds
+    """
+    digest: str
+    query: str
+    duration: float
+    rows: int
+    counters: Dict[str, int] = dataclasses.field(default_factory=dict)
+    failed: bool = False
+
+
+class Profiler():
+    """
+    Collect per statement masking costs and write top N report
+
+    Status counters are global, with parallel masking deltas include work of
+    statements running at the same time. Use serial order for exact numbers.
+
+    :param int top: number of statements in report
+    :param str report: report path, .json writes json, anything else text table
+    """
+
+    def __init__(self, top: int = 20, report: str = None) -> None:
+        self.top = max(1, int(top))
+        self.report = report
+        self.profiles: List[StatementProfile] = []
+        self._lock = threading.Lock()
+
+    def snapshot(self, engine: db.Engine) -> Dict[str, int]:
+        """
+        Read InnoDB status counters
+
+        :param engine: sqlalchemy engine of temporary mysqld
+
+        :returns: dict of counter values
+        """
+        names = ", ".join(f"'{c}'" for c in STATUS_COUNTERS)
+        with engine.connect() as conn:
+            rows = conn.execute(db.text(f"SHOW GLOBAL STATUS WHERE Variable_name IN ({names})")).fetchall()
+        return {name: int(value) for name, value in rows}
+
+    def record(
+            self,
+            digest: str,
+            query: str,
+            duration: float,
+            rows: int,
+            before: Dict[str, int],
+            after: Dict[str, int],
+            failed: bool = False) -> StatementProfile:
+        """
+        Store statement cost
+
+        :returns: StatementProfile
+        """
+        counters = {k: after.get(k, 0) - before.get(k, 0) for k in STATUS_COUNTERS}
+        profile = StatementProfile(
+            digest=digest,
+            query=query,
+            duration=round(duration, 3),
+            rows=rows,
+            counters=counters,
+            failed=failed)
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def slowest(self) -> List[StatementProfile]:
+        """
+        Most expensive statements, slowest first
+        """
+        with self._lock:
+            return sorted(self.profiles, key=lambda p: p.duration, reverse=True)[:self.top]
+
+    def table(self) -> str:
+        """
+        Format slowest statements as text table
+        """
+        lines = [
+            f"{'statement':<12} {'seconds':>10} {'rows':>12} {'lock_ms':>10} "
+            f"{'rows_read':>12} {'rows_upd':>12} {'pages_wr':>10}  query"]
+        for p in self.slowest():
+            c = p.counters
+            query = " ".join(p.query.split())
+            if len(query) > 80:
+                query = f"{query[:77]}..."
+            lines.append(
+                f"{p.digest[:12]:<12} {p.duration:>10} {p.rows:>12} {c['Innodb_row_lock_time']:>10} "
+                f"{c['Innodb_rows_read']:>12} {c['Innodb_rows_updated']:>12} {c['Innodb_pages_written']:>10}  "
+                f"{'FAILED ' if p.failed else ''}{query}")
+        return "\n".join(lines)
+
+    def write(self) -> None:
+        """
+        Log report and write it to report path
+        """
+        if not self.profiles:
+            return
+        total = round(sum(p.duration for p in self.profiles), 3)
+        _logger.info(f"Masking profile, {len(self.profiles)} statements, {total}s total:\n{self.table()}")
+        if not self.report:
+            return
+        tmp = f"{self.report}.tmp"
+        with open(tmp, "w") as f:
+            if os.path.splitext(self.report)[1] == ".json":
+                json.dump(
+                    {
+                        "statements": len(self.profiles),
+                        "total_seconds": total,
+                        "top": [dataclasses.asdict(p) for p in self.slowest()],
+                    },
+                    f,
+                    indent=2)
+            else:
+                f.write(self.table() + "\n")
+        os.replace(tmp, self.report)
+        _logger.info(f"Masking profile written to {self.report}")
@@ -0,0 +1,184 @@
+import logging
+import os
+import stat
+import time
+import uuid
+import threading
+import concurrent.futures
+from typing import List
+
+_logger = logging.getLogger(__name__)
+
+GB = 1 << 30
+REMOVING_SUFFIX = ".removing-"
+
+
+class TokenBucket():
+    """
+    IO budget shared by removal workers
+
+    :param int rate: bytes per second, 0 disables limit
+    """
+
+    def __init__(self, rate: int = 0) -> None:
+        self.rate = rate
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int) -> None:
+        """
+        Wait until amount of bytes fits to budget
+        """
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Remover():
+    """
+    Background removal of large directory trees
+
+    Path is renamed aside first, so it can be reused immediately. Files of
+    a tree are removed in parallel by workers shared with other trees, large
+    files are truncated step by step before unlink to spread freeing of
+    extents, every freed byte is taken from shared IO budget.
+
+    :param int workers: trees walked in parallel and files removed in parallel
+    :param int io_budget: bytes per second freed by all workers, 0 unlimited
+    :param int truncate_step: bytes freed by one truncate of large file
+    """
+
+    def __init__(self, workers: int = 2, io_budget: int = 0, truncate_step: int = GB) -> None:
+        self.workers = max(1, int(workers))
+        self.truncate_step = max(1, int(truncate_step))
+        self.bucket = TokenBucket(rate=io_budget)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="remover")
+        # Separate pool, tree tasks wait for their files and must not occupy file workers
+        self._files = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="remover-file")
+        self._futures: List[concurrent.futures.Future] = []
+        self._lock = threading.Lock()
+
+    def remove(self, path: str, background: bool = True) -> concurrent.futures.Future:
+        """
+        Rename path aside and remove it
+
+        :param str path: file or directory
+        :param bool background: return without waiting for removal
+
+        :returns: future of removal, result is number of freed bytes
+        """
+        aside = path
+        if os.path.lexists(path):
+            aside = f"{path.rstrip('/')}{REMOVING_SUFFIX}{uuid.uuid4().hex[:8]}"
+            os.rename(path, aside)
+            _logger.debug(f"Removing {path} as {aside}")
+        future = self._pool.submit(self._remove_tree, aside)
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()] + [future]
+        if not background:
+            future.result()
+        return future
+
+    def _remove_file(self, path: str, st: os.stat_result) -> int:
+        size = st.st_blocks * 512
+        if stat.S_ISREG(st.st_mode) and st.st_nlink == 1 and size > self.truncate_step:
+            with open(path, "r+b") as f:
+                length = st.st_size
+                while length > 0:
+                    length = max(0, length - self.truncate_step)
+                    self.bucket.consume(self.truncate_step)
+                    os.ftruncate(f.fileno(), length)
+        else:
+            self.bucket.consume(size)
+        os.unlink(path)
+        return size
+
+    def _try_remove_file(self, path: str) -> int:
+        try:
+            return self._remove_file(path, os.lstat(path))
+        except FileNotFoundError:
+            return 0
+        except OSError as e:
+            _logger.warning(f"Unable to remove {path}: {e}")
+            return 0
+
+    def _remove_tree(self, path: str) -> int:
+        start = time.perf_counter()
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            return 0
+        if not stat.S_ISDIR(st.st_mode):
+            return self._remove_file(path, st)
+        futures = []
+        for root, dirs, files in os.walk(path):
+            for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                futures.append(self._files.submit(self._try_remove_file, os.path.join(root, name)))
+        freed = sum(f.result() for f in futures)
+        for root, dirs, _ in os.walk(path, topdown=False):
+            for name in dirs:
+                dir_path = os.path.join(root, name)
+                if not os.path.islink(dir_path):
+                    try:
+                        os.rmdir(dir_path)
+                    except OSError as e:
+                        _logger.warning(f"Unable to remove {dir_path}: {e}")
+        os.rmdir(path)
+        _logger.debug(f"Removed {path}, {freed >> 20} MB in {round(time.perf_counter() - start, 1)}s")
+        return freed
+
+    def pending(self) -> int:
+        """
+        Number of removals not finished yet
+        """
+        with self._lock:
+            return sum(1 for f in self._futures if not f.done())
+
+    def wait(self) -> None:
+        """
+        Wait for all queued removals
+        """
+        with self._lock:
+            futures = list(self._futures)
+        if any(not f.done() for f in futures):
+            _logger.info(f"Waiting for {sum(1 for f in futures if not f.done())} background removals")
+        for f in futures:
+            try:
+                f.result()
+            except OSError as e:
+                _logger.error(f"Background removal failed: {e}")
+
+
+_remover = None
+_remover_lock = threading.Lock()
+
+
+def configure(workers: int = 2, io_budget: int = 0, truncate_step: int = GB) -> Remover:
+    """
+    Replace shared removal service, call before first removal
+
+    :returns: shared Remover
+    """
+    global _remover
+    with _remover_lock:
+        _remover = Remover(workers=workers, io_budget=io_budget, truncate_step=truncate_step)
+        return _remover
+
+
+def get_remover() -> Remover:
+    """
+    Shared removal service, created with defaults on first use
+    """
+    global _remover
+    with _remover_lock:
+        if _remover is None:
+            _remover = Remover()
+        return _remover
@@ -1,17 +1,63 @@
 import logging
 import git
 import os
+import time
+import fcntl
+import hashlib
 import shutil
-from typing import List
+from typing import List, Tuple
+from tempuscator.sqlscript import parse_script
+from tempuscator.remover import get_remover
 
 
 _logger = logging.getLogger(__name__)
 
+FETCH_STAMP = "tempuscator-fetched"
+
 
 class Scruber():
+    """
+    Scrub sql file from git repository
+
+    With cache directory repository is kept as bare mirror shared by all jobs,
+    mirror is fetched only when last fetch is older than ttl and sql file is
+    read directly from git objects. Without cache repository is cloned to dst
+    and removed when object is destroyed. Without url sql_file is read as
+    local file.
 
-    def __init__(self, url: str, dst: str, sql_file: str) -> None:
-        self.dst = dst
+    :param str url: repository url, None for local sql file
+    :param str dst: clone path, not used with cache
+    :param str sql_file: path of sql file inside repository
+    :param str cache_dir: directory with bare mirrors
+    :param int ttl: seconds since last fetch when mirror is considered fresh
+    :param str ref: branch, tag or commit, default HEAD
+    """
+
+    def __init__(
+            self,
+            url: str,
+            dst: str,
+            sql_file: str,
+            cache_dir: str = None,
+            ttl: int = 300,
+            ref: str = None) -> None:
+        self.url = url
+        self.ref = ref or "HEAD"
+        self.sql_file = sql_file
+        self.dst = None if cache_dir else dst
+        self.content = None
+        if not url:
+            self.dst = None
+            self.sha = None
+            self.source_file = sql_file
+            if not os.path.isfile(self.source_file):
+                raise FileNotFoundError(f"{self.source_file} file not found")
+            _logger.info(f"Using local {sql_file}")
+            return
+        if cache_dir:
+            self.content, self.sha = self.__from_cache(cache_dir=cache_dir, ttl=ttl)
+            _logger.info(f"Using {sql_file} from {url} at {self.sha}")
+            return
         if os.path.isdir(self.dst):
             _logger.debug(f"{dst} exists, pulling changes")
             repo = git.Repo(path=self.dst)
@@ -19,14 +65,55 @@ class Scruber():
         else:
             _logger.debug(f"{dst} doesn't exist, cloning repo")
             repo = git.Repo.clone_from(url=url, to_path=self.dst)
+        if ref:
+            repo.git.checkout(ref)
+        self.sha = repo.head.commit.hexsha
+        _logger.info(f"Using {sql_file} from {url} at {self.sha}")
         self.source_file = os.path.join(dst, sql_file)
         if not os.path.exists(self.source_file):
             raise FileNotFoundError(f"{self.source_file} file not found")
 
     def __del__(self) -> None:
-        if os.path.isdir(self.dst):
-            shutil.rmtree(self.dst)
+        if self.dst and os.path.isdir(self.dst):
+            get_remover().remove(self.dst)
 
-    def get_queries(self) -> List[str]:
+    def __from_cache(self, cache_dir: str, ttl: int) -> Tuple[str, str]:
+        os.makedirs(cache_dir, mode=0o750, exist_ok=True)
+        mirror = os.path.join(cache_dir, f"{hashlib.sha1(self.url.encode()).hexdigest()[:16]}.git")
+        stamp = os.path.join(mirror, FETCH_STAMP)
+        with open(f"{mirror}.lock", "w") as lock:
+            # Workers share mirror, only one of them clones or fetches it
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not os.path.isdir(mirror):
+                _logger.info(f"Creating mirror of {self.url} in {mirror}")
+                tmp = f"{mirror}.tmp"
+                if os.path.isdir(tmp):
+                    shutil.rmtree(tmp)
+                git.Repo.clone_from(url=self.url, to_path=tmp, mirror=True)
+                os.rename(tmp, mirror)
+                repo = git.Repo(path=mirror)
+                open(stamp, "w").close()
+            else:
+                repo = git.Repo(path=mirror)
+                age = time.time() - os.path.getmtime(stamp) if os.path.isfile(stamp) else None
+                if age is None or age > ttl:
+                    _logger.debug(f"Fetching {self.url} to {mirror}")
+                    repo.git.fetch("--prune", "origin")
+                    open(stamp, "w").close()
+                else:
+                    _logger.debug(f"Mirror {mirror} fetched {round(age)}s ago, skipping fetch")
+            commit = repo.commit(self.ref)
+            try:
+                blob = commit.tree / self.sql_file
+            except KeyError:
+                raise FileNotFoundError(f"{self.sql_file} not found in {self.url} at {commit.hexsha}")
+            return blob.data_stream.read().decode(), commit.hexsha
+
+    def get_script(self) -> str:
+        if self.content is not None:
+            return self.content
         with open(self.source_file, "r") as f:
-            return f.read().split("\n")[:-1]
+            return f.read()
+
+    def get_queries(self) -> List[str]:
+        return [s.sql for s in parse_script(self.get_script().splitlines(keepends=True))]
@@ -0,0 +1,166 @@
+import logging
+import os
+import re
+import configparser
+import dataclasses
+import psutil
+from typing import Dict
+
+_logger = logging.getLogger(__name__)
+
+MB = 1 << 20
+GB = 1 << 30
+SIZE_FIELDS = ("memory", "buffer_pool_size", "log_buffer_size", "prepare_memory")
+# Storage type: (innodb-io-capacity, innodb-io-capacity-max)
+IO_CAPACITY = {
+    "nvme": (20000, 40000),
+    "ssd": (5000, 10000),
+    "hdd": (200, 2000),
+    "unknown": (3000, 6000),
+}
+
+
+def parse_size(value: str) -> int:
+    """
+    Parse size with optional K, M, G or T suffix
+
+    :param str value: size, for example 512M
+
+    :returns: size in bytes
+    """
+    m = re.fullmatch(r"\s*(\d+)\s*([KMGT]?)B?\s*", str(value), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"Wrong size: {value}")
+    return int(m.group(1)) << (10 * " KMGT".index(m.group(2).upper() or " "))
+
+
+def format_size(value: int) -> str:
+    """
+    Format bytes as megabytes for mysqld and xtrabackup options
+    """
+    return f"{max(1, value // MB)}M"
+
+
+def storage_type(path: str) -> str:
+    """
+    Detect storage type of block device holding path
+
+    :param str path: file or directory, first existing parent is used
+
+    :returns: nvme, ssd, hdd or unknown
+    """
+    while not os.path.exists(path) and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+    dev = os.stat(path).st_dev
+    sys_dev = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    if os.path.isfile(os.path.join(sys_dev, "partition")):
+        sys_dev = os.path.dirname(sys_dev)
+    slaves = os.path.join(sys_dev, "slaves")
+    if os.path.isdir(slaves) and os.listdir(slaves):
+        sys_dev = os.path.realpath(os.path.join(slaves, sorted(os.listdir(slaves))[0]))
+        if os.path.isfile(os.path.join(sys_dev, "partition")):
+            sys_dev = os.path.dirname(sys_dev)
+    rotational = os.path.join(sys_dev, "queue", "rotational")
+    if not os.path.isfile(rotational):
+        return "unknown"
+    if os.path.basename(sys_dev).startswith("nvme"):
+        return "nvme"
+    with open(rotational, "r") as f:
+        return "hdd" if f.read().strip() == "1" else "ssd"
+
+
+def load_overrides(path: str, section: str = "resources") -> Dict[str, str]:
+    """
+    Read resource overrides from ini config file
+
+    :param str path: config file path
+    :param str section: section name
+
+    :returns: dict of overrides, empty if file or section missing
+    """
+    if not path or not os.path.isfile(path):
+        return {}
+    conf = configparser.RawConfigParser()
+    with open(path, "r") as f:
+        conf.read_file(f)
+    if not conf.has_section(section):
+        return {}
+    return dict(conf[section])
+
+
+@dataclasses.dataclass
+class ResourceProfile():
+    """
+    Resources for temporary mysqld and xtrabackup prepare derived from host
+
+    :param int cpus: cpus available for one job
+    :param int memory: memory in bytes available for one job
+    :param str storage: storage type of datadir
+    """
+    cpus: int
+    memory: int
+    storage: str
+    buffer_pool_size: int
+    buffer_pool_instances: int
+    log_buffer_size: int
+    io_capacity: int
+    io_capacity_max: int
+    page_cleaners: int
+    thread_pool_size: int
+    prepare_memory: int
+    prepare_parallel: int
+
+    @classmethod
+    def detect(cls, path: str, share: int = 1, overrides: Dict[str, str] = None) -> "ResourceProfile":
+        """
+        Build profile from host resources
+
+        :param str path: datadir path, used for storage detection
+        :param int share: number of jobs sharing host
+        :param dict overrides: values from config file, take precedence
+
+        :returns: ResourceProfile
+        """
+        share = max(1, int(share))
+        overrides = dict(overrides or {})
+        # Base inputs first, derived values follow overridden cpus and memory
+        cpus = int(overrides.pop("cpus")) if "cpus" in overrides else max(1, (psutil.cpu_count() or 1) // share)
+        memory = parse_size(overrides.pop("memory")) if "memory" in overrides else psutil.virtual_memory().total // share
+        storage = overrides.pop("storage", None) or storage_type(path)
+        if "buffer_pool_size" in overrides:
+            buffer_pool = parse_size(overrides.pop("buffer_pool_size"))
+        else:
+            buffer_pool = max(128 * MB, (memory // 2) // (128 * MB) * (128 * MB))
+        instances = min(64, max(1, buffer_pool // GB))
+        io_capacity, io_capacity_max = IO_CAPACITY.get(storage, IO_CAPACITY["unknown"])
+        values = {
+            "cpus": cpus,
+            "memory": memory,
+            "storage": storage,
+            "buffer_pool_size": buffer_pool,
+            "buffer_pool_instances": instances,
+            "log_buffer_size": 64 * MB if memory < 16 * GB else 256 * MB,
+            "io_capacity": io_capacity,
+            "io_capacity_max": io_capacity_max,
+            "page_cleaners": min(instances, cpus),
+            "thread_pool_size": cpus,
+            "prepare_memory": max(128 * MB, memory // 2),
+            "prepare_parallel": cpus,
+        }
+        for key, value in overrides.items():
+            if key not in values:
+                _logger.warning(f"Unknown resource override: {key}")
+                continue
+            values[key] = parse_size(value) if key in SIZE_FIELDS else int(value)
+        profile = cls(**values)
+        profile.log()
+        return profile
+
+    def log(self) -> None:
+        _logger.info(
+            f"Resource profile: cpus={self.cpus} memory={format_size(self.memory)} storage={self.storage} "
+            f"buffer_pool={format_size(self.buffer_pool_size)}x{self.buffer_pool_instances} "
+            f"log_buffer={format_size(self.log_buffer_size)} "
+            f"io_capacity={self.io_capacity}/{self.io_capacity_max} "
+            f"page_cleaners={self.page_cleaners} thread_pool={self.thread_pool_size} "
+            f"prepare_memory={format_size(self.prepare_memory)} prepare_parallel={self.prepare_parallel}")
@@ -0,0 +1,203 @@
+import logging
+import time
+import threading
+import concurrent.futures
+import sqlalchemy as db
+from typing import Dict, List, Tuple
+from tempuscator.helpers import execute_query
+from tempuscator.exceptions import MaskingError
+from tempuscator.chunker import RangeChunker
+from tempuscator.journal import StageJournal
+from tempuscator.metrics import Metrics
+from tempuscator.profiler import Profiler
+from tempuscator.planner import CostPlanner, Slot, statement_digest
+from tempuscator.sqlscript import Statement
+
+_logger = logging.getLogger(__name__)
+
+ORDER_TABLE = "table"
+ORDER_SERIAL = "serial"
+
+
+class MaskScheduler():
+    """
+    Table aware masking statements scheduler
+
+    Statements touching the same tables are executed one after another in
+    file order, statements on unrelated tables run in parallel.
+
+    :param int workers: number of table groups processed in parallel
+    :param int max_in_flight: global cap for queries executed at the same time, default workers
+    :param str order: table - parallel by table, serial - one statement at a time in file order
+    :param chunker: optional primary key range chunker, slices of one statement run in parallel
+    :param journal: optional stage journal, completed statements are skipped on resume
+    :param metrics: optional metrics, duration of every statement is recorded
+    :param profiler: optional profiler, rows and InnoDB counters of every statement are recorded
+    :param planner: optional cost planner, groups are dispatched longest first
+    """
+
+    def __init__(
+            self,
+            workers: int = 4,
+            max_in_flight: int = None,
+            order: str = ORDER_TABLE,
+            chunker: RangeChunker = None,
+            journal: StageJournal = None,
+            metrics: Metrics = None,
+            profiler: Profiler = None,
+            planner: CostPlanner = None) -> None:
+        if order not in (ORDER_TABLE, ORDER_SERIAL):
+            raise ValueError(f"order must be one from: {ORDER_TABLE} {ORDER_SERIAL}")
+        self.workers = max(1, int(workers))
+        self.max_in_flight = max(1, int(max_in_flight)) if max_in_flight else self.workers
+        self.order = order
+        self.chunker = chunker
+        self.journal = journal or StageJournal()
+        self.metrics = metrics or Metrics()
+        self.profiler = profiler
+        self.planner = planner
+        self.timings: Dict[str, Tuple[float, int]] = {}
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+
+    def groups(self, statements: List[Statement]) -> List[List[Statement]]:
+        """
+        Split statements to groups which must be executed serially
+
+        :param list statements: parsed masking statements in file order
+
+        :returns: list of statement groups, each keeping file order
+        """
+        if self.order == ORDER_SERIAL:
+            return [list(statements)] if statements else []
+        parent: Dict[str, str] = {}
+
+        def find(t: str) -> str:
+            while parent[t] != t:
+                parent[t] = parent[parent[t]]
+                t = parent[t]
+            return t
+
+        s_tables = []
+        for st in statements:
+            tables = st.tables
+            if not tables:
+                _logger.debug(f"No tables detected in: {st.sql}")
+                tables = [""]
+            for t in tables:
+                parent.setdefault(t, t)
+            first, *rest = tables
+            for t in rest:
+                parent[find(t)] = find(first)
+            s_tables.append(first)
+        groups: Dict[str, List[Statement]] = {}
+        for st, t in zip(statements, s_tables):
+            groups.setdefault(find(t), []).append(st)
+        return list(groups.values())
+
+    def _execute(self, engine: db.Engine, query: str) -> int:
+        with self._in_flight:
+            _logger.debug(f"Executing: {query}")
+            return execute_query(engine=engine, query=query, dispose=False)
+
+    def _run_slices(self, engine: db.Engine, slices: List[str]) -> Tuple[List[str], int]:
+        failed = []
+        rows = 0
+        futures = {self._slice_pool.submit(self._execute, engine, s): s for s in slices}
+        for f in concurrent.futures.as_completed(futures):
+            if f.exception():
+                _logger.error(f"Query failed: {futures[f]}: {f.exception()}")
+                failed.append(futures[f])
+            else:
+                rows += f.result()
+        return failed, rows
+
+    def _run_group(self, engine: db.Engine, group: List[Statement]) -> List[str]:
+        failed = []
+        for st in group:
+            q = st.sql
+            digest = statement_digest(q)
+            stage = f"mask:{digest}"
+            if self.journal.done(stage):
+                continue
+            before = self.profiler.snapshot(engine) if self.profiler else None
+            start = time.perf_counter()
+            rows = 0
+            try:
+                slices = self.chunker.split(engine=engine, statement=st) if self.chunker else []
+                if slices:
+                    q_failed, rows = self._run_slices(engine=engine, slices=slices)
+                else:
+                    rows = self._execute(engine=engine, query=q)
+                    q_failed = []
+            except Exception as e:
+                _logger.error(f"Query failed: {q}: {e}")
+                q_failed = [q]
+            duration = time.perf_counter() - start
+            failed.extend(q_failed)
+            _logger.debug(f"Statement {digest[:12]} took {round(duration, 3)}s, rows: {rows}: {q}")
+            self.metrics.gauge(
+                "mask_statement_duration_seconds",
+                round(duration, 3),
+                "Duration of masking statement",
+                statement=digest[:12])
+            if self.profiler:
+                self.profiler.record(
+                    digest=digest,
+                    query=q,
+                    duration=duration,
+                    rows=rows,
+                    before=before,
+                    after=self.profiler.snapshot(engine),
+                    failed=bool(q_failed))
+            if not q_failed:
+                self.timings[digest] = (duration, rows)
+            if not q_failed and self.journal.enabled:
+                # innodb-flush-log-at-trx-commit=0, make statement durable before journaling it
+                execute_query(engine=engine, query="FLUSH ENGINE LOGS", dispose=False)
+                self.journal.complete(stage)
+        return failed
+
+    def plan(self, engine: db.Engine, statements: List[Statement]) -> List[Slot]:
+        """
+        Estimate schedule of masking statements without executing them
+
+        :param engine: sqlalchemy engine of temporary mysqld
+        :param list statements: parsed masking statements in file order
+
+        :returns: planned slots, longest group first
+        """
+        planner = self.planner or CostPlanner()
+        return planner.plan(engine=engine, groups=self.groups(statements), workers=self.workers)
+
+    def run(self, engine: db.Engine, statements: List[Statement]) -> None:
+        """
+        Execute masking statements
+
+        :param engine: sqlalchemy engine of temporary mysqld
+        :param list statements: parsed masking statements in file order
+
+        :raises MaskingError: if any of statements failed
+        """
+        if self.planner:
+            slots = self.plan(engine=engine, statements=statements)
+            _logger.info(f"Masking plan:\n{CostPlanner.describe(slots)}")
+            groups = [s.statements for s in slots]
+        else:
+            groups = self.groups(statements)
+        _logger.info(f"Scheduling {len(statements)} queries in {len(groups)} groups on {self.workers} workers")
+        failed = []
+        self._slice_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_in_flight)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = [pool.submit(self._run_group, engine, g) for g in groups]
+                for f in concurrent.futures.as_completed(futures):
+                    failed.extend(f.result())
+        finally:
+            self._slice_pool.shutdown()
+            if self.profiler:
+                self.profiler.write()
+            if self.planner:
+                self.planner.save(self.timings)
+        engine.dispose()
+        if failed:
+            raise MaskingError(f"{len(failed)} masking queries failed")
@@ -0,0 +1,228 @@
+import logging
+import os
+import re
+import json
+import hashlib
+import tempfile
+import dataclasses
+from typing import Iterable, Iterator, List, Set
+from tempuscator.exceptions import SqlScriptError
+
+_logger = logging.getLogger(__name__)
+
+# Bump when parsing result changes, old cache entries are ignored
+PARSER_VERSION = 2
+
+_IDENT = r"(?:`[^`]+`|\w+)(?:\s*\.\s*(?:`[^`]+`|\w+))?"
+_TABLE_RE = re.compile(
+    r"\b(?:FROM|JOIN|INTO|TABLE)\s+(" + _IDENT + r")",
+    re.IGNORECASE)
+_UPDATE_RE = re.compile(
+    r"\bUPDATE\s+(?:LOW_PRIORITY\s+)?(?:IGNORE\s+)?(.+?)\s+SET\b",
+    re.IGNORECASE | re.DOTALL)
+_ALIAS_RE = re.compile(r"^\s*(" + _IDENT + r")")
+_LITERAL_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_KIND_RE = re.compile(r"^\s*(?:/\*.*?\*/\s*)*(\w+)", re.DOTALL)
+_DELIMITER_RE = re.compile(r"^\s*DELIMITER\s+(\S+)", re.IGNORECASE)
+_SUBQUERY_RE = re.compile(r"\s*SELECT\b", re.IGNORECASE)
+# Line starting a statement, SET only as session statement, not as UPDATE ... SET continuation
+_LINE_STATEMENT_RE = re.compile(
+    r"^\s*(?:UPDATE|DELETE|INSERT|REPLACE|TRUNCATE|ALTER|CREATE|DROP|RENAME|CALL|SELECT|OPTIMIZE|ANALYZE"
+    r"|SET\s+(?:@|SESSION\b|GLOBAL\b|LOCAL\b|NAMES\b))\b",
+    re.IGNORECASE)
+
+
+def _normalize(name: str) -> str:
+    return ".".join(p.strip().strip("`") for p in name.split(".")).lower()
+
+
+def _in_expression(query: str, pos: int) -> bool:
+    """
+    Check if pos is inside parentheses which are not a subquery, like TRIM(x FROM y)
+    """
+    opened: List[int] = []
+    for i, c in enumerate(query[:pos]):
+        if c == "(":
+            opened.append(i)
+        elif c == ")" and opened:
+            opened.pop()
+    return bool(opened) and not _SUBQUERY_RE.match(query, opened[-1] + 1)
+
+
+def query_tables(query: str) -> Set[str]:
+    """
+    Find tables touched by query
+
+    :param str query: SQL statement
+
+    :returns: set of lower cased table names, schema qualified if query qualifies them
+    """
+    query = _LITERAL_RE.sub("''", query)
+    tables = set()
+    update = _UPDATE_RE.search(query)
+    if update:
+        for ref in re.split(r",|\bJOIN\b", update.group(1), flags=re.IGNORECASE):
+            m = _ALIAS_RE.match(ref)
+            if m:
+                tables.add(_normalize(m.group(1)))
+    for m in _TABLE_RE.finditer(query):
+        if _in_expression(query, m.start()):
+            continue
+        tables.add(_normalize(m.group(1)))
+    return tables
+
+
+def split_statements(lines: Iterable[str], delimiter: str = ";") -> Iterator[str]:
+    """
+    Split SQL script to statements
+
+    Strings, quoted identifiers, comments and mysql client DELIMITER command
+    are handled, comments are dropped except executable /*! */ and hint /*+ */ ones.
+    Script without any delimiter where every line starts a statement is split
+    by lines.
+
+    :param lines: script lines, for example open file
+    :param str delimiter: initial statement delimiter
+
+    :raises SqlScriptError: if string, identifier or comment isn't terminated
+
+    :returns: iterator of statements without delimiter
+    """
+    buf: List[str] = []
+    state = None
+    number = 0
+    split = False
+    for number, line in enumerate(lines, 1):
+        if state is None and not "".join(buf).strip():
+            m = _DELIMITER_RE.match(line)
+            if m:
+                delimiter = m.group(1)
+                split = True
+                buf = []
+                continue
+        i = 0
+        n = len(line)
+        while i < n:
+            c = line[i]
+            if state in ("'", '"', "`"):
+                buf.append(c)
+                if c == "\\" and state != "`" and i + 1 < n:
+                    buf.append(line[i + 1])
+                    i += 2
+                    continue
+                if c == state:
+                    if i + 1 < n and line[i + 1] == state:
+                        buf.append(state)
+                        i += 2
+                        continue
+                    state = None
+                i += 1
+                continue
+            if state in ("comment", "hint"):
+                if line.startswith("*/", i):
+                    buf.append("*/" if state == "hint" else " ")
+                    state = None
+                    i += 2
+                    continue
+                if state == "hint":
+                    buf.append(c)
+                i += 1
+                continue
+            if line.startswith("/*", i):
+                if line.startswith(("/*!", "/*+"), i):
+                    state = "hint"
+                    buf.append("/*")
+                else:
+                    state = "comment"
+                i += 2
+                continue
+            if c == "#" or (line.startswith("--", i) and (i + 2 == n or line[i + 2].isspace())):
+                buf.append("\n")
+                break
+            if line.startswith(delimiter, i):
+                statement = "".join(buf).strip()
+                if statement:
+                    yield statement
+                split = True
+                buf = []
+                i += len(delimiter)
+                continue
+            if c in ("'", '"', "`"):
+                state = c
+            buf.append(c)
+            i += 1
+    if state is not None:
+        raise SqlScriptError(f"Unterminated {'comment' if state in ('comment', 'hint') else state} at end of script, line {number}")
+    statement = "".join(buf).strip()
+    if not statement:
+        return
+    lines = [line for line in statement.splitlines() if line.strip()]
+    if not split and len(lines) > 1:
+        if all(_LINE_STATEMENT_RE.match(line) for line in lines):
+            _logger.warning(f"No '{delimiter}' in script, treating each of {len(lines)} lines as statement")
+            yield from (line.strip() for line in lines)
+            return
+        _logger.warning(f"No '{delimiter}' in script, {len(lines)} lines parsed as one statement")
+    yield statement
+
+
+@dataclasses.dataclass
+class Statement():
+    """
+    Parsed script statement
+
+    :param str sql: statement text without delimiter and comments
+    :param str kind: upper cased first keyword, for example UPDATE
+    :param list tables: sorted tables touched by statement
+    """
+    sql: str
+    kind: str
+    tables: List[str]
+
+    @classmethod
+    def parse(cls, sql: str) -> "Statement":
+        m = _KIND_RE.match(sql)
+        return cls(sql=sql, kind=m.group(1).upper() if m else "", tables=sorted(query_tables(sql)))
+
+
+def parse_script(lines: Iterable[str]) -> List[Statement]:
+    """
+    Parse SQL script
+
+    :param lines: script lines
+
+    :returns: list of statements in script order
+    """
+    return [Statement.parse(s) for s in split_statements(lines)]
+
+
+def load_script(content: str, cache_dir: str = None) -> List[Statement]:
+    """
+    Parse SQL script, reusing cached result for the same content
+
+    :param str content: script text
+    :param str cache_dir: directory with parsed scripts, keyed by sha256 of content
+
+    :returns: list of statements in script order
+    """
+    if not cache_dir:
+        return parse_script(content.splitlines(keepends=True))
+    key = hashlib.sha256(content.encode()).hexdigest()
+    path = os.path.join(cache_dir, f"{key}.json")
+    if os.path.isfile(path):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == PARSER_VERSION:
+                _logger.debug(f"Using parsed script from {path}")
+                return [Statement(**s) for s in data["statements"]]
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            _logger.warning(f"Ignoring broken script cache {path}: {e}")
+    statements = parse_script(content.splitlines(keepends=True))
+    os.makedirs(cache_dir, mode=0o750, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump({"version": PARSER_VERSION, "statements": [dataclasses.asdict(s) for s in statements]}, f)
+    os.replace(tmp, path)
+    _logger.debug(f"Parsed {len(statements)} statements, cached in {path}")
+    return statements
@@ -0,0 +1,204 @@
+import logging
+import queue
+import shlex
+import subprocess
+import threading
+from typing import BinaryIO, List, Union
+from tempuscator.constants import SSH_PATH
+
+_logger = logging.getLogger(__name__)
+
+
+class RemoteSink():
+    """
+    Remote file written through ssh, fed from bounded buffer
+
+    Host never slows down others: when its buffer is full, rest of stream is
+    sent from local archive after the stream ends, or host is detached if
+    there is no local archive. Stream goes to dst.part, renamed to dst only
+    when complete.
+
+    :param str host: address of remote server
+    :param str user: ssh user
+    :param str dst: remote file path
+    :param int buffer_chunks: max chunks buffered for this host
+    """
+
+    def __init__(
+            self,
+            host: str,
+            user: str,
+            dst: str,
+            buffer_chunks: int = 64,
+            os_user: Union[str, int] = None,
+            os_group: Union[str, int] = None) -> None:
+        self.host = host
+        self.user = user
+        self.dst = dst
+        self.part = f"{dst}.part"
+        self.os_user = os_user
+        self.os_group = os_group
+        self.failed = False
+        self.written = 0
+        self.queued = 0
+        self.spill = None
+        self.spill_offset = None
+        self._queue = queue.Queue(maxsize=buffer_chunks)
+        self._proc = None
+        self._thread = None
+
+    def __str__(self) -> str:
+        return f"{self.user}@{self.host}:{self.dst}"
+
+    def _ssh(self, command: str) -> List[str]:
+        cli = [SSH_PATH]
+        cli.append("-o")
+        cli.append("UserKnownHostsFile=/dev/null")
+        cli.append("-o")
+        cli.append("StrictHostKeyChecking=no")
+        cli.append("-o")
+        cli.append("Compression=no")
+        cli.append(f"{self.user}@{self.host}")
+        cli.append(command)
+        return cli
+
+    def start(self, spill: str = None) -> None:
+        """
+        Start remote writer
+
+        :param str spill: local archive with the same stream, used when buffer is full
+        """
+        self.spill = spill
+        cli = self._ssh(f"cat > {shlex.quote(self.part)}")
+        _logger.debug(f"Executing: {' '.join(cli)}")
+        self._proc = subprocess.Popen(
+            cli,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            user=self.os_user,
+            group=self.os_group)
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def _write(self, data: bytes) -> None:
+        if self.failed:
+            return
+        try:
+            self._proc.stdin.write(data)
+            self.written += len(data)
+        except (BrokenPipeError, OSError) as e:
+            _logger.error(f"Streaming to {self} failed: {e}")
+            self.failed = True
+
+    def _writer(self) -> None:
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            self._write(data)
+        if self.spill_offset is not None and not self.failed:
+            _logger.info(f"Sending rest of stream to {self} from {self.spill}")
+            with open(self.spill, "rb") as f:
+                f.seek(self.spill_offset)
+                while not self.failed:
+                    data = f.read(4 << 20)
+                    if not data:
+                        break
+                    self._write(data)
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+
+    def put(self, data: bytes) -> None:
+        """
+        Queue data for host, never blocks
+        """
+        if self.failed or self.spill_offset is not None:
+            return
+        try:
+            self._queue.put_nowait(data)
+            self.queued += len(data)
+        except queue.Full:
+            if self.spill:
+                _logger.warning(f"{self} buffer full, rest will be sent from {self.spill}")
+                self.spill_offset = self.queued
+                return
+            _logger.warning(f"{self} buffer full, detaching")
+            self.failed = True
+            self._proc.kill()
+            self._drain()
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def finish(self) -> None:
+        """
+        Mark end of stream, writer sends what is left
+        """
+        if self.failed:
+            self._drain()
+        self._queue.put(None)
+
+    def close(self) -> bool:
+        """
+        Wait for remote side and move complete file to dst
+
+        :returns: True if whole stream was written
+        """
+        self._thread.join()
+        self._proc.wait()
+        if self._proc.returncode != 0:
+            self.failed = True
+        if not self.failed:
+            rename = subprocess.run(
+                self._ssh(f"mv {shlex.quote(self.part)} {shlex.quote(self.dst)}"),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                user=self.os_user,
+                group=self.os_group)
+            self.failed = rename.returncode != 0
+        _logger.debug(f"{self} finished, written: {self.written}, failed: {self.failed}")
+        return not self.failed
+
+
+class StreamTee():
+    """
+    Copy stream to optional local file and remote sinks at the same time
+
+    :param list sinks: remote sinks
+    :param local: local file object or None
+    :param int chunk_size: read size
+    """
+
+    def __init__(self, sinks: List[RemoteSink], local: BinaryIO = None, chunk_size: int = 4 << 20) -> None:
+        self.sinks = sinks
+        self.local = local
+        self.chunk_size = chunk_size
+
+    def run(self, stream: BinaryIO) -> List[RemoteSink]:
+        """
+        Pump stream until EOF
+
+        :returns: list of sinks which didn't receive whole stream
+        """
+        spill = getattr(self.local, "name", None) if self.local else None
+        for sink in self.sinks:
+            sink.start(spill=spill if isinstance(spill, str) else None)
+        while True:
+            data = stream.read(self.chunk_size)
+            if not data:
+                break
+            if self.local:
+                self.local.write(data)
+                # Sinks behind the stream read rest of it from local file
+                self.local.flush()
+            for sink in self.sinks:
+                sink.put(data)
+        for sink in self.sinks:
+            sink.finish()
+        return [s for s in self.sinks if not s.close()]
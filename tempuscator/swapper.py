@@ -2,17 +2,26 @@ import dataclasses
 import psutil
 import os
 import subprocess
-from tempuscator.exceptions import MysqldNotRunning, MysqlAccessDeniend, MyCnfConfigError
-from tempuscator.helpers import execute_query
-from typing import List
+from tempuscator.exceptions import MysqldNotRunning, MysqlAccessDeniend, MyCnfConfigError, MysqldStartTimeout, InsufficientSpace
+from tempuscator.engines import CONNECT_ERRORS
+from tempuscator.fscopy import copy_tree, free_space, same_device, tree_size
+from tempuscator.resources import MB
+from tempuscator.remover import get_remover
+from typing import List, Optional, Tuple
 import sqlalchemy as db
 import logging
 import datetime
-import shutil
+import time
+import concurrent.futures
 import configparser
+from tempuscator.grants import GrantExporter, DEFAULT_SOCKET
 from tempuscator.constants import (
     PT_SHOW_GRANTS,
-    SYSTEMCTL_PATH
+    SYSTEMCTL_PATH,
+    GRANTS_NATIVE,
+    GRANTS_PT,
+    EXTRACT_AUTO,
+    SWAP_DST_DIR
 )
 
 _logger = logging.getLogger(__name__)
@@ -24,12 +33,30 @@ class SwapDirs():
     user: str = dataclasses.field(default=None)
     password: str = dataclasses.field(default=None, repr=False)
     grants: List[str] = dataclasses.field(init=False, default_factory=list, repr=False)
-    dst_dir: str = dataclasses.field(default="/var/lib/mysql")
+    dst_dir: str = dataclasses.field(default=SWAP_DST_DIR)
     backup: bool = dataclasses.field(default=False)
     mysqld_running: bool = dataclasses.field(default=False)
+    socket: str = dataclasses.field(default=DEFAULT_SOCKET)
+    grants_source: str = dataclasses.field(default=GRANTS_NATIVE)
+    grants_workers: int = dataclasses.field(default=4)
+    grants_cache: str = dataclasses.field(default=None)
+    grants_ignore: List[str] = dataclasses.field(default_factory=lambda: ["root@localhost"])
+    grants_include: List[str] = dataclasses.field(default_factory=list)
+    start_timeout: float = dataclasses.field(default=3600)
+    copy_workers: int = dataclasses.field(default=8)
+    old_dir: str = dataclasses.field(init=False, default=None)
+    stop_issued: float = dataclasses.field(init=False, default=None, repr=False)
+    downtime: float = dataclasses.field(init=False, default=None)
+    ready: bool = dataclasses.field(init=False, default=False)
 
     def __post_init__(self):
-        if not os.path.exists(PT_SHOW_GRANTS):
+        if self.src_dir in (None, EXTRACT_AUTO):
+            self.src_dir = self.staging_path(dst_dir=self.dst_dir)
+        if not same_device(self.src_dir, os.path.dirname(self.dst_dir.rstrip("/"))):
+            _logger.warning(f"{self.src_dir} is not on the same filesystem as {self.dst_dir}, datadir will be copied before swap")
+        if self.grants_source not in (GRANTS_NATIVE, GRANTS_PT):
+            raise ValueError(f"grants_source must be one from: {GRANTS_NATIVE} {GRANTS_PT}")
+        if self.grants_source == GRANTS_PT and not os.path.exists(PT_SHOW_GRANTS):
             raise FileNotFoundError(f"{PT_SHOW_GRANTS} not found!")
         self.mysqld_running = "mysqld" in (p.name() for p in psutil.process_iter())
         if not self.mysqld_running:
@@ -47,13 +74,34 @@ class SwapDirs():
                 _logger.debug(f"Mysql user: {self.user}")
             if u_conf.has_option("client", "password"):
                 self.password = u_conf.get("client", "password") if u_conf.has_option("client", "password") else None
+            # Explicit --mysql-socket wins over .my.cnf
+            if u_conf.has_option("client", "socket") and self.socket == DEFAULT_SOCKET:
+                self.socket = u_conf.get("client", "socket")
+        if self.grants_source == GRANTS_PT:
+            self.grants = self.__pt_show_grants()
+            return
+        exporter = GrantExporter(
+            socket=self.socket,
+            user=self.user,
+            password=self.password,
+            workers=self.grants_workers,
+            ignore=self.grants_ignore,
+            include=self.grants_include,
+            cache_dir=self.grants_cache)
+        try:
+            self.grants = exporter.grants()
+        except db.exc.OperationalError as e:
+            raise MysqlAccessDeniend(f"Unable to connect to mysql: {e.orig}")
+
+    def __pt_show_grants(self) -> List[str]:
         cli = [PT_SHOW_GRANTS]
         cli.append("--database")
         cli.append("mysql")
         cli.append("--host")
         cli.append("localhost")
-        cli.append("--ignore")
-        cli.append("root@localhost")
+        if self.grants_ignore:
+            cli.append("--ignore")
+            cli.append(",".join(self.grants_ignore))
         if self.user:
             cli.append("--user")
             cli.append(self.user)
@@ -65,20 +113,83 @@ class SwapDirs():
         if err:
             raise MysqlAccessDeniend("Unable to connect to mysql")
         perms = out.decode().split("\n")[:-1]
-        self.grants = [p for p in perms if not p.startswith("--")]
-
-    def update_users(self, engine: db.Engine) -> None:
-        _logger.info("Adding users")
-        for grant in self.grants:
-            execute_query(engine=engine, query=grant)
-        _logger.info("Updating root password")
-        query = db.text("ALTER USER {user}@localhost IDENTIFIED WITH caching_sha2_password BY '{password}'".format(
-            user=self.user,
-            password=self.password))
+        return [p for p in perms if not p.startswith("--")]
+
+    @staticmethod
+    def staging_path(dst_dir: str, name: str = "swap") -> str:
+        """
+        Extraction directory next to dst_dir, on the same filesystem
+
+        :param str dst_dir: system mysqld datadir
+        :param str name: staging directory suffix
+        """
+        return os.path.join(os.path.dirname(dst_dir.rstrip("/")), f".tempuscator-{name}")
+
+    def check_space(self, required: int) -> None:
+        """
+        Check free space on filesystem of dst_dir
+
+        :param int required: bytes needed for new datadir
+
+        :raises InsufficientSpace: not enough free space
+        """
+        free = free_space(os.path.dirname(self.dst_dir.rstrip("/")))
+        _logger.debug(f"Free space near {self.dst_dir}: {free // MB} MB, required: {required // MB} MB")
+        if free < required:
+            raise InsufficientSpace(f"{free // MB} MB free near {self.dst_dir}, {required // MB} MB required")
+
+    def stage(self) -> None:
+        """
+        Copy new datadir to filesystem of dst_dir if it is elsewhere
+
+        Runs before system mysqld is stopped, so only renames are left for downtime.
+        """
+        target_parent = os.path.dirname(self.dst_dir.rstrip("/"))
+        if same_device(self.src_dir, target_parent):
+            return
+        staged = self.staging_path(dst_dir=self.dst_dir, name=os.path.basename(self.src_dir.rstrip("/")))
+        self.check_space(tree_size(self.src_dir))
+        if os.path.exists(staged):
+            get_remover().remove(staged)
+        _logger.info(f"Copying {self.src_dir} to {staged} with {self.copy_workers} workers")
+        copy_tree(src=self.src_dir, dst=staged, workers=self.copy_workers)
+        get_remover().remove(self.src_dir)
+        self.src_dir = staged
+
+    def update_users(self, engine: db.Engine) -> List[Tuple[str, str]]:
+        """
+        Replay grants over one connection, failed grants don't stop replay
+
+        :param engine: sqlalchemy engine of new mysqld
+
+        :returns: list of failed (grant, error)
+        """
+        _logger.info(f"Adding users, {len(self.grants)} grants")
+        failed = []
+        start = time.perf_counter()
         with engine.connect() as conn:
-            conn.execute(query)
-            conn.commit()
+            # Grants are DDL with implicit commit, pyformat must not touch % in hosts
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT", no_parameters=True)
+            for grant in self.grants:
+                try:
+                    conn.exec_driver_sql(grant)
+                except db.exc.DBAPIError as e:
+                    _logger.debug(f"Grant failed: {grant}: {e.orig}")
+                    failed.append((grant, str(e.orig)))
+            duration = time.perf_counter() - start
+            _logger.info(
+                f"Replayed {len(self.grants) - len(failed)} grants in {round(duration, 2)}s, "
+                f"{round(len(self.grants) / max(duration, 0.001))} grants/s")
+            _logger.info("Updating root password")
+            conn.exec_driver_sql("ALTER USER {user}@localhost IDENTIFIED WITH caching_sha2_password BY '{password}'".format(
+                user=self.user,
+                password=self.password))
         engine.dispose()
+        if failed:
+            _logger.error(f"{len(failed)} grants failed:")
+            for grant, error in failed:
+                _logger.error(f"{grant}: {error}")
+        return failed
 
     def stop_mysqld(self) -> None:
         _logger.info("Stopping system Mysqld")
@@ -87,12 +198,19 @@ class SwapDirs():
         cli = [SYSTEMCTL_PATH]
         cli.append("stop")
         cli.append("mysqld")
+        self.stop_issued = time.perf_counter()
         exec = subprocess.Popen(cli)
         exec.communicate()
         if exec.returncode == 0:
             self.mysqld_running = False
 
     def start_mysqld(self) -> None:
+        """
+        Start system mysqld and wait until it accepts connections
+
+        :raises MysqldNotRunning: systemctl failed to start mysqld
+        :raises MysqldStartTimeout: mysqld not ready in start_timeout
+        """
         _logger.info("Starting system Mysqld")
         if self.mysqld_running:
             return
@@ -101,23 +219,83 @@ class SwapDirs():
         cli.append("mysqld")
         exec = subprocess.Popen(cli)
         exec.communicate()
-        if exec.returncode == 0:
-            self.mysqld_running = True
+        if exec.returncode != 0:
+            raise MysqldNotRunning(f"Unable to start system mysqld, systemctl exited with {exec.returncode}")
+        self.mysqld_running = True
+        self.wait_ready()
+
+    def wait_ready(self) -> None:
+        """
+        Poll system mysqld until it accepts connections and record downtime
+
+        :raises MysqldStartTimeout: mysqld not ready in start_timeout
+        """
+        url = db.engine.URL.create(
+            drivername="mysql+pymysql",
+            username=self.user or os.environ.get("USER"),
+            password=self.password,
+            host="localhost",
+            query={"unix_socket": self.socket})
+        engine = db.create_engine(url, poolclass=db.pool.NullPool)
+        started = time.perf_counter()
+        delay = 0.05
+        while True:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(db.text("SELECT 1"))
+                break
+            except db.exc.OperationalError as e:
+                code = e.orig.args[0] if e.orig and e.orig.args else None
+                if code not in CONNECT_ERRORS:
+                    _logger.debug(f"Mysqld answered with error {code}, treating as ready")
+                    break
+            if time.perf_counter() - started > self.start_timeout:
+                raise MysqldStartTimeout(f"System mysqld not ready after {self.start_timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+        self.ready = True
+        if self.stop_issued:
+            self.downtime = round(time.perf_counter() - self.stop_issued, 3)
+            _logger.info(f"System mysqld accepting connections, downtime: {self.downtime}s")
 
     def swap_dirs(self) -> None:
+        """
+        Move old directory aside and new one in place, nothing is removed here
+        """
         _logger.info("Swapping system Mysqld directories")
-        if self.backup:
-            _logger.info("Saving old directory")
-            self.__backup_old_mysqld_directory()
+        suffix = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        aside = None
         if os.path.exists(self.dst_dir):
-            _logger.debug(f"Removing {self.dst_dir}")
-            shutil.rmtree(path=self.dst_dir)
+            aside = f"{self.dst_dir}-{suffix}" if self.backup else f"{self.dst_dir}.old-{suffix}"
+            _logger.debug(f"Moving {self.dst_dir} to {aside}")
+            os.rename(self.dst_dir, aside)
         _logger.debug(f"Moving {self.src_dir} to {self.dst_dir}")
-        os.rename(self.src_dir, self.dst_dir)
-
-    def __backup_old_mysqld_directory(self) -> None:
-        _logger.debug("Creating backup of old mysqld directory")
-        backup_suffix = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        new_name = f"{self.dst_dir}-{backup_suffix}"
-        _logger.debug(f"New name: {new_name}")
-        os.rename(self.dst_dir, new_name)
+        try:
+            os.rename(self.src_dir, self.dst_dir)
+        except OSError:
+            if aside:
+                _logger.error(f"Unable to move {self.src_dir} to {self.dst_dir}, restoring {aside}")
+                os.rename(aside, self.dst_dir)
+            raise
+        if aside and self.backup:
+            _logger.info(f"Old directory saved as {aside}")
+        elif aside:
+            self.old_dir = aside
+
+    def remove_old_dir(self) -> Optional[concurrent.futures.Future]:
+        """
+        Remove previous mysqld directory in background, only after new one is up
+
+        :raises MysqldNotRunning: system mysqld isn't accepting connections, previous directory is kept
+
+        :returns: removal future or None if nothing to remove
+        """
+        if not self.old_dir:
+            return None
+        if not (self.mysqld_running and self.ready):
+            _logger.error(f"System mysqld didn't come up on new datadir, keeping previous one in {self.old_dir}")
+            raise MysqldNotRunning(f"System mysqld not running, previous datadir kept in {self.old_dir}")
+        _logger.info(f"Removing {self.old_dir} in background")
+        future = get_remover().remove(self.old_dir)
+        self.old_dir = None
+        return future
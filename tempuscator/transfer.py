@@ -0,0 +1,204 @@
+import logging
+import os
+import shlex
+import hashlib
+import time
+import threading
+import subprocess
+import concurrent.futures
+from typing import Dict, List, Tuple, Union
+from tempuscator.exceptions import UploadError
+from tempuscator.constants import SCP_PATH, SSH_PATH
+
+_logger = logging.getLogger(__name__)
+
+MB = 1 << 20
+READ_SIZE = 4 * MB
+SSH_OPTIONS = ["-o", "UserKnownHostsFile=/dev/null", "-o", "StrictHostKeyChecking=no", "-o", "Compression=no"]
+# Remote side needs GNU dd with byte offsets, sha256sum and truncate
+PROBE_COMMAND = "command -v sha256sum >/dev/null && command -v truncate >/dev/null && dd if=/dev/null of=/dev/null oflag=seek_bytes status=none"
+
+
+def file_ranges(size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """
+    Split file to (offset, length) chunks
+    """
+    return [(offset, min(chunk_size, size - offset)) for offset in range(0, size, chunk_size)]
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class ChunkedTransfer():
+    """
+    Send file over several ssh streams, each stream writes own byte range
+
+    Remote file is preallocated, chunks are written in place with dd and
+    whole file checksum is compared at the end. Failed chunks are resent,
+    plain scp is used when remote side can't write byte ranges.
+
+    :param str host: address of remote server
+    :param str user: ssh user
+    :param int streams: concurrent ssh streams
+    :param int chunk_size: bytes sent by one stream
+    :param int retries: attempts of single chunk
+    """
+
+    def __init__(
+            self,
+            host: str,
+            user: str,
+            streams: int = 4,
+            chunk_size: int = 256 * MB,
+            retries: int = 3,
+            os_user: Union[str, int] = None,
+            os_group: Union[str, int] = None) -> None:
+        self.host = host
+        self.user = user
+        self.streams = max(1, int(streams))
+        self.chunk_size = max(MB, int(chunk_size))
+        self.retries = max(1, int(retries))
+        self.os_user = os_user
+        self.os_group = os_group
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def __str__(self) -> str:
+        return f"{self.user}@{self.host}"
+
+    def _ssh(self, command: str) -> List[str]:
+        return [SSH_PATH] + SSH_OPTIONS + [f"{self.user}@{self.host}", command]
+
+    def _remote(self, command: str) -> subprocess.CompletedProcess:
+        cli = self._ssh(command)
+        _logger.debug(f"Executing: {' '.join(cli)}")
+        return subprocess.run(
+            cli,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            user=self.os_user,
+            group=self.os_group)
+
+    def probe(self) -> bool:
+        """
+        Check if remote side can receive chunks
+        """
+        return self._remote(PROBE_COMMAND).returncode == 0
+
+    def _send_chunk(self, src: str, dst: str, offset: int, length: int) -> str:
+        """
+        Write byte range of src to remote dst
+
+        :returns: sha256 of sent range
+        """
+        command = f"dd of={shlex.quote(dst)} bs={READ_SIZE} seek={offset} oflag=seek_bytes conv=notrunc status=none"
+        proc = subprocess.Popen(
+            self._ssh(command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            user=self.os_user,
+            group=self.os_group)
+        digest = hashlib.sha256()
+        try:
+            with open(src, "rb") as f:
+                f.seek(offset)
+                left = length
+                while left > 0:
+                    data = f.read(min(READ_SIZE, left))
+                    if not data:
+                        break
+                    proc.stdin.write(data)
+                    digest.update(data)
+                    left -= len(data)
+            proc.stdin.close()
+        except (BrokenPipeError, OSError) as e:
+            proc.kill()
+            proc.wait()
+            raise UploadError(f"Chunk {offset}+{length} to {self} failed: {e}")
+        proc.wait()
+        if proc.returncode != 0:
+            raise UploadError(f"Chunk {offset}+{length} to {self} failed: {proc.stderr.read().decode().strip()}")
+        with self._lock:
+            self.sent += length
+        return digest.hexdigest()
+
+    def _send_with_retry(self, src: str, dst: str, offset: int, length: int) -> str:
+        for attempt in range(1, self.retries + 1):
+            try:
+                return self._send_chunk(src=src, dst=dst, offset=offset, length=length)
+            except UploadError as e:
+                if attempt == self.retries:
+                    raise
+                _logger.warning(f"{e}, retrying {attempt}/{self.retries - 1}")
+                time.sleep(attempt)
+
+    def _send_ranges(self, src: str, dst: str, ranges: List[Tuple[int, int]]) -> Dict[int, str]:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.streams) as pool:
+            futures = {pool.submit(self._send_with_retry, src, dst, o, n): o for o, n in ranges}
+            return {futures[f]: f.result() for f in concurrent.futures.as_completed(futures)}
+
+    def _remote_sha256(self, path: str, offset: int = None, length: int = None) -> str:
+        if offset is None:
+            command = f"sha256sum {shlex.quote(path)}"
+        else:
+            command = (
+                f"dd if={shlex.quote(path)} bs={READ_SIZE} skip={offset} count={length} "
+                "iflag=skip_bytes,count_bytes status=none | sha256sum")
+        result = self._remote(command)
+        if result.returncode != 0:
+            raise UploadError(f"Unable to checksum {path} on {self}: {result.stderr.decode().strip()}")
+        return result.stdout.decode().split()[0]
+
+    def _scp(self, src: str, dst: str) -> None:
+        cli = [SCP_PATH] + SSH_OPTIONS + [src, f"{self.user}@{self.host}:{dst}"]
+        _logger.debug(f"Executing: {' '.join(cli)}")
+        upload = subprocess.run(cli, stdout=subprocess.DEVNULL, user=self.os_user, group=self.os_group)
+        if upload.returncode != 0:
+            raise UploadError(f"scp of {src} to {self} failed with code {upload.returncode}")
+
+    def send(self, src: str, dst: str) -> None:
+        """
+        Upload file, remote file appears under dst only after checksum matched
+
+        :param str src: local file
+        :param str dst: remote file path
+
+        :raises UploadError: chunks failed after retries or checksum doesn't match
+        """
+        start = time.perf_counter()
+        size = os.path.getsize(src)
+        if not self.probe():
+            _logger.warning(f"{self} can't receive chunks, falling back to scp")
+            self._scp(src=src, dst=dst)
+            return
+        part = f"{dst}.part"
+        result = self._remote(f"truncate -s {size} {shlex.quote(part)}")
+        if result.returncode != 0:
+            raise UploadError(f"Unable to create {part} on {self}: {result.stderr.decode().strip()}")
+        ranges = file_ranges(size=size, chunk_size=self.chunk_size)
+        _logger.info(f"Sending {src} to {self}:{dst} in {len(ranges)} chunks over {self.streams} streams")
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+            local_sha = pool.submit(file_sha256, src)
+            chunk_sha = self._send_ranges(src=src, dst=part, ranges=ranges)
+            local_sha = local_sha.result()
+        if self._remote_sha256(part) != local_sha:
+            broken = [(o, n) for o, n in ranges if self._remote_sha256(part, o, n) != chunk_sha[o]]
+            _logger.warning(f"Checksum of {self}:{part} doesn't match, resending {len(broken)} chunks")
+            self._send_ranges(src=src, dst=part, ranges=broken)
+            if self._remote_sha256(part) != local_sha:
+                raise UploadError(f"Checksum of {self}:{part} doesn't match after resending chunks")
+        result = self._remote(f"mv {shlex.quote(part)} {shlex.quote(dst)}")
+        if result.returncode != 0:
+            raise UploadError(f"Unable to rename {part} on {self}: {result.stderr.decode().strip()}")
+        duration = max(time.perf_counter() - start, 0.001)
+        _logger.info(f"Sent {size // MB} MB to {self} in {round(duration, 1)}s, {round(size / MB / duration, 1)} MB/s")
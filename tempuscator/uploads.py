@@ -0,0 +1,190 @@
+import logging
+import os
+import time
+import threading
+import dataclasses
+import concurrent.futures
+from typing import Callable, Dict, List
+from tempuscator.metrics import Metrics
+
+_logger = logging.getLogger(__name__)
+
+MB = 1 << 20
+
+
+@dataclasses.dataclass
+class HostStats():
+    """
+    Upload statistics of single host
+
+    :param int uploads: finished uploads
+    :param int failures: failed attempts
+    :param int bytes: bytes uploaded
+    :param float seconds: time spent in successful uploads
+    :param float next_attempt: monotonic time before which host is backed off
+    """
+    uploads: int = 0
+    failures: int = 0
+    bytes: int = 0
+    seconds: float = 0
+    next_attempt: float = 0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Average MB/s of successful uploads
+        """
+        return self.bytes / MB / self.seconds if self.seconds else 0
+
+
+class UploadScheduler():
+    """
+    Background uploads of archives to several hosts
+
+    Every archive is sent to all its hosts, at most max_concurrent uploads
+    run at once. Failed upload is retried after exponential backoff, the
+    backoff applies to the whole host. When max_backlog archives are
+    waiting, submit blocks, so slow hosts throttle new jobs instead of
+    filling the disk.
+
+    :param int max_concurrent: uploads running at the same time
+    :param int max_backlog: archives queued or uploading
+    :param int retries: attempts per host and archive
+    :param float backoff: seconds before first retry, doubled with every failure
+    :param float max_backoff: longest wait between attempts
+    :param Metrics metrics: metrics of uploads
+    """
+
+    def __init__(
+            self,
+            max_concurrent: int = 2,
+            max_backlog: int = 4,
+            retries: int = 3,
+            backoff: float = 30,
+            max_backoff: float = 600,
+            metrics: Metrics = None) -> None:
+        self.retries = max(1, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.metrics = metrics or Metrics()
+        self.stats: Dict[str, HostStats] = {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, int(max_concurrent)), thread_name_prefix="upload")
+        self._backlog = threading.BoundedSemaphore(max(1, int(max_backlog)))
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Condition(self._lock)
+
+    def _host(self, host: str) -> HostStats:
+        with self._lock:
+            return self.stats.setdefault(host, HostStats())
+
+    def submit(
+            self,
+            src: str,
+            hosts: List[str],
+            upload: Callable[[str], None],
+            done: Callable[[Dict[str, bool]], None] = None) -> None:
+        """
+        Queue archive upload to hosts, blocks while backlog is full
+
+        :param str src: local archive
+        :param list hosts: destination hosts
+        :param upload: callable uploading src to given host, raises on failure
+        :param done: called with host -> success when all hosts finished
+        """
+        if not hosts:
+            if done:
+                done({})
+            return
+        if not self._backlog.acquire(blocking=False):
+            _logger.warning("Upload backlog full, waiting for uploads to finish")
+            self._backlog.acquire()
+        size = os.path.getsize(src) if os.path.isfile(src) else 0
+        results = {}
+        remaining = [len(hosts)]
+        with self._lock:
+            self._pending += 1
+        self._gauges()
+
+        def finish(host: str, success: bool) -> None:
+            with self._lock:
+                results[host] = success
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if not last:
+                return
+            try:
+                if done:
+                    done(results)
+            except Exception as e:
+                _logger.error(f"Upload completion of {src} failed: {e}")
+            finally:
+                self._backlog.release()
+                with self._lock:
+                    self._pending -= 1
+                    self._idle.notify_all()
+                self._gauges()
+
+        _logger.info(f"Queued upload of {src} to {', '.join(hosts)}")
+        for host in hosts:
+            self._schedule(src=src, size=size, host=host, attempt=1, upload=upload, finish=finish)
+
+    def _schedule(self, src: str, size: int, host: str, attempt: int, upload: Callable[[str], None], finish) -> None:
+        delay = max(0, self._host(host).next_attempt - time.monotonic())
+        if delay:
+            _logger.info(f"Host {host} backed off, upload of {src} starts in {round(delay)}s")
+            timer = threading.Timer(delay, self._pool.submit, args=(self._run, src, size, host, attempt, upload, finish))
+            timer.daemon = True
+            timer.start()
+            return
+        self._pool.submit(self._run, src, size, host, attempt, upload, finish)
+
+    def _run(self, src: str, size: int, host: str, attempt: int, upload: Callable[[str], None], finish) -> None:
+        stats = self._host(host)
+        start = time.perf_counter()
+        try:
+            upload(host)
+        except Exception as e:
+            with self._lock:
+                stats.failures += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                stats.next_attempt = time.monotonic() + delay
+            self.metrics.inc("upload_failures_total", help="Failed upload attempts", host=host)
+            if attempt >= self.retries:
+                _logger.error(f"Upload of {src} to {host} failed after {attempt} attempts: {e}")
+                finish(host, False)
+                return
+            _logger.warning(f"Upload of {src} to {host} failed ({e}), retry {attempt}/{self.retries - 1} in {round(delay)}s")
+            self._schedule(src=src, size=size, host=host, attempt=attempt + 1, upload=upload, finish=finish)
+            return
+        duration = time.perf_counter() - start
+        with self._lock:
+            stats.uploads += 1
+            stats.bytes += size
+            stats.seconds += duration
+            stats.next_attempt = 0
+        self.metrics.inc("upload_bytes_total", size, help="Bytes uploaded", host=host)
+        self.metrics.gauge("upload_throughput_bytes", size / max(duration, 0.001), "Throughput of last upload", host=host)
+        _logger.info(
+            f"Uploaded {src} to {host}: {size // MB} MB in {round(duration, 1)}s, "
+            f"{round(size / MB / max(duration, 0.001), 1)} MB/s, host average {round(stats.throughput, 1)} MB/s")
+        finish(host, True)
+
+    def _gauges(self) -> None:
+        self.metrics.gauge("upload_backlog", self.pending(), "Archives waiting for or being uploaded")
+
+    def pending(self) -> int:
+        """
+        Archives not uploaded to all hosts yet
+        """
+        with self._lock:
+            return self._pending
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until all queued archives are uploaded
+
+        :returns: False if timeout expired first
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending == 0, timeout=timeout)
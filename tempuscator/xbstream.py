@@ -0,0 +1,107 @@
+import logging
+import struct
+import dataclasses
+from typing import BinaryIO, Iterator, Optional
+from tempuscator.exceptions import BackupFileCorrupt
+from tempuscator.constants import XBSTREAM_MAGIC
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_PAYLOAD = b"P"
+CHUNK_SPARSE = b"S"
+CHUNK_EOF = b"E"
+
+
+@dataclasses.dataclass(frozen=True)
+class Chunk():
+    """
+    Single xbstream chunk header
+
+    :param str path: file path inside archive
+    :param bytes type: chunk type, payload, sparse or eof
+    :param int offset: offset of payload inside extracted file
+    :param int length: payload length
+    :param int position: position of payload inside stream
+    """
+    path: str
+    type: bytes
+    offset: int = 0
+    length: int = 0
+    position: int = 0
+
+
+class XbstreamReader():
+    """
+    Minimal xbstream header reader, payloads are skipped unless requested
+
+    :param stream: binary file object opened for reading, should be seekable
+    """
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self.stream = stream
+
+    def _read(self, size: int) -> bytes:
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise BackupFileCorrupt("Unexpected end of xbstream")
+        return data
+
+    def _skip(self, size: int) -> None:
+        if self.stream.seekable():
+            self.stream.seek(size, 1)
+            return
+        while size > 0:
+            size -= len(self._read(min(size, 1 << 20)))
+
+    def chunks(self, limit: Optional[int] = None) -> Iterator[Chunk]:
+        """
+        Iterate over chunk headers
+
+        :param int limit: stop after this many chunks
+
+        :returns: iterator of Chunk
+        """
+        count = 0
+        while limit is None or count < limit:
+            magic = self.stream.read(len(XBSTREAM_MAGIC))
+            if not magic:
+                return
+            if magic != XBSTREAM_MAGIC:
+                raise BackupFileCorrupt("Wrong xbstream chunk magic")
+            _flags, c_type, path_len = struct.unpack("<ccI", self._read(6))
+            path = self._read(path_len).decode()
+            count += 1
+            if c_type == CHUNK_EOF:
+                yield Chunk(path=path, type=c_type)
+                continue
+            sparse_map = 0
+            if c_type == CHUNK_SPARSE:
+                sparse_map = struct.unpack("<I", self._read(4))[0]
+            length, offset, _checksum = struct.unpack("<QQI", self._read(20))
+            if sparse_map:
+                self._skip(sparse_map * 8)
+            position = self.stream.tell() if self.stream.seekable() else 0
+            yield Chunk(path=path, type=c_type, offset=offset, length=length, position=position)
+            if self.stream.seekable():
+                self.stream.seek(position + length)
+            else:
+                self._skip(length)
+
+    def read_file(self, path: str, limit: Optional[int] = None) -> Optional[bytes]:
+        """
+        Read small file payload from stream
+
+        :param str path: file path inside archive
+        :param int limit: stop looking after this many chunks
+
+        :returns: file content or None if not found
+        """
+        data = None
+        for chunk in self.chunks(limit=limit):
+            if chunk.path != path:
+                continue
+            if chunk.type == CHUNK_EOF:
+                break
+            self.stream.seek(chunk.position)
+            data = (data or b"") + self._read(chunk.length)
+        return data
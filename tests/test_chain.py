@@ -0,0 +1,85 @@
+import struct
+import pytest
+from tempuscator import chain
+from tempuscator.chain import BackupChain, read_checkpoints
+from tempuscator.constants import XBSTREAM_MAGIC
+from tempuscator.exceptions import ChainError
+
+FULL = {"backup_type": "full-backuped", "from_lsn": "0", "to_lsn": "100"}
+
+
+def incremental(from_lsn: int, to_lsn: int) -> dict:
+    return {"backup_type": "incremental", "from_lsn": str(from_lsn), "to_lsn": str(to_lsn)}
+
+
+def write_archive(path, files: dict) -> None:
+    with open(path, "wb") as f:
+        for name, data in files.items():
+            encoded = name.encode()
+            f.write(XBSTREAM_MAGIC + struct.pack("<ccI", b"\0", b"P", len(encoded)) + encoded)
+            f.write(struct.pack("<QQI", len(data), 0, 0) + data)
+
+
+@pytest.fixture
+def based_chain(tmp_path):
+    backup_chain = BackupChain(directory=str(tmp_path / "chain"))
+    (tmp_path / "chain" / "base").mkdir()
+    (tmp_path / "chain" / "base" / "ibdata1").write_text("base")
+    backup_chain.record(source="/backups/full.xbs", checkpoints=FULL)
+    return backup_chain
+
+
+def test_read_checkpoints(tmp_path):
+    archive = tmp_path / "backup.xbs"
+    write_archive(archive, {"ibdata1": b"x" * 10, "xtrabackup_checkpoints": b"backup_type = incremental\nfrom_lsn = 5\nto_lsn = 9\n"})
+    assert read_checkpoints(str(archive)) == incremental(5, 9)
+
+
+def test_read_compressed_checkpoints(tmp_path, monkeypatch):
+    monkeypatch.setitem(chain.METADATA_CODECS, ".qp", ["/bin/cat"])
+    archive = tmp_path / "backup.xbs"
+    write_archive(archive, {"ibdata1.qp": b"x", "xtrabackup_checkpoints.qp": b"to_lsn = 9\n"})
+    assert read_checkpoints(str(archive)) == {"to_lsn": "9"}
+
+
+def test_archive_without_checkpoints(tmp_path):
+    archive = tmp_path / "backup.xbs"
+    write_archive(archive, {"ibdata1": b"x"})
+    assert read_checkpoints(str(archive)) is None
+
+
+def test_incremental_requires_base(tmp_path):
+    backup_chain = BackupChain(directory=str(tmp_path))
+    backup_chain.check(FULL)
+    with pytest.raises(ChainError):
+        backup_chain.check(incremental(100, 200))
+
+
+def test_incremental_must_continue_chain(based_chain):
+    based_chain.check(incremental(100, 200))
+    with pytest.raises(ChainError):
+        based_chain.check(incremental(150, 200))
+    with pytest.raises(ChainError):
+        based_chain.check({"backup_type": "incremental", "to_lsn": "200"})
+
+
+def test_record_survives_reload(based_chain):
+    based_chain.record(source="/backups/inc1.xbs", checkpoints=incremental(100, 200))
+    reloaded = BackupChain(directory=based_chain.directory)
+    assert reloaded.to_lsn == 200
+    assert [b["source"] for b in reloaded.state["backups"]] == ["full.xbs", "inc1.xbs"]
+    reloaded.record(source="/backups/full2.xbs", checkpoints=FULL)
+    assert [b["source"] for b in reloaded.state["backups"]] == ["full2.xbs"]
+
+
+def test_invalidate(based_chain):
+    based_chain.invalidate()
+    assert BackupChain(directory=based_chain.directory).to_lsn is None
+    with pytest.raises(ChainError):
+        based_chain.materialize(target="/nonexistent")
+
+
+def test_materialize(based_chain, tmp_path):
+    target = tmp_path / "work"
+    based_chain.materialize(target=str(target))
+    assert (target / "ibdata1").read_text() == "base"
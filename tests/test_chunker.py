@@ -0,0 +1,39 @@
+import pytest
+from tempuscator.chunker import RangeChunker
+
+
+@pytest.fixture
+def chunker():
+    return RangeChunker(chunk_rows=1000)
+
+
+def test_parse_update(chunker):
+    assert chunker.parse("UPDATE users SET email = 'x' WHERE id > 10;") == (
+        "UPDATE users SET email = 'x'", "users", "users", "id > 10")
+
+
+def test_parse_update_alias_without_where(chunker):
+    assert chunker.parse("UPDATE shop.users u SET u.email = NULL") == (
+        "UPDATE shop.users u SET u.email = NULL", "shop.users", "u", None)
+
+
+def test_parse_delete(chunker):
+    assert chunker.parse("DELETE FROM `logs` WHERE created < NOW()") == (
+        "DELETE FROM `logs`", "`logs`", "`logs`", "created < NOW()")
+
+
+@pytest.mark.parametrize("query", [
+    "UPDATE a JOIN b ON a.id = b.id SET a.x = b.x",
+    "UPDATE a SET x = (SELECT 1)",
+    "DELETE FROM a ORDER BY id LIMIT 10",
+    "DELETE a FROM a USING a, b",
+    "INSERT INTO a VALUES (1)",
+    "UPDATE a SET note = 'see WHERE clause' WHERE id = 1",
+])
+def test_parse_unsupported(chunker, query):
+    assert chunker.parse(query) is None
+
+
+def test_chunk_rows_must_be_positive():
+    with pytest.raises(ValueError):
+        RangeChunker(chunk_rows=0)
@@ -0,0 +1,103 @@
+import os
+import shutil
+import struct
+import pytest
+from tempuscator.constants import XBSTREAM_MAGIC
+from tempuscator.datacache import PreparedCache, backup_fingerprint
+from tempuscator.fscopy import tree_size
+
+
+def write_archive(path, files: dict) -> None:
+    with open(path, "wb") as f:
+        for name, data in files.items():
+            encoded = name.encode()
+            f.write(XBSTREAM_MAGIC + struct.pack("<ccI", b"\0", b"P", len(encoded)) + encoded)
+            f.write(struct.pack("<QQI", len(data), 0, 0) + data)
+
+
+def backup(path, uuid: str, to_lsn: int = 100) -> str:
+    write_archive(path, {
+        "ibdata1": os.urandom(64),
+        "xtrabackup_checkpoints": f"backup_type = full-backuped\nfrom_lsn = 0\nto_lsn = {to_lsn}\n".encode(),
+        "xtrabackup_info": f"uuid = {uuid}\n".encode(),
+    })
+    return str(path)
+
+
+def datadir(path, size: int) -> str:
+    path.mkdir()
+    (path / "ibdata1").write_bytes(b"d" * size)
+    (path / "xtrabackup_info").write_text("uuid = x\n")
+    return str(path)
+
+
+@pytest.fixture
+def entry_size(tmp_path):
+    return tree_size(datadir(tmp_path / "sample", 300))
+
+
+@pytest.fixture
+def cache(tmp_path, entry_size):
+    # Room for three datadirs of 300 bytes, sizes are allocated blocks
+    return PreparedCache(directory=str(tmp_path / "cache"), max_size=entry_size * 3)
+
+
+def test_fingerprint_follows_backup_identity(tmp_path):
+    first = backup(tmp_path / "a.xbs", uuid="u1")
+    copy = shutil.copy(first, tmp_path / "copy.xbs")
+    assert backup_fingerprint(first) == backup_fingerprint(str(copy))
+    assert backup_fingerprint(first) != backup_fingerprint(backup(tmp_path / "b.xbs", uuid="u2"))
+    assert backup_fingerprint(first) != backup_fingerprint(backup(tmp_path / "c.xbs", uuid="u1", to_lsn=200))
+
+
+def test_no_key_without_metadata(tmp_path, cache):
+    archive = tmp_path / "a.xbs"
+    write_archive(archive, {"ibdata1": b"x"})
+    assert cache.key(str(archive)) is None
+    (tmp_path / "junk").write_bytes(b"not xbstream")
+    assert cache.key(str(tmp_path / "junk")) is None
+
+
+def test_key_depends_on_variant(tmp_path, cache):
+    archive = backup(tmp_path / "a.xbs", uuid="u1")
+    assert cache.key(archive) == cache.key(archive)
+    assert cache.key(archive) != cache.key(archive, variant="shop.*")
+
+
+def test_store_and_clone(tmp_path, cache):
+    target = tmp_path / "work"
+    assert not cache.clone(key="k1", target=str(target))
+    cache.store(key="k1", source=datadir(tmp_path / "prepared", 100))
+    assert cache.clone(key="k1", target=str(target))
+    assert (target / "ibdata1").read_bytes() == b"d" * 100
+    # Metadata files are shared, data files are private copies
+    assert os.stat(target / "xtrabackup_info").st_nlink == 2
+    assert os.stat(target / "ibdata1").st_nlink == 1
+
+
+def test_store_skipped_while_locked(tmp_path, cache):
+    source = datadir(tmp_path / "prepared", 100)
+    with cache._lock("k1", exclusive=True):
+        cache.store(key="k1", source=source)
+    assert cache.entries() == []
+
+
+def test_too_large_entry_not_stored(tmp_path, cache, entry_size):
+    cache.store(key="k1", source=datadir(tmp_path / "prepared", entry_size * 4))
+    assert cache.entries() == []
+
+
+def test_least_recently_used_evicted(tmp_path, cache):
+    for n in range(3):
+        cache.store(key=f"k{n}", source=datadir(tmp_path / f"prepared{n}", 300))
+    cache.clone(key="k0", target=str(tmp_path / "work"))
+    cache.store(key="k3", source=datadir(tmp_path / "prepared3", 300))
+    assert sorted(k for k, _ in cache.entries()) == ["k0", "k2", "k3"]
+
+
+def test_entry_in_use_not_evicted(tmp_path, cache):
+    for n in range(3):
+        cache.store(key=f"k{n}", source=datadir(tmp_path / f"prepared{n}", 300))
+    with cache._lock("k0"):
+        cache.store(key="k3", source=datadir(tmp_path / "prepared3", 300))
+    assert sorted(k for k, _ in cache.entries()) == ["k0", "k2", "k3"]
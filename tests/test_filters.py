@@ -0,0 +1,95 @@
+import re
+import pytest
+from tempuscator.filters import SchemaFilter, decode_name, split_patterns
+from tempuscator.sqlscript import Statement
+
+
+@pytest.fixture
+def shop():
+    return SchemaFilter(include=["shop", "crm.customers"], exclude=["shop.log_*"])
+
+
+def test_split_patterns():
+    assert split_patterns(" shop, crm.customers ,,") == ["shop", "crm.customers"]
+    assert split_patterns(None) == []
+
+
+def test_decode_name():
+    assert decode_name("my@002ddb") == "my-db"
+    assert decode_name("plain") == "plain"
+
+
+def test_disabled_filter_selects_everything():
+    f = SchemaFilter()
+    assert not f.enabled
+    assert f.table_selected("any", "table")
+    assert f.tables_regex() is None
+    assert f.tables_exclude_regex() is None
+
+
+def test_schema_and_table_selection(shop):
+    assert shop.enabled
+    assert shop.schema_selected("shop")
+    assert shop.schema_selected("crm")
+    assert shop.schema_selected("mysql")
+    assert not shop.schema_selected("billing")
+    assert shop.table_selected("shop", "orders")
+    assert not shop.table_selected("shop", "log_2024")
+    assert shop.table_selected("crm", "customers")
+    assert not shop.table_selected("crm", "leads")
+    assert shop.table_selected("mysql", "user")
+
+
+def test_excluded_schema():
+    f = SchemaFilter(exclude=["archive"])
+    assert not f.schema_selected("archive")
+    assert not f.table_selected("archive", "orders")
+    assert f.table_selected("shop", "orders")
+
+
+@pytest.mark.parametrize("path, selected", [
+    ("ibdata1", True),
+    ("undo_001", True),
+    ("xtrabackup_checkpoints", True),
+    ("#innodb_redo/#ib_redo1", True),
+    ("shop/orders.ibd", True),
+    ("shop/orders.ibd.zst", True),
+    ("shop/orders.ibd.qp", True),
+    ("shop/log_2024.ibd", False),
+    ("shop/log_2024.ibd.lz4", False),
+    ("shop/db.opt", True),
+    ("crm/customers#P#p0.ibd", True),
+    ("crm/leads#P#p0.ibd", False),
+    ("crm/db.opt", True),
+    ("billing/invoices.ibd", False),
+    ("billing/db.opt", False),
+    ("mysql/user.ibd", True),
+])
+def test_path_selected(shop, path, selected):
+    assert shop.path_selected(path) is selected
+
+
+def test_encoded_path():
+    f = SchemaFilter(include=["my-db"])
+    assert f.path_selected("my@002ddb/t@002d1.ibd")
+    assert not f.path_selected("other/t.ibd")
+
+
+def test_statement_selected(shop):
+    assert shop.statement_selected(Statement.parse("UPDATE shop.orders SET x = 1"))
+    assert not shop.statement_selected(Statement.parse("UPDATE billing.invoices SET x = 1"))
+    assert shop.statement_selected(Statement.parse("UPDATE invoices SET x = 1"))
+    assert shop.statement_selected(Statement.parse("SET @x = 1"))
+
+
+def test_xtrabackup_regexes(shop):
+    tables = re.compile(shop.tables_regex())
+    exclude = re.compile(shop.tables_exclude_regex())
+    assert tables.match("shop.orders")
+    assert tables.match("crm.customers")
+    assert tables.match("mysql.user")
+    assert not tables.match("crm.leads")
+    assert not tables.match("shopping.orders")
+    assert not tables.match("crmXcustomers")
+    assert exclude.match("shop.log_2024")
+    assert not exclude.match("shop.orders")
@@ -0,0 +1,125 @@
+import json
+import threading
+from tempuscator.jobs import Job, JobQueue, STATE_DONE, STATE_FAILED, STATE_RUNNING
+
+
+def write_job(path, job: Job) -> None:
+    with open(path / f"{job.id}.json", "w") as f:
+        json.dump(job.__dict__, f)
+
+
+def run_queue(path, **kwargs):
+    handled = []
+    lock = threading.Lock()
+
+    def handler(job):
+        with lock:
+            handled.append(job.backup)
+
+    jobs = JobQueue(path=str(path), handler=handler, **kwargs)
+    jobs.start()
+    jobs.stop()
+    return jobs, handled
+
+
+def test_submit_and_process(tmp_path):
+    handled = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def handler(job):
+        started.set()
+        release.wait(5)
+        handled.append(job.backup)
+
+    jobs = JobQueue(path=str(tmp_path), handler=handler)
+    jobs.start()
+    job = jobs.submit(backup="/backups/a.xbs", action="obfuscate")
+    assert started.wait(5)
+    assert jobs.submit(backup="/backups/a.xbs", action="obfuscate") is job
+    assert jobs.depth() == 1
+    release.set()
+    jobs.stop()
+    assert handled == ["/backups/a.xbs"]
+    assert jobs.jobs[job.id].state == STATE_DONE
+    assert jobs.depth() == 0
+
+
+def test_unfinished_jobs_requeued_on_reload(tmp_path):
+    queued = Job(id=JobQueue.job_id("/b/queued.xbs"), backup="/b/queued.xbs", action="obfuscate")
+    running = Job(id=JobQueue.job_id("/b/running.xbs"), backup="/b/running.xbs", action="swap", state=STATE_RUNNING, attempts=1)
+    done = Job(id=JobQueue.job_id("/b/done.xbs"), backup="/b/done.xbs", action="obfuscate", state=STATE_DONE, finished=1)
+    for job in (queued, running, done):
+        write_job(tmp_path, job)
+    jobs, handled = run_queue(tmp_path)
+    assert sorted(handled) == ["/b/queued.xbs", "/b/running.xbs"]
+    assert jobs.jobs[running.id].attempts == 2
+    assert jobs.jobs[done.id].state == STATE_DONE
+
+
+def test_failed_jobs_requeued_only_when_asked(tmp_path):
+    backup = tmp_path / "failed.xbs"
+    backup.write_bytes(b"")
+    missing = str(tmp_path / "missing.xbs")
+    queue_dir = tmp_path / "queue"
+    queue_dir.mkdir()
+    for path in (str(backup), missing):
+        write_job(queue_dir, Job(id=JobQueue.job_id(path), backup=path, action="obfuscate", state=STATE_FAILED, error="boom"))
+    _, handled = run_queue(queue_dir)
+    assert handled == []
+    jobs, handled = run_queue(queue_dir, retry_failed=True)
+    assert handled == [str(backup)]
+    assert jobs.jobs[JobQueue.job_id(missing)].state == STATE_FAILED
+
+
+def test_failed_handler_marks_job_failed(tmp_path):
+    def handler(job):
+        raise RuntimeError("broken backup")
+
+    jobs = JobQueue(path=str(tmp_path), handler=handler)
+    jobs.start()
+    job = jobs.submit(backup="/b/a.xbs", action="obfuscate")
+    jobs.stop()
+    assert job.state == STATE_FAILED
+    assert job.error == "broken backup"
+    with open(tmp_path / f"{job.id}.json") as f:
+        assert json.load(f)["state"] == STATE_FAILED
+
+
+def test_new_upload_under_same_name_queued_again(tmp_path):
+    backup = tmp_path / "backup.xbs"
+    backup.write_bytes(b"first")
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handler(job):
+        handled.append(backup.read_bytes())
+        started.set()
+        release.wait(5)
+
+    jobs = JobQueue(path=str(tmp_path / "queue"), handler=handler)
+    jobs.start()
+    first = jobs.submit(backup=str(backup), action="obfuscate")
+    assert started.wait(5)
+    replacement = tmp_path / "upload.tmp"
+    replacement.write_bytes(b"second upload")
+    replacement.rename(backup)
+    second = jobs.submit(backup=str(backup), action="obfuscate")
+    assert second is not first
+    assert not first.current()
+    assert second.current()
+    release.set()
+    jobs.stop()
+    assert handled == [b"first", b"second upload"]
+
+
+def test_waiting_job_takes_replaced_file(tmp_path):
+    backup = tmp_path / "backup.xbs"
+    backup.write_bytes(b"first")
+    jobs = JobQueue(path=str(tmp_path / "queue"), handler=lambda job: None)
+    job = jobs.submit(backup=str(backup), action="obfuscate")
+    backup.write_bytes(b"second upload")
+    assert jobs.submit(backup=str(backup), action="obfuscate") is job
+    assert job.current()
+    assert jobs.depth() == 1
@@ -0,0 +1,37 @@
+from tempuscator.journal import StageJournal, file_fingerprint
+
+
+def test_disabled_journal():
+    journal = StageJournal()
+    journal.complete("extract")
+    assert not journal.done("extract")
+    assert not journal.exists()
+
+
+def test_stages_survive_reload(tmp_path):
+    fingerprint = {"path": "/backup.xbs", "size": 1, "mtime": 1}
+    journal = StageJournal(directory=str(tmp_path), fingerprint=fingerprint)
+    assert not journal.exists()
+    journal.complete("extract")
+    assert journal.exists()
+    resumed = StageJournal(directory=str(tmp_path), fingerprint=fingerprint)
+    assert resumed.done("extract")
+    assert not resumed.done("prepare")
+    assert not resumed.stale
+
+
+def test_changed_input_makes_journal_stale(tmp_path):
+    StageJournal(directory=str(tmp_path), fingerprint={"size": 1}).complete("extract")
+    journal = StageJournal(directory=str(tmp_path), fingerprint={"size": 2})
+    assert journal.stale
+    assert not journal.done("extract")
+    journal.reset()
+    assert not journal.stale
+    assert StageJournal(directory=str(tmp_path), fingerprint={"size": 2}).stages == {}
+
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / "backup.xbs"
+    assert file_fingerprint(str(path)) is None
+    path.write_bytes(b"data")
+    assert file_fingerprint(str(path))["size"] == 4
@@ -0,0 +1,64 @@
+import json
+import contextlib
+import pytest
+from tempuscator.planner import CostPlanner, statement_digest
+from tempuscator.sqlscript import Statement
+
+
+class FakeEngine():
+    @contextlib.contextmanager
+    def connect(self):
+        yield None
+
+
+def group(*seconds: float):
+    return [Statement.parse(f"UPDATE t SET x = {s} /* {n} */") for n, s in enumerate(seconds)]
+
+
+@pytest.fixture
+def planner(tmp_path):
+    groups = [group(3), group(5), group(1, 1), group(4), group(3)]
+    history = {statement_digest(st.sql): {"seconds": float(st.sql.split()[5]), "rows": 10} for g in groups for st in g}
+    path = tmp_path / "history.json"
+    path.write_text(json.dumps({"statements": history}))
+    return CostPlanner(history=str(path)), groups
+
+
+def test_longest_processing_time_first(planner):
+    cost_planner, groups = planner
+    slots = cost_planner.plan(engine=FakeEngine(), groups=groups, workers=2)
+    assert [s.cost for s in slots] == [5, 4, 3, 3, 2]
+    assert [(s.worker, s.start) for s in slots] == [(0, 0), (1, 0), (1, 4), (0, 5), (1, 7)]
+    assert max(s.end for s in slots) == 9
+
+
+def test_single_worker_runs_everything_serially(planner):
+    cost_planner, groups = planner
+    slots = cost_planner.plan(engine=FakeEngine(), groups=groups, workers=1)
+    assert {s.worker for s in slots} == {0}
+    assert max(s.end for s in slots) == 17
+
+
+def test_describe(planner):
+    cost_planner, groups = planner
+    text = CostPlanner.describe(cost_planner.plan(engine=FakeEngine(), groups=groups, workers=2))
+    assert "Estimated makespan: 9.0s" in text
+    assert "Busiest worker: 1, 9.0s in 3 groups, longest group 4.0s" in text
+    assert CostPlanner.describe([]) == "Nothing to schedule"
+
+
+def test_rate_learned_from_history(tmp_path):
+    path = tmp_path / "history.json"
+    path.write_text(json.dumps({"statements": {"a": {"seconds": 2, "rows": 1000}, "b": {"seconds": 2, "rows": 3000}}}))
+    assert CostPlanner(history=str(path)).rate == 1000
+
+
+def test_save_merges_history(tmp_path):
+    path = str(tmp_path / "history.json")
+    first = CostPlanner(history=path)
+    second = CostPlanner(history=path)
+    first.save({"a": (1.0, 10)})
+    second.save({"b": (2.0, 20)})
+    with open(path) as f:
+        assert json.load(f)["statements"] == {"a": {"seconds": 1.0, "rows": 10}, "b": {"seconds": 2.0, "rows": 20}}
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["history.json", "history.json.lock"]
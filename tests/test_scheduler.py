@@ -0,0 +1,100 @@
+import time
+import threading
+import pytest
+from tempuscator import scheduler
+from tempuscator.exceptions import MaskingError
+from tempuscator.scheduler import MaskScheduler, ORDER_SERIAL
+from tempuscator.sqlscript import Statement
+
+
+def st(sql: str) -> Statement:
+    return Statement.parse(sql)
+
+
+class FakeEngine():
+    def dispose(self) -> None:
+        pass
+
+
+class Recorder():
+    """
+    Stands in for execute_query, records order and concurrency of queries
+    """
+
+    def __init__(self, delay: float = 0.02, fail: str = None) -> None:
+        self.delay = delay
+        self.fail = fail
+        self.executed = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, engine, query: str, dispose: bool = True) -> int:
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.delay)
+        with self._lock:
+            self.running -= 1
+            self.executed.append(query)
+        if query == self.fail:
+            raise RuntimeError("masking failed")
+        return 1
+
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = Recorder()
+    monkeypatch.setattr(scheduler, "execute_query", recorder)
+    return recorder
+
+
+def test_groups_by_shared_tables():
+    statements = [
+        st("UPDATE a SET x = 1"),
+        st("UPDATE b SET y = 1"),
+        st("UPDATE c JOIN a ON a.id = c.id SET c.z = a.x"),
+        st("UPDATE d SET w = 1"),
+        st("UPDATE b SET y = 2"),
+    ]
+    groups = MaskScheduler(workers=2).groups(statements)
+    assert [[s.sql for s in g] for g in groups] == [
+        ["UPDATE a SET x = 1", "UPDATE c JOIN a ON a.id = c.id SET c.z = a.x"],
+        ["UPDATE b SET y = 1", "UPDATE b SET y = 2"],
+        ["UPDATE d SET w = 1"],
+    ]
+
+
+def test_groups_merged_transitively():
+    statements = [st("UPDATE a SET x = 1"), st("UPDATE b SET y = 1"), st("INSERT INTO a SELECT * FROM b")]
+    assert len(MaskScheduler().groups(statements)) == 1
+
+
+def test_serial_order_single_group():
+    statements = [st("UPDATE a SET x = 1"), st("UPDATE b SET y = 1")]
+    assert MaskScheduler(order=ORDER_SERIAL).groups(statements) == [statements]
+    assert MaskScheduler(order=ORDER_SERIAL).groups([]) == []
+
+
+def test_unknown_order():
+    with pytest.raises(ValueError):
+        MaskScheduler(order="random")
+
+
+def test_run_keeps_table_order_and_caps_concurrency(recorder):
+    statements = [st(f"UPDATE t{n % 4} SET x = {n}") for n in range(12)]
+    MaskScheduler(workers=4, max_in_flight=2).run(engine=FakeEngine(), statements=statements)
+    assert sorted(recorder.executed) == sorted(s.sql for s in statements)
+    for table in range(4):
+        ours = [q for q in recorder.executed if q.startswith(f"UPDATE t{table} ")]
+        assert ours == [s.sql for s in statements if s.sql.startswith(f"UPDATE t{table} ")]
+    assert recorder.peak == 2
+
+
+def test_run_reports_failed_queries(recorder):
+    recorder.fail = "UPDATE a SET x = 1"
+    statements = [st("UPDATE a SET x = 1"), st("UPDATE a SET x = 2"), st("UPDATE b SET y = 1")]
+    with pytest.raises(MaskingError):
+        MaskScheduler(workers=2).run(engine=FakeEngine(), statements=statements)
+    # Failure doesn't stop rest of the group
+    assert sorted(recorder.executed) == sorted(s.sql for s in statements)
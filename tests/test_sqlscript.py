@@ -0,0 +1,74 @@
+import pytest
+from tempuscator.exceptions import SqlScriptError
+from tempuscator.sqlscript import parse_script, query_tables, split_statements
+
+
+def split(script: str):
+    return list(split_statements(script.splitlines(keepends=True)))
+
+
+def test_split_statements():
+    script = (
+        "UPDATE a SET x = 1;\n"
+        "-- comment; not a statement\n"
+        "UPDATE b SET y = 'semi;colon', z = \"q\"\"uote\";  # trailing\n"
+        "/* block; comment */ DELETE FROM c\n"
+        "WHERE id > 1;\n")
+    assert split(script) == [
+        "UPDATE a SET x = 1",
+        "UPDATE b SET y = 'semi;colon', z = \"q\"\"uote\"",
+        "DELETE FROM c\nWHERE id > 1",
+    ]
+
+
+def test_split_keeps_executable_comments():
+    assert split("/*!40101 SET NAMES utf8 */;\nSELECT /*+ MAX_EXECUTION_TIME(1) */ 1;\n") == [
+        "/*!40101 SET NAMES utf8 */",
+        "SELECT /*+ MAX_EXECUTION_TIME(1) */ 1",
+    ]
+
+
+def test_split_delimiter_command():
+    script = (
+        "DELIMITER //\n"
+        "CREATE PROCEDURE p() BEGIN UPDATE a SET x = 1; END//\n"
+        "DELIMITER ;\n"
+        "CALL p();\n")
+    assert split(script) == ["CREATE PROCEDURE p() BEGIN UPDATE a SET x = 1; END", "CALL p()"]
+
+
+def test_split_without_delimiter_by_lines():
+    assert split("UPDATE a SET x = 1\nDELETE FROM b\n\nSET @v = 1\n") == [
+        "UPDATE a SET x = 1",
+        "DELETE FROM b",
+        "SET @v = 1",
+    ]
+
+
+def test_split_without_delimiter_multiline_statement():
+    assert split("UPDATE a\nSET x = 1\nWHERE id = 2\n") == ["UPDATE a\nSET x = 1\nWHERE id = 2"]
+
+
+@pytest.mark.parametrize("script", ["UPDATE a SET x = 'open;\n", "/* never closed\n", "SELECT `a;\n"])
+def test_split_unterminated(script):
+    with pytest.raises(SqlScriptError):
+        split(script)
+
+
+def test_parse_script():
+    statements = parse_script([
+        "UPDATE shop.users u JOIN `orders` o ON o.user_id = u.id SET u.email = NULL;\n",
+        "DELETE FROM logs WHERE id IN (SELECT id FROM old_logs);\n",
+        "INSERT INTO audit SELECT * FROM users;\n",
+    ])
+    assert [s.kind for s in statements] == ["UPDATE", "DELETE", "INSERT"]
+    assert [s.tables for s in statements] == [
+        ["orders", "shop.users"],
+        ["logs", "old_logs"],
+        ["audit", "users"],
+    ]
+
+
+def test_query_tables_ignores_expressions():
+    query = "UPDATE users u SET u.email = TRIM(BOTH ' ' FROM u.email), u.code = SUBSTRING(u.code FROM 2)"
+    assert query_tables(query) == {"users"}
@@ -0,0 +1,78 @@
+import io
+import os
+import stat
+import time
+import pytest
+from tempuscator import streamer
+from tempuscator.streamer import RemoteSink, StreamTee
+
+# Runs remote command locally, host named slow doesn't read its stream for a while
+FAKE_SSH = """#!/bin/sh
+for last; do :; done
+case "$*" in *@slow*) sleep 3 </dev/null;; esac
+exec sh -c "$last"
+"""
+CHUNK = 64 << 10
+
+
+@pytest.fixture(autouse=True)
+def local_ssh(tmp_path, monkeypatch):
+    ssh = tmp_path / "ssh"
+    ssh.write_text(FAKE_SSH)
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(streamer, "SSH_PATH", str(ssh))
+
+
+def test_stream_to_all_sinks(tmp_path):
+    data = os.urandom(CHUNK * 10 + 5)
+    local = io.BytesIO()
+    sinks = [RemoteSink(host=h, user="test", dst=str(tmp_path / h)) for h in ("a", "b")]
+    assert StreamTee(sinks=sinks, local=local, chunk_size=CHUNK).run(io.BytesIO(data)) == []
+    assert local.getvalue() == data
+    for h in ("a", "b"):
+        assert (tmp_path / h).read_bytes() == data
+        assert not (tmp_path / f"{h}.part").exists()
+
+
+class SlowStream():
+    """
+    Stream producing chunk every millisecond, like running xtrabackup
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self._data = io.BytesIO(data)
+
+    def read(self, size: int) -> bytes:
+        time.sleep(0.001)
+        return self._data.read(size)
+
+
+def test_slow_sink_spills_to_local_file(tmp_path):
+    data = os.urandom(CHUNK * 200)
+    fast = RemoteSink(host="fast", user="test", dst=str(tmp_path / "fast"), buffer_chunks=4)
+    slow = RemoteSink(host="slow", user="test", dst=str(tmp_path / "slow"), buffer_chunks=4)
+    with open(tmp_path / "local", "wb") as local:
+        failed = StreamTee(sinks=[fast, slow], local=local, chunk_size=CHUNK).run(SlowStream(data))
+    assert failed == []
+    assert slow.spill_offset is not None
+    assert fast.spill_offset is None
+    assert (tmp_path / "fast").read_bytes() == data
+    assert (tmp_path / "slow").read_bytes() == data
+
+
+def test_slow_sink_detached_without_local_file(tmp_path):
+    data = os.urandom(CHUNK * 200)
+    fast = RemoteSink(host="fast", user="test", dst=str(tmp_path / "fast"), buffer_chunks=4)
+    slow = RemoteSink(host="slow", user="test", dst=str(tmp_path / "slow"), buffer_chunks=4)
+    start = time.monotonic()
+    failed = StreamTee(sinks=[fast, slow], chunk_size=CHUNK).run(SlowStream(data))
+    assert time.monotonic() - start < 3
+    assert failed == [slow]
+    assert (tmp_path / "fast").read_bytes() == data
+    assert not (tmp_path / "slow").exists()
+
+
+def test_failed_remote_command(tmp_path):
+    sink = RemoteSink(host="a", user="test", dst=str(tmp_path / "missing" / "archive"))
+    assert StreamTee(sinks=[sink], chunk_size=CHUNK).run(io.BytesIO(b"data")) == [sink]
+    assert not (tmp_path / "missing").exists()
@@ -0,0 +1,81 @@
+import os
+import pytest
+from tempuscator import swapper as swapper_module
+from tempuscator.exceptions import MysqldNotRunning
+from tempuscator.swapper import SwapDirs
+
+
+def make_swapper(src_dir: str, dst_dir: str, backup: bool = False) -> SwapDirs:
+    # Skip __post_init__, it needs running system mysqld
+    swapper = SwapDirs.__new__(SwapDirs)
+    swapper.src_dir = src_dir
+    swapper.dst_dir = dst_dir
+    swapper.backup = backup
+    swapper.mysqld_running = False
+    swapper.old_dir = None
+    swapper.ready = False
+    swapper.stop_issued = None
+    swapper.downtime = None
+    return swapper
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    src = tmp_path / "new"
+    dst = tmp_path / "mysql"
+    src.mkdir()
+    dst.mkdir()
+    (src / "ibdata1").write_text("new")
+    (dst / "ibdata1").write_text("old")
+    return src, dst
+
+
+def test_swap_dirs(dirs):
+    src, dst = dirs
+    swapper = make_swapper(str(src), str(dst))
+    swapper.swap_dirs()
+    assert (dst / "ibdata1").read_text() == "new"
+    assert not src.exists()
+    assert open(os.path.join(swapper.old_dir, "ibdata1")).read() == "old"
+
+
+def test_swap_dirs_restores_old_dir(dirs, monkeypatch):
+    src, dst = dirs
+    rename = os.rename
+
+    def failing_rename(a, b):
+        if a == str(src):
+            raise OSError("rename failed")
+        rename(a, b)
+
+    monkeypatch.setattr(swapper_module.os, "rename", failing_rename)
+    swapper = make_swapper(str(src), str(dst))
+    with pytest.raises(OSError):
+        swapper.swap_dirs()
+    assert (dst / "ibdata1").read_text() == "old"
+    assert sorted(os.listdir(dst.parent)) == ["mysql", "new"]
+    assert swapper.old_dir is None
+
+
+def test_old_dir_kept_when_mysqld_fails_to_start(dirs, monkeypatch):
+    src, dst = dirs
+    monkeypatch.setattr(swapper_module, "SYSTEMCTL_PATH", "/bin/false")
+    swapper = make_swapper(str(src), str(dst))
+    swapper.swap_dirs()
+    with pytest.raises(MysqldNotRunning):
+        swapper.start_mysqld()
+    with pytest.raises(MysqldNotRunning):
+        swapper.remove_old_dir()
+    assert os.path.isdir(swapper.old_dir)
+
+
+def test_old_dir_removed_when_mysqld_ready(dirs):
+    src, dst = dirs
+    swapper = make_swapper(str(src), str(dst))
+    swapper.swap_dirs()
+    old_dir = swapper.old_dir
+    swapper.mysqld_running = True
+    swapper.ready = True
+    swapper.remove_old_dir().result()
+    assert not os.path.exists(old_dir)
+    assert swapper.old_dir is None
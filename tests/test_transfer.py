@@ -0,0 +1,60 @@
+import os
+import stat
+import pytest
+from tempuscator import transfer
+from tempuscator.transfer import ChunkedTransfer, MB, file_ranges, file_sha256
+
+# Runs remote command locally, the last argument is the command
+FAKE_SSH = """#!/bin/sh
+for last; do :; done
+exec sh -c "$last"
+"""
+
+
+@pytest.fixture
+def local_ssh(tmp_path, monkeypatch):
+    ssh = tmp_path / "ssh"
+    ssh.write_text(FAKE_SSH)
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(transfer, "SSH_PATH", str(ssh))
+    return ssh
+
+
+def test_file_ranges_cover_file():
+    assert file_ranges(size=10, chunk_size=4) == [(0, 4), (4, 4), (8, 2)]
+    assert file_ranges(size=8, chunk_size=4) == [(0, 4), (4, 4)]
+    assert file_ranges(size=3, chunk_size=4) == [(0, 3)]
+    assert file_ranges(size=0, chunk_size=4) == []
+
+
+def test_send_writes_file(tmp_path, local_ssh):
+    src = tmp_path / "archive.xbs"
+    src.write_bytes(os.urandom(3 * MB + 123))
+    dst = tmp_path / "remote" / "archive.xbs"
+    dst.parent.mkdir()
+    ChunkedTransfer(host="localhost", user="test", streams=2, chunk_size=MB).send(src=str(src), dst=str(dst))
+    assert file_sha256(str(dst)) == file_sha256(str(src))
+    assert not os.path.exists(f"{dst}.part")
+
+
+def test_send_resends_broken_chunk(tmp_path, local_ssh, monkeypatch):
+    src = tmp_path / "archive.xbs"
+    src.write_bytes(os.urandom(3 * MB))
+    dst = tmp_path / "remote.xbs"
+    part = f"{dst}.part"
+    sent = []
+    send_chunk = ChunkedTransfer._send_chunk
+
+    def corrupting_send(self, src, dst, offset, length):
+        digest = send_chunk(self, src=src, dst=dst, offset=offset, length=length)
+        sent.append(offset)
+        if offset == MB and sent.count(offset) == 1:
+            with open(part, "r+b") as f:
+                f.seek(offset)
+                f.write(b"\0" * 16)
+        return digest
+
+    monkeypatch.setattr(ChunkedTransfer, "_send_chunk", corrupting_send)
+    ChunkedTransfer(host="localhost", user="test", streams=3, chunk_size=MB).send(src=str(src), dst=str(dst))
+    assert sorted(sent) == [0, MB, MB, 2 * MB]
+    assert file_sha256(str(dst)) == file_sha256(str(src))
@@ -0,0 +1,79 @@
+import time
+import threading
+from tempuscator.uploads import UploadScheduler
+
+
+class FlakyUpload():
+    """
+    Upload failing given number of times per host, records attempt times
+    """
+
+    def __init__(self, failures: dict) -> None:
+        self.failures = dict(failures)
+        self.attempts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, host: str) -> None:
+        with self._lock:
+            self.attempts.setdefault(host, []).append(time.monotonic())
+            left = self.failures.get(host, 0)
+            self.failures[host] = left - 1
+        if left > 0:
+            raise OSError(f"{host} unreachable")
+
+
+def submit(scheduler: UploadScheduler, src: str, hosts: list, upload) -> dict:
+    results = {}
+    finished = threading.Event()
+
+    def done(res):
+        results.update(res)
+        finished.set()
+
+    scheduler.submit(src=src, hosts=hosts, upload=upload, done=done)
+    assert finished.wait(10)
+    return results
+
+
+def test_retry_until_success(tmp_path):
+    src = tmp_path / "archive.xbs"
+    src.write_bytes(b"x" * 1024)
+    upload = FlakyUpload(failures={"a": 2})
+    scheduler = UploadScheduler(retries=3, backoff=0.01)
+    assert submit(scheduler, str(src), ["a", "b"], upload) == {"a": True, "b": True}
+    assert len(upload.attempts["a"]) == 3
+    assert len(upload.attempts["b"]) == 1
+    assert scheduler.stats["a"].failures == 2
+    assert scheduler.stats["a"].uploads == 1
+    assert scheduler.stats["a"].bytes == 1024
+    assert scheduler.wait(timeout=5)
+    assert scheduler.pending() == 0
+
+
+def test_gives_up_after_retries(tmp_path):
+    src = tmp_path / "archive.xbs"
+    src.write_bytes(b"x")
+    upload = FlakyUpload(failures={"a": 10})
+    scheduler = UploadScheduler(retries=2, backoff=0.01)
+    assert submit(scheduler, str(src), ["a"], upload) == {"a": False}
+    assert len(upload.attempts["a"]) == 2
+    assert scheduler.stats["a"].uploads == 0
+
+
+def test_backoff_doubles_and_is_capped(tmp_path):
+    src = tmp_path / "archive.xbs"
+    src.write_bytes(b"x")
+    upload = FlakyUpload(failures={"a": 3})
+    scheduler = UploadScheduler(retries=4, backoff=0.1, max_backoff=0.15)
+    assert submit(scheduler, str(src), ["a"], upload) == {"a": True}
+    times = upload.attempts["a"]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    assert gaps[0] >= 0.1
+    assert gaps[1] >= 0.15
+    assert gaps[2] < 0.35
+
+
+def test_no_hosts_finishes_immediately(tmp_path):
+    results = []
+    UploadScheduler().submit(src=str(tmp_path / "missing"), hosts=[], upload=None, done=results.append)
+    assert results == [{}]
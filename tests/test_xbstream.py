@@ -0,0 +1,86 @@
+import io
+import struct
+import pytest
+from tempuscator.constants import XBSTREAM_MAGIC
+from tempuscator.exceptions import BackupFileCorrupt
+from tempuscator.xbstream import CHUNK_EOF, CHUNK_PAYLOAD, CHUNK_SPARSE, Chunk, XbstreamReader
+
+
+def payload(path: str, data: bytes, offset: int = 0) -> bytes:
+    name = path.encode()
+    header = XBSTREAM_MAGIC + struct.pack("<ccI", b"\0", CHUNK_PAYLOAD, len(name)) + name
+    return header + struct.pack("<QQI", len(data), offset, 0) + data
+
+
+def sparse(path: str, data: bytes, holes: list) -> bytes:
+    name = path.encode()
+    header = XBSTREAM_MAGIC + struct.pack("<ccI", b"\0", CHUNK_SPARSE, len(name)) + name + struct.pack("<I", len(holes))
+    sparse_map = b"".join(struct.pack("<II", skip, length) for skip, length in holes)
+    return header + struct.pack("<QQI", len(data), 0, 0) + sparse_map + data
+
+
+def eof(path: str) -> bytes:
+    name = path.encode()
+    return XBSTREAM_MAGIC + struct.pack("<ccI", b"\0", CHUNK_EOF, len(name)) + name
+
+
+class Unseekable(io.RawIOBase):
+    def __init__(self, data: bytes) -> None:
+        self._data = io.BytesIO(data)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._data.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+STREAM = (
+    payload("ibdata1", b"a" * 10)
+    + payload("ibdata1", b"b" * 5, offset=10)
+    + eof("ibdata1")
+    + sparse("db/t.ibd", b"c" * 4, holes=[(0, 4)])
+    + payload("xtrabackup_checkpoints", b"to_lsn = 1\n")
+    + eof("xtrabackup_checkpoints"))
+
+
+def test_chunk_headers():
+    chunks = list(XbstreamReader(io.BytesIO(STREAM)).chunks())
+    assert [(c.path, c.type, c.offset, c.length) for c in chunks] == [
+        ("ibdata1", CHUNK_PAYLOAD, 0, 10),
+        ("ibdata1", CHUNK_PAYLOAD, 10, 5),
+        ("ibdata1", CHUNK_EOF, 0, 0),
+        ("db/t.ibd", CHUNK_SPARSE, 0, 4),
+        ("xtrabackup_checkpoints", CHUNK_PAYLOAD, 0, 11),
+        ("xtrabackup_checkpoints", CHUNK_EOF, 0, 0),
+    ]
+    assert STREAM[chunks[3].position:chunks[3].position + 4] == b"cccc"
+
+
+def test_chunk_limit():
+    assert list(XbstreamReader(io.BytesIO(STREAM)).chunks(limit=1)) == [
+        Chunk(path="ibdata1", type=CHUNK_PAYLOAD, offset=0, length=10, position=len(payload("ibdata1", b"")))]
+
+
+def test_unseekable_stream():
+    chunks = list(XbstreamReader(io.BufferedReader(Unseekable(STREAM))).chunks())
+    assert [c.path for c in chunks] == [c.path for c in XbstreamReader(io.BytesIO(STREAM)).chunks()]
+
+
+def test_read_file():
+    reader = XbstreamReader(io.BytesIO(STREAM))
+    assert reader.read_file("ibdata1") == b"a" * 10 + b"b" * 5
+    assert XbstreamReader(io.BytesIO(STREAM)).read_file("xtrabackup_checkpoints") == b"to_lsn = 1\n"
+    assert XbstreamReader(io.BytesIO(STREAM)).read_file("missing") is None
+
+
+def test_wrong_magic():
+    with pytest.raises(BackupFileCorrupt):
+        list(XbstreamReader(io.BytesIO(b"NOTXBSTR" + STREAM)).chunks())
+
+
+def test_truncated_header():
+    with pytest.raises(BackupFileCorrupt):
+        list(XbstreamReader(io.BytesIO(STREAM[:len(XBSTREAM_MAGIC) + 3])).chunks())